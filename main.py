@@ -10,6 +10,7 @@ import sys
 
 from argparse import ArgumentParser
 from src.forensics.forensics import Forensics
+from src.forensics.service import ForensicsService
 
 if __name__ == '__main__':
     # Main entry point for the forensics microservice
@@ -17,6 +18,9 @@ if __name__ == '__main__':
     # Args expected:
     #    --run_id - The ID of the supervisor run request.
     #    --run_dir - The name of the target directory to use for operations
+    #
+    # or:
+    #    --service - Run as a long-lived service taking run requests from the FORENSICS_SPOOL_DIR directory
 
     # init the return value
     ret_val: int = 0
@@ -27,15 +31,22 @@ if __name__ == '__main__':
     # create a command line parser
     parser = ArgumentParser()
 
-    parser.add_argument('--run_id', default=None, help='The run identifier.', type=str, required=True)
-    parser.add_argument('--run_dir', default=None, help='The name of the run directory to use for the staging operations.', type=str,
-                        required=True)
+    parser.add_argument('--run_id', default=None, help='The run identifier.', type=str)
+    parser.add_argument('--run_dir', default=None, help='The name of the run directory to use for the staging operations.', type=str)
+    parser.add_argument('--service', action='store_true', help='Run as a service processing run requests from the spool directory.')
 
     # collect the params
     args = parser.parse_args()
 
+    # the run params are required unless running as a service
+    if not args.service and (args.run_id is None or args.run_dir is None):
+        parser.error('the following arguments are required: --run_id, --run_dir')
+
     # validate the inputs
-    if args.run_dir == '':
+    if args.service:
+        # process run requests until told to stop
+        ret_val: int = ForensicsService(forensics_obj).serve()
+    elif args.run_dir == '':
         # missing 1 or more params
         ret_val: int = -2
     else:
@@ -0,0 +1,403 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Benchmark of the forensics pipeline.
+
+    Synthetic JUnit XML reports are generated into a temporary run directory
+    and the hot paths are timed against the in-process stand-in for the
+    irods-sv DB (IRODS_SV_DB_BACKEND=fake), so neither test fixtures nor a live
+    DB are needed and the real statement, Json binding and COPY code is timed:
+     - parse_test_reports: the reports parsed and the summary persisted, end to end,
+     - parse_file_stream/parse_file_dom: each report parsed, with its error/failure capture, in this process in each parse mode,
+     - update_run_results: the summary persisted,
+     - update_run_details: the error/failure details streamed in with COPY and the summary headers persisted.
+
+    Each stage is run --repeat times and the median time is kept. Throughput
+    is reported in MB/s of report data and testcases/s, along with the peak
+    RSS of this process and of any parse worker processes. The parse mode and
+    number of parse workers are set here rather than taken from the
+    environment so the results do not depend on the machine's CPU count.
+
+    The results can be saved as a baseline (--save-baseline) and later runs
+    checked against it (--check), which exits with 1 if a stage is more than
+    --tolerance slower than the baseline or uses that much more memory, and
+    also more than --noise-floor seconds (--rss-floor MB) worse, so timer and
+    scheduling noise on the short stages is not reported as a regression.
+
+    usage: python -m src.benchmarks.forensics_benchmark [--files 200] [--testcases 200] [--failure-ratio 0.1] [--text-size 2048] [--check]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import statistics
+import tempfile
+import resource
+from argparse import ArgumentParser
+from functools import partial
+from xml.sax.saxutils import escape, quoteattr
+
+from src.common.pg_fake import FakeSupervisorDB
+from src.forensics.forensics import Forensics
+from src.forensics.report_parser import ReportParser
+
+
+class ReportGenerator:
+    """
+    Class that generates synthetic JUnit XML test reports
+
+    """
+
+    def __init__(self, testcases: int = 200, failure_ratio: float = 0.1, text_size: int = 2048, seed: int = 1):
+        """
+        Init the report generator
+
+        :param testcases: The number of testcases in each report.
+        :param failure_ratio: The fraction of the testcases that fail. A third of those are errors rather than failures.
+        :param text_size: The number of characters in each failure's text.
+        :param seed: The random seed, so the reports are the same every time.
+        """
+        # save the params
+        self.testcases: int = testcases
+        self.failure_ratio: float = failure_ratio
+        self.text_size: int = text_size
+
+        # create the random generator
+        self.random: random.Random = random.Random(seed)
+
+    def get_text(self, suite_name: str, name: str) -> str:
+        """
+        Gets a traceback like failure text of about text_size characters.
+
+        :param suite_name: The test suite name.
+        :param name: The testcase name.
+        :return: The text.
+        """
+        # build a traceback with some run specific noise in it
+        line: str = f'  File "/tmp/tmp{self.random.randrange(16 ** 8):08x}/{suite_name}.py", line {self.random.randint(1, 2000)}, in {name}\n'
+
+        # return to the caller
+        return (line * (self.text_size // len(line) + 1))[:self.text_size]
+
+    def get_report(self, suite_name: str) -> str:
+        """
+        Gets a test report.
+
+        :param suite_name: The test suite name.
+        :return: The XML report.
+        """
+        # init the testcase elements and counts
+        testcases: list = []
+        failures: int = 0
+        errors: int = 0
+
+        # for each testcase
+        for index in range(self.testcases):
+            # get the testcase details
+            name: str = f'test_{index}'
+            duration: float = round(self.random.expovariate(2), 3)
+
+            # does this one fail
+            if self.random.random() < self.failure_ratio:
+                # a third of them are errors
+                tag: str = 'error' if self.random.random() < 1 / 3 else 'failure'
+
+                # count it
+                if tag == 'error':
+                    errors += 1
+                else:
+                    failures += 1
+
+                # add the testcase with the failure
+                testcases.append(f'<testcase classname="{suite_name}" name="{name}" time="{duration}">'
+                                 f'<{tag} message={quoteattr(f"object at 0x{self.random.randrange(16 ** 12):012x} failed")} '
+                                 f'type="AssertionError">{escape(self.get_text(suite_name, name))}</{tag}>'
+                                 f'<system-out>output of {name}</system-out></testcase>')
+            else:
+                testcases.append(f'<testcase classname="{suite_name}" name="{name}" time="{duration}"/>')
+
+        # return to the caller
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n<testsuite name="{suite_name}" tests="{self.testcases}" errors="{errors}" '
+                f'failures="{failures}" skipped="0">{"".join(testcases)}</testsuite>')
+
+    def generate(self, test_reports_dir: str, files: int) -> tuple:
+        """
+        Writes the test reports.
+
+        :param test_reports_dir: The directory to write the reports to.
+        :param files: The number of reports.
+        :return: A tuple of the total size of the reports in bytes and the total number of testcases.
+        """
+        # init the total size
+        total_bytes: int = 0
+
+        # make sure the directory exists
+        os.makedirs(test_reports_dir, exist_ok=True)
+
+        # for each report
+        for index in range(files):
+            # get the report
+            data: bytes = self.get_report(f'test_suite_{index}').encode('utf-8')
+
+            # write it out
+            with open(os.path.join(test_reports_dir, f'report_{index}.xml'), 'wb') as fp:
+                fp.write(data)
+
+            # count it
+            total_bytes += len(data)
+
+        # return to the caller
+        return total_bytes, files * self.testcases
+
+
+class ForensicsBenchmark:
+    """
+    Class that times the forensics pipeline
+
+    """
+
+    def __init__(self, files: int, generator: ReportGenerator, repeat: int = 5, parse_mode: str = 'stream', workers: int = 1):
+        """
+        Init the benchmark
+
+        :param files: The number of reports to generate.
+        :param generator: The report generator.
+        :param repeat: The number of times each stage is run, the median time is kept.
+        :param parse_mode: The report parse mode.
+        :param workers: The number of parse worker processes.
+        """
+        # save the params
+        self.files: int = files
+        self.generator: ReportGenerator = generator
+        self.repeat: int = repeat
+        self.parse_mode: str = parse_mode
+        self.workers: int = workers
+
+    @staticmethod
+    def get_peak_rss_mb() -> dict:
+        """
+        Gets the peak resident memory of this process and of its finished child processes.
+
+        :return: A dict of the peak RSS in MB.
+        """
+        # ru_maxrss is in KB on linux
+        return {'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)}
+
+    @staticmethod
+    def parse_reports(report_parser: ReportParser, file_paths: list) -> list:
+        """
+        Parses the reports one at a time in this process.
+
+        :param report_parser: The parser.
+        :param file_paths: The paths to the reports.
+        :return: The test suite name and summary data of each report.
+        """
+        # return to the caller
+        return [report_parser.parse_file(file_path) for file_path in file_paths]
+
+    def time_stage(self, stage) -> float:
+        """
+        Runs a stage repeatedly.
+
+        :param stage: The function to time.
+        :return: The median time in seconds.
+        """
+        # init the times
+        times: list = []
+
+        # run the stage
+        for _ in range(self.repeat):
+            start: float = time.perf_counter()
+
+            stage()
+
+            times.append(time.perf_counter() - start)
+
+        # return to the caller
+        return statistics.median(times)
+
+    def run(self) -> dict:
+        """
+        Runs the benchmark.
+
+        :return: The results.
+        """
+        # create a place for the run
+        work_dir: str = tempfile.mkdtemp(prefix='forensics-benchmark-')
+
+        try:
+            # keep the logging out of the way unless asked for
+            os.environ.setdefault('LOG_LEVEL', '30')
+            os.environ.setdefault('LOG_PATH', work_dir)
+
+            # generate the reports
+            full_run_dir: str = os.path.join(work_dir, 'run')
+            test_reports_dir: str = os.path.join(full_run_dir, 'test-reports')
+
+            total_bytes, total_testcases = self.generator.generate(test_reports_dir, self.files)
+
+            # use the stand-in DB, it never makes sense to benchmark against a live one
+            os.environ['IRODS_SV_DB_BACKEND'] = 'fake'
+
+            for param, value in (('USERNAME', 'benchmark'), ('PASSWORD', ''), ('DATABASE', 'irods-sv'), ('HOST', 'localhost'), ('PORT', '5432')):
+                os.environ.setdefault(f'IRODS_SV_DB_{param}', value)
+
+            # create the forensics object and get the stand-in DB it uses
+            forensics: Forensics = Forensics()
+            fake_db: FakeSupervisorDB = FakeSupervisorDB.get_instance('irods-sv')
+
+            # use the parse settings being measured, not the ones in the environment
+            forensics.report_parser.parse_mode = self.parse_mode
+            forensics.report_parser.workers = self.workers
+
+            # init the results
+            ret_val: dict = {'config': {'files': self.files, 'testcases': self.generator.testcases, 'failure_ratio': self.generator.failure_ratio,
+                                        'text_size': self.generator.text_size, 'parse_mode': forensics.report_parser.parse_mode,
+                                        'parse_workers': forensics.report_parser.workers},
+                             'data': {'mb': round(total_bytes / 1024 / 1024, 3), 'testcases': total_testcases}, 'stages': {}}
+
+            # time the parsing and persisting of the reports end to end
+            ret_val['stages']['parse_test_reports'] = self.time_stage(lambda: forensics.parse_test_reports('1', full_run_dir))
+
+            # time the parser on its own in each mode, in this process so the worker pool does not hide it
+            file_paths: list = [os.path.join(test_reports_dir, file) for file in sorted(os.listdir(test_reports_dir))]
+
+            for parse_mode in ReportParser.PARSE_MODES:
+                report_parser: ReportParser = ReportParser(parse_mode, 1, group_failures=forensics.report_parser.group_failures,
+                                                           text_limiter=forensics.report_parser.text_limiter)
+
+                ret_val['stages'][f'parse_file_{parse_mode}'] = self.time_stage(partial(self.parse_reports, report_parser, file_paths))
+
+            # get the run summary and time persisting it
+            _, run_summary = forensics.collect_test_reports(full_run_dir)
+
+            forensics.settings = forensics.settings._replace(stream_details=False)
+
+            ret_val['stages']['update_run_results'] = self.time_stage(lambda: forensics.persist_run_summary('1', run_summary))
+
+            # get the size of the summary saved
+            payload_bytes: int = fake_db.db.execute("SELECT LENGTH(results) FROM run_results WHERE run_id = '1'").fetchone()[0]
+
+            # time streaming the details in separately
+            forensics.settings = forensics.settings._replace(stream_details=True)
+
+            ret_val['stages']['update_run_details'] = self.time_stage(lambda: forensics.persist_run_summary('1', run_summary))
+
+            # work out the throughput of each stage
+            for stage, seconds in ret_val['stages'].items():
+                ret_val['stages'][stage] = {'seconds': round(seconds, 4), 'mb_per_s': round(ret_val['data']['mb'] / seconds, 2) if seconds else 0,
+                                            'testcases_per_s': round(total_testcases / seconds) if seconds else 0}
+
+            # stop the parse workers, if any, so their memory is counted
+            ReportParser.shutdown_pool()
+
+            # add the payload size and the memory used
+            ret_val['data']['payload_mb'] = round(payload_bytes / 1024 / 1024, 3)
+            ret_val['peak_rss_mb'] = self.get_peak_rss_mb()
+        finally:
+            # clean up
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        # return to the caller
+        return ret_val
+
+    @staticmethod
+    def check(results: dict, baseline: dict, tolerance: float, noise_floor: float = 0.05, rss_floor: float = 16.0) -> list:
+        """
+        Compares the results with the baseline.
+
+        :param results: The benchmark results.
+        :param baseline: The baseline results.
+        :param tolerance: The fraction slower (or bigger) than the baseline that is allowed.
+        :param noise_floor: The number of seconds slower than the baseline that is always allowed.
+        :param rss_floor: The number of MB bigger than the baseline that is always allowed.
+        :return: The list of regressions found.
+        """
+        # init the return value
+        ret_val: list = []
+
+        # the numbers are only comparable on the same workload
+        if results['config'] != baseline['config']:
+            return [f'The benchmark config {results["config"]} does not match the baseline config {baseline["config"]}']
+
+        # compare the stage times
+        for stage, stage_results in results['stages'].items():
+            # get the baseline time
+            baseline_seconds: float = baseline['stages'].get(stage, {}).get('seconds', 0)
+
+            # is it slower than allowed
+            if baseline_seconds and stage_results['seconds'] > max(baseline_seconds * (1 + tolerance), baseline_seconds + noise_floor):
+                ret_val.append(f'{stage}: {stage_results["seconds"]}s vs the baseline {baseline_seconds}s')
+
+        # compare the memory used
+        for process, peak_rss in results['peak_rss_mb'].items():
+            # get the baseline memory
+            baseline_rss: float = baseline['peak_rss_mb'].get(process, 0)
+
+            # is it bigger than allowed
+            if baseline_rss and peak_rss > max(baseline_rss * (1 + tolerance), baseline_rss + rss_floor):
+                ret_val.append(f'peak RSS ({process}): {peak_rss}MB vs the baseline {baseline_rss}MB')
+
+        # return to the caller
+        return ret_val
+
+
+if __name__ == '__main__':
+    # create a command line parser
+    parser = ArgumentParser(description='Benchmarks the forensics pipeline on synthetic test reports.')
+
+    parser.add_argument('--files', default=200, type=int, help='The number of test reports.')
+    parser.add_argument('--testcases', default=200, type=int, help='The number of testcases in each report.')
+    parser.add_argument('--failure-ratio', default=0.1, type=float, help='The fraction of the testcases that fail.')
+    parser.add_argument('--text-size', default=2048, type=int, help='The number of characters in each failure text.')
+    parser.add_argument('--repeat', default=5, type=int, help='The number of times each stage is run, the median time is kept.')
+    parser.add_argument('--parse-mode', default='stream', choices=('dom', 'stream'), help='The report parse mode.')
+    parser.add_argument('--workers', default=1, type=int, help='The number of parse worker processes.')
+    parser.add_argument('--seed', default=1, type=int, help='The random seed for the report generator.')
+    parser.add_argument('--baseline', default=os.path.join(os.path.dirname(__file__), 'baseline.json'), help='The baseline file.')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the baseline.')
+    parser.add_argument('--check', action='store_true', help='Check the results against the baseline.')
+    parser.add_argument('--tolerance', default=0.25, type=float, help='The fraction slower than the baseline allowed by --check.')
+    parser.add_argument('--noise-floor', default=0.05, type=float, help='The number of seconds slower than the baseline always allowed.')
+    parser.add_argument('--rss-floor', default=16.0, type=float, help='The number of MB more memory than the baseline always allowed.')
+
+    # collect the params
+    args = parser.parse_args()
+
+    # init the exit code
+    exit_code: int = 0
+
+    # run the benchmark
+    benchmark_results: dict = ForensicsBenchmark(args.files, ReportGenerator(args.testcases, args.failure_ratio, args.text_size, args.seed),
+                                                 args.repeat, args.parse_mode, args.workers).run()
+
+    # output the results
+    print(json.dumps(benchmark_results, indent=2))
+
+    # save the baseline if requested
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_fp:
+            json.dump(benchmark_results, baseline_fp, indent=2)
+            baseline_fp.write('\n')
+
+    # check against the baseline if requested
+    if args.check:
+        # load the baseline
+        with open(args.baseline, encoding='utf-8') as baseline_fp:
+            regressions: list = ForensicsBenchmark.check(benchmark_results, json.load(baseline_fp), args.tolerance, args.noise_floor,
+                                                                 args.rss_floor)
+
+        # report the regressions
+        for regression in regressions:
+            print(f'REGRESSION: {regression}', file=sys.stderr)
+
+        # fail if there were any
+        exit_code = 1 if regressions else 0
+
+    # exit with the final exit code
+    sys.exit(exit_code)
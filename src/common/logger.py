@@ -9,18 +9,46 @@
 """
 
 import os
+import copy
+import json
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+import contextvars
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+# the context fields added to the log records, e.g. the run id, the executor and the stage
+log_context: contextvars.ContextVar = contextvars.ContextVar('log_context', default={})
 
 
 class LoggingUtil:
     """
     creates and configures a logger
+
+    With LOG_ASYNC=true the console and file output is done on a background
+    thread. Log calls only put the record on a queue of LOG_QUEUE_SIZE records
+    (default 10000); when it is full a record is dropped (LOG_QUEUE_POLICY=drop,
+    the default) or the caller waits for room (LOG_QUEUE_POLICY=block). The
+    queued records are written out when the process exits.
+
+    LOG_FORMAT overrides the line format asked for, e.g. LOG_FORMAT=json writes
+    each record as a JSON object with the context fields set with set_context().
     """
+    # the background log writers, by logger name
+    listeners: dict = {}
+
+    # the lock used when starting and stopping them
+    listeners_lock: threading.Lock = threading.Lock()
+
     @staticmethod
-    def init_logging(name, level=logging.INFO, line_format='short', log_file_path=None):
+    def init_logging(name, level=logging.INFO, line_format='short', log_file_path=None, async_mode=None):
         """
             Logging utility controlling format and setting initial logging level
+
+            :param line_format: One of minimum, short, medium, long or json. LOG_FORMAT overrides it.
+            :param async_mode: True to write the log output on a background thread, None to use LOG_ASYNC.
         """
         # get a new logger
         logger = logging.getLogger(__name__)
@@ -29,15 +57,21 @@ class LoggingUtil:
         if not logger.parent.name == 'root':
             return logger
 
-        # define the various output formats
-        format_type = {"minimum": '%(message)s', "short": '%(funcName)s(): %(message)s', "medium": '%(asctime)-15s - %(funcName)s(): %(message)s',
-                       "long": '%(asctime)-15s  - %(filename)s %(funcName)s() %(levelname)s: %(message)s'}[line_format]
+        # use the format in the environment if there is one
+        line_format = os.getenv('LOG_FORMAT', line_format)
 
         # create a stream handler (default to console)
         stream_handler = logging.StreamHandler()
 
         # create a formatter
-        formatter = logging.Formatter(format_type)
+        if line_format == 'json':
+            formatter = JsonFormatter()
+        else:
+            # define the various output formats
+            format_type = {"minimum": '%(message)s', "short": '%(funcName)s(): %(message)s', "medium": '%(asctime)-15s - %(funcName)s(): %(message)s',
+                           "long": '%(asctime)-15s  - %(filename)s %(funcName)s() %(levelname)s: %(message)s'}[line_format]
+
+            formatter = logging.Formatter(format_type)
 
         # set the formatter on the console stream
         stream_handler.setFormatter(formatter)
@@ -51,6 +85,13 @@ class LoggingUtil:
         # dont allow message propagation
         logger.propagate = False
 
+        # add the log context to the records as they are made, i.e. on the calling thread
+        if not any(isinstance(log_filter, ContextFilter) for log_filter in logger.filters):
+            logger.addFilter(ContextFilter())
+
+        # init the output handlers
+        handlers: list = []
+
         # if there was a file path passed in use it
         if log_file_path is not None:
             # create a rotating file handler, 100mb max per file with a max number of 10 files
@@ -62,15 +103,114 @@ class LoggingUtil:
             # set the log level
             file_handler.setLevel(level)
 
-            # add the handler to the logger
-            logger.addHandler(file_handler)
+            # add the handler to the output
+            handlers.append(file_handler)
+
+        # add the console handler to the output
+        handlers.append(stream_handler)
 
-        # add the console handler to the logger
-        logger.addHandler(stream_handler)
+        # is the output to be written in the background
+        if async_mode is None:
+            async_mode = os.getenv('LOG_ASYNC', 'false').lower() == 'true'
+
+        if async_mode:
+            # give the output handlers to a background writer, the logger only gets a handler that queues the records
+            LoggingUtil.start_listener(logger, handlers)
+        else:
+            # add the output handlers to the logger
+            for handler in handlers:
+                logger.addHandler(handler)
 
         # return to the caller
         return logger
 
+    @staticmethod
+    def start_listener(logger: logging.Logger, handlers: list):
+        """
+        Starts writing the output of a logger on a background thread.
+
+        :param logger: The logger.
+        :param handlers: The output handlers.
+        :return:
+        """
+        # create the queue and the handler that feeds it
+        queue_handler = BoundedQueueHandler(queue.Queue(int(os.getenv('LOG_QUEUE_SIZE', '10000'))), os.getenv('LOG_QUEUE_POLICY', 'drop'))
+
+        # create the background writer
+        listener = BoundedQueueListener(queue_handler, *handlers)
+
+        with LoggingUtil.listeners_lock:
+            # stop any writer started for this logger before
+            if logger.name in LoggingUtil.listeners:
+                LoggingUtil.stop_listener(logger.name)
+
+            # make sure the queued records are written out on exit
+            if not LoggingUtil.listeners:
+                atexit.register(LoggingUtil.stop_listeners)
+
+            # send the records to the queue
+            logger.addHandler(queue_handler)
+
+            # start writing
+            listener.start()
+
+            # save the writer
+            LoggingUtil.listeners[logger.name] = (logger, listener)
+
+    @staticmethod
+    def stop_listener(name: str):
+        """
+        Stops the background writer of a logger after the queued records are written. The caller holds the listeners lock.
+
+        :param name: The logger name.
+        :return:
+        """
+        # get the logger and its writer
+        logger, listener = LoggingUtil.listeners.pop(name)
+
+        # stop taking records
+        logger.removeHandler(listener.queue_handler)
+
+        # write out what is queued
+        listener.stop()
+
+        # report anything dropped at the end
+        listener.report_dropped(logger.name)
+
+    @staticmethod
+    def stop_listeners():
+        """
+        Stops all the background writers after the queued records are written.
+
+        :return:
+        """
+        with LoggingUtil.listeners_lock:
+            for name in list(LoggingUtil.listeners):
+                LoggingUtil.stop_listener(name)
+
+    @staticmethod
+    def set_context(**fields) -> contextvars.Token:
+        """
+        Adds fields to the log context of the current thread (or task), e.g. set_context(run_id='123').
+
+        Threads started with a copy of the context get the fields too, and their changes stay in their copy.
+
+        :param fields: The fields to add.
+        :return: A token that reset_context() uses to put back the context as it was before.
+        """
+        # return to the caller
+        return log_context.set({**log_context.get(), **fields})
+
+    @staticmethod
+    def reset_context(token: contextvars.Token):
+        """
+        Puts back the log context as it was before set_context() returned the token.
+
+        :param token: The token.
+        :return:
+        """
+        log_context.reset(token)
+
     @staticmethod
     def prep_for_logging() -> (int, str):
         """
@@ -87,3 +227,177 @@ class LoggingUtil:
 
         # return to the caller
         return log_level, log_path
+
+
+class ContextFilter(logging.Filter):
+    """
+    Class that adds the log context fields to the log records
+
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Adds the current log context to a record.
+
+        :param record: The log record.
+        :return: True, all records are kept.
+        """
+        # save the context, it is not copied as a new dict is set on each change
+        record.context = log_context.get()
+
+        # return to the caller
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Class that formats log records as single line JSON objects
+
+    The object holds the time (UTC, ISO 8601), level, logger, function and
+    message, followed by the log context fields and the exception, if any.
+    """
+    # the encoder, shared by all records
+    encoder: json.JSONEncoder = json.JSONEncoder(separators=(',', ':'), default=str)
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Formats a record.
+
+        :param record: The log record.
+        :return: The JSON text.
+        """
+        # init the object with the record fields
+        ret_val: dict = {'time': f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))}.{int(record.msecs):03d}Z",
+                         'level': record.levelname, 'logger': record.name, 'function': record.funcName, 'message': record.getMessage()}
+
+        # add the context fields
+        ret_val.update(getattr(record, 'context', {}))
+
+        # add the exception, it is only rendered once per record
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if record.exc_text:
+            ret_val['exception'] = record.exc_text
+
+        # return to the caller
+        return self.encoder.encode(ret_val)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Class that puts log records on a bounded queue for a background writer
+
+    Only the message text is rendered on the calling thread, so later changes to
+    the arguments do not show up in the output. The formatting is done by the
+    writer's handlers.
+    """
+
+    def __init__(self, record_queue: queue.Queue, policy: str = 'drop'):
+        """
+        Init the handler
+
+        :param record_queue: The queue.
+        :param policy: What to do when the queue is full, 'drop' the record or 'block' until there is room.
+        """
+        # init the base class
+        QueueHandler.__init__(self, record_queue)
+
+        # save the params
+        self.block: bool = policy.lower() == 'block'
+
+        # the number of records dropped since it was last reported
+        self.dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Gets a copy of the record with the message rendered.
+
+        :param record: The log record.
+        :return: The record to queue.
+        """
+        # copy the record so the caller's is not changed
+        record = copy.copy(record)
+
+        # render the message
+        record.msg = record.getMessage()
+        record.args = None
+
+        # return to the caller
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """
+        Puts a record on the queue, dropping it or waiting for room if the queue is full.
+
+        :param record: The log record.
+        :return:
+        """
+        # wait for room if that is the policy
+        if self.block:
+            self.queue.put(record)
+            return
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # count it, the count is reported by the writer
+            self.dropped += 1
+
+
+class BoundedQueueListener(QueueListener):
+    """
+    Class that writes out the log records of a bounded queue on a background thread
+
+    """
+
+    def __init__(self, queue_handler: BoundedQueueHandler, *handlers):
+        """
+        Init the listener
+
+        :param queue_handler: The handler feeding the queue.
+        :param handlers: The output handlers.
+        """
+        # init the base class, the output handlers keep their own levels
+        QueueListener.__init__(self, queue_handler.queue, *handlers, respect_handler_level=True)
+
+        # save the params
+        self.queue_handler: BoundedQueueHandler = queue_handler
+
+    def handle(self, record: logging.LogRecord):
+        """
+        Writes out a record, after a warning about any records dropped before it.
+
+        :param record: The log record.
+        :return:
+        """
+        # report any records dropped
+        self.report_dropped(record.name)
+
+        # write the record
+        QueueListener.handle(self, record)
+
+    def report_dropped(self, name: str):
+        """
+        Writes out a warning with the number of records dropped since the last one, if any were.
+
+        :param name: The logger name.
+        :return:
+        """
+        # were records dropped
+        if self.queue_handler.dropped > 0:
+            # get the count and reset it
+            dropped, self.queue_handler.dropped = self.queue_handler.dropped, 0
+
+            # report it
+            QueueListener.handle(self, logging.makeLogRecord({'name': name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                                                              'funcName': 'report_dropped',
+                                                              'msg': f'{dropped} log records were dropped, the log queue was full.'}))
+
+    def enqueue_sentinel(self):
+        """
+        Puts the stop marker on the queue, waiting for room if it is full so nothing queued is lost.
+
+        :return:
+        """
+        self.queue.put(self._sentinel)
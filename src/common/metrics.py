@@ -0,0 +1,192 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Run metrics.
+
+    The metrics of a run (the time spent in each stage and counters such as
+    the bytes read or the DB round trips) are gathered in a RunMetrics object
+    that is made current for the run with a context variable. Code anywhere
+    below the run records into it with the module level stage() and count()
+    calls without the object being passed around. When no run metrics are
+    current, e.g. they are turned off, those calls only look up the context
+    variable and return.
+
+    Threads started with a copy of the run's context (contextvars.copy_context())
+    record into the same metrics. Work done in other processes is not seen.
+"""
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+
+# the metrics of the current run
+current_metrics: contextvars.ContextVar = contextvars.ContextVar('current_metrics', default=None)
+
+# the context manager used for stages when there are no current metrics
+NO_STAGE = nullcontext()
+
+
+class RunMetrics:
+    """
+    Class that gathers the stage timings and counters of a run
+
+    """
+
+    def __init__(self, run_id: str):
+        """
+        Init the run metrics
+
+        :param run_id: The id of the run.
+        """
+        # save the params
+        self.run_id: str = run_id
+
+        # the number of times each stage ran and the total nanoseconds spent in it, by stage name
+        self.stages: dict = {}
+
+        # the counters, by name
+        self.counters: dict = {}
+
+        # the lock used when recording from more than one thread
+        self.lock: threading.Lock = threading.Lock()
+
+        # the run start time
+        self.start_ns: int = time.perf_counter_ns()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times a stage. A stage can run more than once, also in more than one thread at a time, the times are added up.
+
+        :param name: The stage name.
+        :return:
+        """
+        # get the start time
+        start_ns: int = time.perf_counter_ns()
+
+        try:
+            yield
+        finally:
+            # get the time spent
+            elapsed_ns: int = time.perf_counter_ns() - start_ns
+
+            with self.lock:
+                # add it to the stage
+                calls, total_ns = self.stages.get(name, (0, 0))
+                self.stages[name] = (calls + 1, total_ns + elapsed_ns)
+
+    def count(self, name: str, value: int = 1):
+        """
+        Adds to a counter.
+
+        :param name: The counter name.
+        :param value: The amount to add.
+        :return:
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_record(self) -> dict:
+        """
+        Gets the metrics record of the run.
+
+        :return: A dict of the run id, the total run time, the stage timings and the counters.
+        """
+        with self.lock:
+            # return to the caller
+            return {'run_id': self.run_id, 'elapsed_ms': round((time.perf_counter_ns() - self.start_ns) / 1e6, 3),
+                    'stages': {name: {'calls': calls, 'ms': round(total_ns / 1e6, 3)} for name, (calls, total_ns) in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+    @staticmethod
+    def get_textfile(record: dict) -> str:
+        """
+        Gets a metrics record in the Prometheus text exposition format.
+
+        :param record: The metrics record.
+        :return: The text.
+        """
+        # init the lines with the run totals
+        lines: list = ['# TYPE forensics_run_seconds gauge', f"forensics_run_seconds {record['elapsed_ms'] / 1000:.6f}",
+                       '# TYPE forensics_stage_seconds gauge']
+
+        # add the stage timings
+        lines.extend(f'forensics_stage_seconds{{stage="{name}"}} {stage["ms"] / 1000:.6f}' for name, stage in sorted(record['stages'].items()))
+        lines.append('# TYPE forensics_stage_calls gauge')
+        lines.extend(f'forensics_stage_calls{{stage="{name}"}} {stage["calls"]}' for name, stage in sorted(record['stages'].items()))
+
+        # add the counters
+        lines.append('# TYPE forensics_count gauge')
+        lines.extend(f'forensics_count{{name="{name}"}} {value}' for name, value in sorted(record['counters'].items()))
+
+        # return to the caller
+        return '\n'.join(lines) + '\n'
+
+    def write(self, file_path: str) -> dict:
+        """
+        Writes the metrics record of the run, in the Prometheus text format if the file name ends with .prom, otherwise as JSON.
+
+        The file is replaced in one step so a reader never sees a partial file.
+
+        :param file_path: The file path.
+        :return: The metrics record.
+        """
+        # get the record
+        record: dict = self.get_record()
+
+        # write it to a temporary file next to the target
+        with open(f'{file_path}.tmp', 'w', encoding='utf-8') as fp:
+            if file_path.endswith('.prom'):
+                fp.write(self.get_textfile(record))
+            else:
+                json.dump(record, fp, indent=2)
+
+        # put it in place
+        os.replace(f'{file_path}.tmp', file_path)
+
+        # return to the caller
+        return record
+
+
+def get_current():
+    """
+    Gets the metrics of the current run.
+
+    :return: The run metrics or None if there are none.
+    """
+    # return to the caller
+    return current_metrics.get()
+
+
+def stage(name: str):
+    """
+    Times a stage of the current run, if there are current run metrics.
+
+    :param name: The stage name.
+    :return: A context manager.
+    """
+    # get the current metrics
+    metrics: RunMetrics = current_metrics.get()
+
+    # return to the caller
+    return NO_STAGE if metrics is None else metrics.stage(name)
+
+
+def count(name: str, value: int = 1):
+    """
+    Adds to a counter of the current run, if there are current run metrics.
+
+    :param name: The counter name.
+    :param value: The amount to add.
+    :return:
+    """
+    # get the current metrics
+    metrics: RunMetrics = current_metrics.get()
+
+    # add to the counter
+    if metrics is not None:
+        metrics.count(name, value)
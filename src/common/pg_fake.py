@@ -0,0 +1,444 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    In-process stand-in for the supervisor DB.
+
+    Selected with <DB name>_DB_BACKEND=fake, this provides DB-API style
+    connections that PGUtilsMultiConnect uses in place of psycopg2 ones, so
+    all of the statement, reconnect, retry and backoff handling above it runs
+    unchanged without a Postgres server. The supervisor DB functions used by
+    the services are implemented on a SQLite DB:
+     - get_supervisor_run_def_json(run_id): the run request added with add_run_def() or loaded from <DB name>_DB_FAKE_RUN_DEFS,
+     - update_run_results(run_id, results): saves the run results,
+     - get_run_status_json(request_group): the status of the runs in a request group,
+    along with the run_result_details table and COPY into it.
+
+    The latency of each statement and the rate of dropped connections and
+    failed connection attempts can be set to exercise the error handling:
+     - <DB name>_DB_FAKE_PATH: the SQLite DB file, default in memory,
+     - <DB name>_DB_FAKE_LATENCY_MS: the time each statement takes,
+     - <DB name>_DB_FAKE_FAILURE_RATE: the fraction of statements that fail with a dropped connection,
+     - <DB name>_DB_FAKE_CONNECT_FAILURE_RATE: the fraction of connection attempts that fail.
+"""
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import threading
+
+import psycopg2
+
+
+class FakeSupervisorDB:
+    """
+    Class that holds the data of the stand-in supervisor DB
+
+    """
+    # the stand-in DBs, by DB name
+    instances: dict = {}
+
+    # the lock used when creating them
+    instances_lock: threading.Lock = threading.Lock()
+
+    # the DB schema
+    SCHEMA: tuple = (
+        'CREATE TABLE IF NOT EXISTS run_defs (run_id TEXT PRIMARY KEY, request_group TEXT, run_def TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS run_results (run_id TEXT PRIMARY KEY, results TEXT NOT NULL, updated REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS run_result_details (run_id INTEGER NOT NULL, suite_name TEXT NOT NULL, detail_type TEXT NOT NULL, '
+        'seq INTEGER NOT NULL, detail TEXT NOT NULL)',
+    )
+
+    def __init__(self, db_path: str = ':memory:', latency: float = 0.0, failure_rate: float = 0.0, connect_failure_rate: float = 0.0):
+        """
+        Init the stand-in DB
+
+        :param db_path: The SQLite DB file.
+        :param latency: The number of seconds each statement takes.
+        :param failure_rate: The fraction of statements that fail with a dropped connection.
+        :param connect_failure_rate: The fraction of connection attempts that fail.
+        """
+        # save the params
+        self.latency: float = latency
+        self.failure_rate: float = failure_rate
+        self.connect_failure_rate: float = connect_failure_rate
+
+        # the lock that serializes access to the DB
+        self.lock: threading.Lock = threading.Lock()
+
+        # open the DB, it is shared by the connections of all threads
+        self.db: sqlite3.Connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+
+        # create the schema
+        for sql_stmt in self.SCHEMA:
+            self.db.execute(sql_stmt)
+
+        # the prepared statements, by name. they are kept for the DB rather than per connection so they outlive a dropped connection
+        self.prepared: dict = {}
+
+        # init the statistics
+        self.stats: dict = {'connects': 0, 'connect_failures': 0, 'statements': 0, 'failures': 0}
+
+    @classmethod
+    def get_instance(cls, db_name: str):
+        """
+        Gets the stand-in for a DB, creating it from the <DB name>_DB_FAKE_* environment parameters the first time.
+
+        :param db_name: The DB name.
+        :return: The stand-in DB.
+        """
+        with cls.instances_lock:
+            # create it if needed
+            if db_name not in cls.instances:
+                # get the env param prefix
+                prefix: str = f"{db_name.upper().replace('-', '_')}_DB_FAKE"
+
+                # create the DB
+                instance = cls(os.getenv(f'{prefix}_PATH', ':memory:'), float(os.getenv(f'{prefix}_LATENCY_MS', '0')) / 1000,
+                               float(os.getenv(f'{prefix}_FAILURE_RATE', '0')), float(os.getenv(f'{prefix}_CONNECT_FAILURE_RATE', '0')))
+
+                # load any run requests
+                run_defs_file: str = os.getenv(f'{prefix}_RUN_DEFS')
+
+                if run_defs_file:
+                    with open(run_defs_file, encoding='utf-8') as fp:
+                        for run_id, run_def in json.load(fp).items():
+                            instance.add_run_def(run_id, run_def)
+
+                # save it
+                cls.instances[db_name] = instance
+
+            # return to the caller
+            return cls.instances[db_name]
+
+    def connect(self):
+        """
+        Opens a connection to the stand-in DB.
+
+        :return: The connection.
+        """
+        with self.lock:
+            # count it
+            self.stats['connects'] += 1
+
+            # does this one fail
+            if random.random() < self.connect_failure_rate:
+                self.stats['connect_failures'] += 1
+
+                raise psycopg2.OperationalError('could not connect to server: injected failure')
+
+        # return to the caller
+        return FakeConnection(self)
+
+    def add_run_def(self, run_id: str, run_def: dict):
+        """
+        Adds a run request.
+
+        :param run_id: The id of the run.
+        :param run_def: The run request record, as get_supervisor_run_def_json() returns it.
+        :return:
+        """
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO run_defs (run_id, request_group, run_def) VALUES (?, ?, ?)',
+                            (str(run_id), str(run_def.get('request_group', '')), json.dumps(run_def)))
+
+    def get_results(self, run_id: str):
+        """
+        Gets the results saved for a run.
+
+        :param run_id: The id of the run.
+        :return: The results or None.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT results FROM run_results WHERE run_id = ?', (str(run_id),)).fetchone()
+
+        # return to the caller
+        return json.loads(row[0]) if row else None
+
+    def get_stats(self) -> dict:
+        """
+        Gets the stand-in statistics.
+
+        :return: A dict of the statistics.
+        """
+        with self.lock:
+            # return to the caller
+            return dict(self.stats)
+
+    def run_statement(self) -> None:
+        """
+        Accounts for a statement, applying the latency and any injected failure.
+
+        :return:
+        """
+        # take the time a statement takes
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self.lock:
+            # count it
+            self.stats['statements'] += 1
+
+            # does this one fail
+            if random.random() < self.failure_rate:
+                self.stats['failures'] += 1
+
+                raise psycopg2.OperationalError('server closed the connection unexpectedly: injected failure')
+
+    def call_function(self, function_name: str, params: tuple):
+        """
+        Runs one of the supervisor DB functions.
+
+        :param function_name: The function name.
+        :param params: The function params.
+        :return: The function result.
+        """
+        with self.lock:
+            # get a run request
+            if function_name == 'get_supervisor_run_def_json':
+                row = self.db.execute('SELECT run_def FROM run_defs WHERE run_id = ?', (str(params[0]),)).fetchone()
+
+                # return to the caller
+                return json.loads(row[0]) if row else None
+
+            # save the results of a run
+            if function_name == 'update_run_results':
+                self.db.execute('INSERT OR REPLACE INTO run_results (run_id, results, updated) VALUES (?, ?, ?)',
+                                (str(params[0]), params[1], time.time()))
+
+                # return to the caller
+                return 0
+
+            # get the status of the runs in a request group
+            if function_name == 'get_run_status_json':
+                rows = self.db.execute('SELECT run_defs.run_id, run_results.run_id IS NOT NULL FROM run_defs '
+                                       'LEFT JOIN run_results ON run_results.run_id = run_defs.run_id WHERE run_defs.request_group = ? '
+                                       'ORDER BY run_defs.run_id', (str(params[0]),)).fetchall()
+
+                # return to the caller
+                return [{'run_id': run_id, 'status': 'Complete' if complete else 'Pending'} for run_id, complete in rows] or None
+
+        raise psycopg2.ProgrammingError(f'function public.{function_name} does not exist')
+
+    def execute(self, sql_stmt: str, params: tuple = None) -> int:
+        """
+        Runs a statement on the run result details table.
+
+        :param sql_stmt: The sql, with ? placeholders.
+        :param params: The values bound to the placeholders.
+        :return: The number of rows affected.
+        """
+        with self.lock:
+            # return to the caller
+            return self.db.execute(sql_stmt, params or ()).rowcount
+
+    def copy_details(self, rows: list) -> int:
+        """
+        Saves rows into the run result details table.
+
+        :param rows: The rows, as lists of the column values.
+        :return: The number of rows saved.
+        """
+        with self.lock:
+            self.db.executemany('INSERT INTO run_result_details (run_id, suite_name, detail_type, seq, detail) VALUES (?, ?, ?, ?, ?)', rows)
+
+        # return to the caller
+        return len(rows)
+
+
+class FakeConnection:
+    """
+    Class that stands in for a psycopg2 connection
+
+    """
+
+    def __init__(self, db: FakeSupervisorDB):
+        """
+        Init the connection
+
+        :param db: The stand-in DB.
+        """
+        # save the params
+        self.db: FakeSupervisorDB = db
+
+        # init the connection state
+        self.autocommit: bool = False
+        self.closed: int = 0
+
+    def cursor(self):
+        """
+        Gets a cursor.
+
+        :return: The cursor.
+        """
+        # a closed connection can not be used
+        if self.closed:
+            raise psycopg2.InterfaceError('connection already closed')
+
+        # return to the caller
+        return FakeCursor(self)
+
+    def commit(self):
+        """
+        Commits the transaction, the stand-in saves everything immediately.
+
+        :return:
+        """
+
+    def rollback(self):
+        """
+        Rolls back the transaction, the stand-in saves everything immediately.
+
+        :return:
+        """
+
+    def close(self):
+        """
+        Closes the connection.
+
+        :return:
+        """
+        self.closed = 1
+
+
+class FakeCursor:
+    """
+    Class that stands in for a psycopg2 cursor
+
+    Only the statements the supervisor DB classes send are understood.
+    """
+    # the patterns of the statements understood
+    FUNCTION_CALL: re.Pattern = re.compile(r'^SELECT public\.(\w+)\((.*)\)$', re.DOTALL)
+    PREPARE: re.Pattern = re.compile(r'^PREPARE (\w+) AS (.*)$', re.DOTALL)
+    EXECUTE: re.Pattern = re.compile(r'^EXECUTE (\w+)')
+    SERVER_PARAM: re.Pattern = re.compile(r'\$\d+')
+
+    def __init__(self, conn: FakeConnection):
+        """
+        Init the cursor
+
+        :param conn: The connection.
+        """
+        # save the params
+        self.conn: FakeConnection = conn
+
+        # init the results
+        self.result = None
+        self.rowcount: int = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """
+        Closes the cursor.
+
+        :return:
+        """
+        self.result = None
+
+    def fetchone(self):
+        """
+        Gets the result row of the last statement.
+
+        :return: The row or None.
+        """
+        # return to the caller
+        return self.result
+
+    def execute(self, sql_stmt: str, params: tuple = None):
+        """
+        Runs a statement.
+
+        :param sql_stmt: The sql, with %s placeholders for any params.
+        :param params: The values bound to the placeholders.
+        :return:
+        """
+        # a closed connection can not be used
+        if self.conn.closed:
+            raise psycopg2.InterfaceError('connection already closed')
+
+        # apply the latency and any injected failure, a failure drops the connection
+        try:
+            self.conn.db.run_statement()
+        except psycopg2.OperationalError:
+            self.conn.close()
+
+            raise
+
+        # init the results
+        self.result = None
+        self.rowcount = -1
+
+        # tidy the statement
+        sql_stmt = sql_stmt.strip()
+
+        # save a prepared statement
+        match = self.PREPARE.match(sql_stmt)
+
+        if match:
+            self.conn.db.prepared[match.group(1)] = self.SERVER_PARAM.sub('%s', match.group(2))
+            return
+
+        # run a prepared statement
+        match = self.EXECUTE.match(sql_stmt)
+
+        if match:
+            # is it there
+            if match.group(1) not in self.conn.db.prepared:
+                raise psycopg2.OperationalError(f'prepared statement "{match.group(1)}" does not exist')
+
+            # use the statement it was prepared with
+            sql_stmt = self.conn.db.prepared[match.group(1)]
+
+        # the connection check
+        if sql_stmt == 'SELECT version()':
+            self.result = ('FakeSupervisorDB',)
+        # a supervisor DB function
+        elif self.FUNCTION_CALL.match(sql_stmt):
+            # get the function result, json params arrive as psycopg2 Json adapters
+            result = self.conn.db.call_function(self.FUNCTION_CALL.match(sql_stmt).group(1),
+                                                tuple(param.dumps(param.adapted) if hasattr(param, 'adapted') else param
+                                                      for param in params or ()))
+
+            # save the row
+            self.result = (result,)
+        # the run result details
+        elif sql_stmt.startswith('DELETE FROM public.run_result_details'):
+            self.rowcount = self.conn.db.execute(sql_stmt.replace('public.', '').replace('%s', '?'), tuple(str(param) for param in params))
+        # transaction control is not needed
+        elif sql_stmt in ('BEGIN', 'COMMIT', 'ROLLBACK'):
+            pass
+        else:
+            raise psycopg2.ProgrammingError(f'statement not supported by the stand-in DB: {sql_stmt}')
+
+    def copy_expert(self, copy_stmt: str, file) -> None:
+        """
+        Reads COPY text format rows into the run result details table.
+
+        :param copy_stmt: The COPY ... FROM STDIN statement.
+        :param file: A file like object with the rows.
+        :return:
+        """
+        # only the run result details are supported
+        if 'run_result_details' not in copy_stmt:
+            raise psycopg2.ProgrammingError(f'statement not supported by the stand-in DB: {copy_stmt}')
+
+        # apply the latency and any injected failure
+        self.conn.db.run_statement()
+
+        # read all the rows
+        data: bytes = b''.join(iter(lambda: file.read(65536), b''))
+
+        # split out the columns and undo the escaping
+        rows: list = [[re.sub(r'\\(.)', lambda match: {'t': '\t', 'n': '\n', 'r': '\r'}.get(match.group(1), match.group(1)), column)
+                       for column in line.split('\t')] for line in data.decode('utf-8').splitlines()]
+
+        # save them
+        self.rowcount = self.conn.db.copy_details(rows)
@@ -8,6 +8,9 @@
     Author: Phil Owen, RENCI.org
 """
 import json
+from functools import partial
+
+from psycopg2.extras import Json
 
 from src.common.pg_utils_multi import PGUtilsMultiConnect
 from src.common.logger import LoggingUtil
@@ -54,10 +57,10 @@ class PGImplementation(PGUtilsMultiConnect):
         """
 
         # create the sql
-        sql: str =  f'SELECT public.get_supervisor_run_def_json({run_id})'
+        sql: str = 'SELECT public.get_supervisor_run_def_json(%s)'
 
         # get the data
-        ret_val = self.exec_sql('irods-sv', sql)
+        ret_val = self.exec_sql('irods-sv', sql, (run_id,), 'get_supervisor_run_def_json_stmt')
 
         # return the data
         return ret_val
@@ -68,18 +71,66 @@ class PGImplementation(PGUtilsMultiConnect):
 
         :return:
         """
-        # make sure the sql lacks single quotes
-        results = json.dumps(results).replace('\'', '')
-
         # create the sql
-        sql: str = f"SELECT public.update_run_results({run_id}, '{results}')"
+        sql: str = 'SELECT public.update_run_results(%s, %s)'
 
-        # get the data
-        ret_val = self.exec_sql('irods-sv', sql)
+        # get the data. the results are bound as a compact json parameter so no quoting or copying of the payload is needed
+        ret_val = self.exec_sql('irods-sv', sql, (run_id, Json(results, dumps=partial(json.dumps, separators=(',', ':')))),
+                                'update_run_results_stmt')
+
+        # return the data
+        return ret_val
+
+    def update_run_details(self, run_id: str, details) -> int:
+        """
+        Replaces the detail records of a run in the run result details table.
+
+        The records are streamed in with COPY, each one encoded as it is sent. The table is part of the supervisor DB schema
+        (src/common/sql/run_result_details.sql), it is not created here.
+
+        :param run_id: The id of the run.
+        :param details: An iterable of (test suite name, detail type, detail record dict) tuples.
+        :return: The number of records saved or -1 on an error.
+        """
+        try:
+            # the table is keyed by the numeric run id
+            run_num: int = int(run_id)
+        except ValueError:
+            self.logger.error('Run result details can not be saved for non-numeric run id: %s', run_id)
+
+            # return to the caller
+            return -1
+
+        # remove anything from a previous attempt for the run
+        setup_stmts: list = [('DELETE FROM public.run_result_details WHERE run_id = %s', (run_num,))]
+
+        # create the copy statement
+        copy_stmt: str = 'COPY public.run_result_details (run_id, suite_name, detail_type, seq, detail) FROM STDIN'
+
+        # create the encoder for the records
+        encoder: json.JSONEncoder = json.JSONEncoder(separators=(',', ':'))
+
+        # make the rows in COPY text format as they are needed
+        rows = (f'{run_num}\t{self.escape_copy_text(suite_name)}\t{self.escape_copy_text(detail_type)}\t{seq}\t'
+                f'{self.escape_copy_text(encoder.encode(detail))}\n' for seq, (suite_name, detail_type, detail) in enumerate(details))
+
+        # stream in the records
+        ret_val = self.exec_copy('irods-sv', setup_stmts, copy_stmt, rows)
 
         # return the data
         return ret_val
 
+    @staticmethod
+    def escape_copy_text(value: str) -> str:
+        """
+        Escapes a value for the COPY text format.
+
+        :param value:
+        :return:
+        """
+        # backslashes first so the others are not doubled up
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
     def get_run_status(self, request_group):
         """
         gets the run status
@@ -88,10 +139,10 @@ class PGImplementation(PGUtilsMultiConnect):
         """
 
         # create the sql
-        sql: str = f"SELECT public.get_run_status_json('{request_group}');"
+        sql: str = 'SELECT public.get_run_status_json(%s)'
 
         # get the data
-        ret_val = self.exec_sql('irods-sv', sql)
+        ret_val = self.exec_sql('irods-sv', sql, (request_group,), 'get_run_status_json_stmt')
 
         # return the data
         return ret_val
@@ -0,0 +1,368 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Pooled DB connections with bounded waits and statistics.
+"""
+
+import time
+import threading
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+from src.common.retry_policy import RetryPolicy
+
+
+class IdleTimes:
+    """
+    Class that keeps the time each idle connection of a pool was returned, to tell when one is due a check before it is used again.
+
+    """
+
+    def __init__(self, check_interval: float):
+        """
+        Init the idle times
+
+        :param check_interval: The number of idle seconds after which a connection is checked. 0 checks every time, a negative
+                               value never checks.
+        """
+        # save the params
+        self.check_interval: float = check_interval
+
+        # the monotonic time each idle connection was returned, by connection id. connections not in here are new
+        self.times: dict = {}
+
+    def returned(self, conn):
+        """
+        Notes that a connection was returned to the pool.
+
+        :param conn: The connection.
+        :return:
+        """
+        self.times[id(conn)] = time.monotonic()
+
+    def forget(self, conn):
+        """
+        Forgets a connection that is being thrown away.
+
+        :param conn: The connection.
+        :return:
+        """
+        self.times.pop(id(conn), None)
+
+    def is_due(self, conn) -> bool:
+        """
+        Checks if a connection has been idle long enough to be checked. New connections are not.
+
+        :param conn: The connection.
+        :return: True if the connection should be checked with the DB.
+        """
+        # get the time it was returned
+        last_used: float = self.times.get(id(conn))
+
+        # return to the caller
+        return last_used is not None and 0 <= self.check_interval <= time.monotonic() - last_used
+
+    def expire(self):
+        """
+        Makes every idle connection due a check.
+
+        :return:
+        """
+        for conn_id in list(self.times):
+            self.times[conn_id] = float('-inf')
+
+
+class PGConnectionPool:
+    """
+    Class that wraps a psycopg2 ThreadedConnectionPool.
+
+    The psycopg2 pool raises an error as soon as all of its connections are in
+    use. This class makes callers wait (up to a timeout) for a connection to be
+    returned instead, opens the pool and new connections with backoff if the DB
+    is not reachable, checks connections that have been idle a while before
+    handing them out, and keeps statistics on its use.
+    """
+
+    def __init__(self, name: str, conn_str: str, min_size: int, max_size: int, retry_policy: RetryPolicy, _logger, _auto_commit=True,
+                 _timeout: float = 30.0, _health_check_interval: float = 60.0):
+        """
+        Init the connection pool. Connections are not made until the pool is first used.
+
+        :param name: The DB name.
+        :param conn_str: The DB connection string.
+        :param min_size: The number of connections to keep open.
+        :param max_size: The maximum number of connections.
+        :param retry_policy: The backoff used when the DB can not be reached.
+        :param _logger: A logger to use for reporting.
+        :param _auto_commit: The autocommit setting for the connections.
+        :param _timeout: The number of seconds to wait for a free connection.
+        :param _health_check_interval: The number of idle seconds after which a connection is checked before it is handed out. 0
+                                       checks every time, a negative value never checks.
+        """
+        # save the params
+        self.name: str = name
+        self.max_size: int = max_size
+        self.retry_policy: RetryPolicy = retry_policy
+        self.logger = _logger
+        self.auto_commit: bool = _auto_commit
+        self.timeout: float = _timeout
+
+        # save the arguments the underlying pool is created with
+        self.pool_args: tuple = (min(min_size, max_size), max_size, conn_str)
+
+        # init the times the idle connections were returned
+        self.idle_times: IdleTimes = IdleTimes(_health_check_interval)
+
+        # init the underlying pool
+        self.pool = None
+
+        # the lock used when opening the pool
+        self.open_lock: threading.Lock = threading.Lock()
+
+        # the condition used to update the stats and wait for a connection to be returned
+        self.lock: threading.Condition = threading.Condition()
+
+        # init the pool statistics
+        self.stats: dict = {'checkouts': 0, 'in_use': 0, 'waits': 0, 'wait_time': 0.0, 'timeouts': 0, 'discarded': 0, 'connect_failures': 0,
+                            'checkout_errors': 0, 'stale': 0}
+
+    def open(self) -> bool:
+        """
+        Creates the underlying pool, retrying with backoff until the retry policy gives up.
+
+        :return: True if the pool is open.
+        """
+        with self.open_lock:
+            # get the retry delays
+            delays = self.retry_policy.delays()
+
+            # until the pool is open or we give up
+            while self.pool is None:
+                try:
+                    # create the pool, this opens the minimum number of connections
+                    self.pool = ThreadedConnectionPool(*self.pool_args)
+
+                    self.logger.debug('DB Connection pool (size %s-%s) established to %s.', self.pool_args[0], self.max_size, self.name)
+                except psycopg2.Error:
+                    self.logger.exception('Error creating the DB connection pool for %s.', self.name)
+
+                    # count the failure
+                    with self.lock:
+                        self.stats['connect_failures'] += 1
+
+                    # get the time to wait before trying again
+                    delay = next(delays, None)
+
+                    # out of retries
+                    if delay is None:
+                        self.logger.error('DB Connection pool failed to %s. Giving up.', self.name)
+                        break
+
+                    self.logger.error('DB Connection pool failed to %s. Retrying in %.1f seconds...', self.name, delay)
+                    time.sleep(delay)
+
+        # return to the caller
+        return self.pool is not None
+
+    def getconn(self):
+        """
+        Checks out a connection, waiting for one to be returned if they are all in use.
+
+        :return: A DB connection.
+        """
+        with self.lock:
+            # are all the connections in use
+            if self.stats['in_use'] >= self.max_size:
+                # save the time we started waiting
+                start: float = time.monotonic()
+
+                # wait for a connection to be returned
+                acquired: bool = self.lock.wait_for(lambda: self.stats['in_use'] < self.max_size, timeout=self.timeout)
+
+                # count the wait
+                self.stats['waits'] += 1
+                self.stats['wait_time'] += time.monotonic() - start
+
+                # did the wait time out
+                if not acquired:
+                    # count it
+                    self.stats['timeouts'] += 1
+
+                    # let the caller know
+                    raise PoolError(f'Timed out waiting {self.timeout} seconds for a connection to {self.name}')
+
+            # reserve the connection
+            self.stats['in_use'] += 1
+
+        try:
+            # make sure the pool is open
+            if self.pool is None and not self.open():
+                raise PoolError(f'Connection pool to {self.name} could not be opened')
+
+            # get a good connection
+            conn = self.get_good_conn()
+
+            # set the autocommit on the connection
+            if conn.autocommit != self.auto_commit:
+                conn.autocommit = self.auto_commit
+        except Exception:
+            with self.lock:
+                # give the reservation back
+                self.stats['in_use'] -= 1
+                self.stats['checkout_errors'] += 1
+                self.lock.notify()
+
+            raise
+
+        with self.lock:
+            # count the checkout
+            self.stats['checkouts'] += 1
+
+        # return to the caller
+        return conn
+
+    def get_good_conn(self):
+        """
+        Gets a connection from the underlying pool. Connections that fail the idle check are thrown away, and new connections
+        that can not be made are retried with backoff until the retry policy gives up.
+
+        :return: A DB connection.
+        """
+        # get the retry delays before the first attempt so the retry deadline includes it
+        delays = self.retry_policy.delays()
+
+        # until there is a good connection
+        while True:
+            try:
+                # get an idle connection or a new one
+                conn = self.pool.getconn()
+            except psycopg2.OperationalError:
+                # count the failure
+                with self.lock:
+                    self.stats['connect_failures'] += 1
+
+                # get the time to wait before trying again
+                delay = next(delays, None)
+
+                # out of retries
+                if delay is None:
+                    self.logger.error('DB Connection failed to %s. Giving up.', self.name)
+                    raise
+
+                self.logger.error('DB Connection failed to %s. Retrying in %.1f seconds...', self.name, delay)
+                time.sleep(delay)
+
+                # try again
+                continue
+
+            # is it good
+            if self.is_usable(conn):
+                # return to the caller
+                return conn
+
+            self.logger.warning('Discarding a stale DB connection to %s.', self.name)
+
+            # throw it away, the next one may be stale too or a new one
+            with self.lock:
+                self.stats['stale'] += 1
+
+            self.idle_times.forget(conn)
+            self.pool.putconn(conn, close=True)
+
+    def is_usable(self, conn) -> bool:
+        """
+        Checks a connection before it is handed out. New connections, and ones used within the health check interval, are not
+        checked with the DB.
+
+        :param conn: The connection.
+        :return: True if the connection can be used.
+        """
+        # a closed connection is no good
+        if conn.closed:
+            return False
+
+        # new connections and recently used ones are good
+        if not self.idle_times.is_due(conn):
+            return True
+
+        try:
+            # make a trip to the DB
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT version()')
+
+            # do not leave a transaction open
+            if not conn.autocommit:
+                conn.rollback()
+        except psycopg2.Error:
+            # the connection is no good
+            return False
+
+        # return to the caller
+        return True
+
+    def check_idle(self):
+        """
+        Makes sure every idle connection is checked before it is handed out again, e.g. after one of them was found to be
+        broken, since the DB may have been restarted.
+
+        :return:
+        """
+        # make them all look long idle
+        self.idle_times.expire()
+
+    def putconn(self, conn, close: bool = False):
+        """
+        Returns a connection to the pool.
+
+        :param conn: The connection to return.
+        :param close: True to discard the connection, e.g. when it is broken.
+        :return:
+        """
+        try:
+            # note when it was returned, or forget it if it is being thrown away
+            if close or conn.closed:
+                self.idle_times.forget(conn)
+            else:
+                self.idle_times.returned(conn)
+
+            # return it to the pool
+            self.pool.putconn(conn, close=close or bool(conn.closed))
+        finally:
+            with self.lock:
+                # update the stats
+                self.stats['in_use'] -= 1
+
+                if close:
+                    self.stats['discarded'] += 1
+
+                # let a waiting caller have it
+                self.lock.notify()
+
+    def closeall(self):
+        """
+        Closes all the connections in the pool.
+
+        :return:
+        """
+        # if the pool was opened, close it
+        if self.pool is not None and not self.pool.closed:
+            self.pool.closeall()
+
+    def get_stats(self) -> dict:
+        """
+        Gets the pool statistics.
+
+        :return: A dict of the statistics.
+        """
+        with self.lock:
+            # copy the counters
+            ret_val: dict = dict(self.stats)
+
+        # add the settings
+        ret_val.update({'name': self.name, 'min_size': self.pool_args[0], 'max_size': self.max_size, 'open': self.pool is not None})
+
+        # return to the caller
+        return ret_val
@@ -13,8 +13,13 @@ import time
 from collections import namedtuple
 
 import psycopg2
+from psycopg2 import errorcodes
 
+from src.common import metrics
 from src.common.logger import LoggingUtil
+from src.common.retry_policy import RetryPolicy
+from src.common.pg_pool import PGConnectionPool
+from src.common.pg_fake import FakeSupervisorDB
 
 
 class PGUtilsMultiConnect:
@@ -27,6 +32,9 @@ class PGUtilsMultiConnect:
         final environment parameter should be all uppercase.
 
         Please see the get_conn_config() method below for more details.
+
+        A DB can be served by an in-process stand-in instead of Postgres by
+        setting <DB name>_DB_BACKEND=fake, see src.common.pg_fake.
     """
 
     def __init__(self, app_name, db_names: tuple, _logger=None, _auto_commit=True):
@@ -58,16 +66,89 @@ class PGUtilsMultiConnect:
         # save the DB names for connection/cursor closing on class tear-down
         self.db_names: tuple = db_names
 
+        # the number of idle seconds after which a connection is checked before use, by DB name.
+        # 0 checks before every statement, a negative value never checks up front
+        self.health_check_intervals: dict = {db_name: float(self.get_env_param(db_name, 'HEALTH_CHECK_INTERVAL', '60')) for db_name in db_names}
+
+        # the monotonic time each DB connection was last known to be good, by DB name
+        self.last_good: dict = {}
+
+        # the backoff used when a DB can not be reached, by DB name
+        self.retry_policies: dict = {db_name: self.get_retry_policy(db_name) for db_name in db_names}
+
+        # the connection pools for the DBs that are configured to use one, by DB name
+        self.pools: dict = {}
+
+        # whether statements that are given a name are run as server-side prepared statements, by DB name
+        self.use_prepared: dict = {db_name: self.get_env_param(db_name, 'PREPARED_STATEMENTS', 'false').lower() == 'true' for db_name in db_names}
+
+        # the names of the statements prepared on each connection, by connection id
+        self.prepared_statements: dict = {}
+
+        # the backend that serves each DB, 'postgres' or the in-process stand-in 'fake', by DB name
+        self.backends: dict = {db_name: self.get_env_param(db_name, 'BACKEND', 'postgres').lower() for db_name in db_names}
+
         # get the details loaded into a tuple for all the DBs
         for db_name in self.db_names:
-            # get the connection string
-            conn_config = self.get_conn_config(db_name)
+            # get the connection string, the stand-in does not need one
+            if self.backends[db_name] == 'fake':
+                conn_config = f'fake:{db_name}'
+            else:
+                conn_config = self.get_conn_config(db_name)
 
             # create a temporary tuple to get the discovery process started
             temp_tuple: namedtuple = self.db_info_tpl(db_name, conn_config, None)
 
-            # get the connection
-            self.get_db_connection(temp_tuple)
+            # save it so the DB is known even if a connection can not be made yet
+            self.dbs.update({db_name: temp_tuple})
+
+            # get the pool size. a max size greater than 0 turns on pooling for this DB
+            pool_max: int = int(self.get_env_param(db_name, 'POOL_MAX', '0'))
+
+            # use a pool or a single connection
+            if not self.enable_pool(db_name, pool_max):
+                # get the connection
+                self.get_db_connection(temp_tuple)
+
+    def enable_pool(self, db_name: str, pool_max: int) -> bool:
+        """
+        Makes a DB use a connection pool of at least pool_max connections, e.g. when it is going to be used by several threads at
+        a time. A single connection already made to the DB is closed. The stand-in DB is always used with a single connection.
+
+        :param db_name: The DB name.
+        :param pool_max: The minimum pool max size, 0 or less leaves the DB as it is.
+        :return: True if the DB uses a pool.
+        """
+        # is there a pool already
+        if db_name in self.pools:
+            # let someone know if it is smaller than needed
+            if self.pools[db_name].max_size < pool_max:
+                self.logger.warning('The %s DB connection pool max size %s is less than the %s needed.', db_name, self.pools[db_name].max_size,
+                                    pool_max)
+
+            # return to the caller
+            return True
+
+        # is a pool wanted and can one be used
+        if pool_max <= 0 or self.backends[db_name] == 'fake':
+            return False
+
+        # close the single connection, if there is one
+        if self.dbs[db_name].conn is not None:
+            self.close_conn(db_name)
+
+            self.dbs[db_name] = self.dbs[db_name]._replace(conn=None)
+
+        # create the pool
+        self.pools[db_name] = PGConnectionPool(db_name, self.dbs[db_name].conn_str, int(self.get_env_param(db_name, 'POOL_MIN', '1')), pool_max,
+                                               self.retry_policies[db_name], self.logger, self.auto_commit,
+                                               float(self.get_env_param(db_name, 'POOL_TIMEOUT', '30')), self.health_check_intervals[db_name])
+
+        # open the pool
+        self.pools[db_name].open()
+
+        # return to the caller
+        return True
 
     def __del__(self):
         """
@@ -88,6 +169,10 @@ class PGUtilsMultiConnect:
         :return:
         """
         try:
+            # if there is a pool, close all of its connections
+            if db_name in self.pools:
+                self.pools[db_name].closeall()
+
             # if there is a connection, close it
             if self.dbs[db_name].conn is not None:
                 # get the item out of the tuple
@@ -98,6 +183,48 @@ class PGUtilsMultiConnect:
         except Exception:
             self.logger.warning('Error detected closing the %s DB connection.', db_name)
 
+    @staticmethod
+    def get_env_param(db_name: str, param_name: str, default: str = None) -> str:
+        """
+        Gets a DB specific environment parameter, i.e. <DB name>_DB_<parameter name>.
+
+        :param db_name:
+        :param param_name:
+        :param default:
+        :return:
+        """
+        # return to the caller
+        return os.environ.get(f"{db_name.upper().replace('-', '_')}_DB_{param_name}", default)
+
+    def get_retry_policy(self, db_name: str) -> RetryPolicy:
+        """
+        Creates the connection retry policy for a DB from the <DB name>_DB_RETRY_* environment parameters.
+
+        By default, retries go on until a connection is made.
+
+        :param db_name:
+        :return:
+        """
+        # return to the caller
+        return RetryPolicy(base_delay=float(self.get_env_param(db_name, 'RETRY_BASE_DELAY', '1')),
+                           max_delay=float(self.get_env_param(db_name, 'RETRY_MAX_DELAY', '60')),
+                           max_attempts=int(self.get_env_param(db_name, 'RETRY_MAX_ATTEMPTS', '0')),
+                           deadline=float(self.get_env_param(db_name, 'RETRY_DEADLINE', '0')))
+
+    def get_pool_stats(self, db_name: str = None) -> dict:
+        """
+        Gets the connection pool statistics.
+
+        :param db_name: The DB to get the statistics for, or None for all pooled DBs.
+        :return: A dict of statistics, keyed by DB name if db_name is None.
+        """
+        # a specific DB was requested
+        if db_name is not None:
+            return self.pools[db_name].get_stats() if db_name in self.pools else {}
+
+        # return to the caller
+        return {name: pool.get_stats() for name, pool in self.pools.items()}
+
     @staticmethod
     def get_conn_config(db_name: str) -> str:
         """
@@ -119,20 +246,30 @@ class PGUtilsMultiConnect:
         # create a connection string
         connection_str: str = f"host={host} port={port} dbname={dbname} user={user} password={password}"
 
+        # get the optional TCP keepalive idle time (seconds) so dead connections are detected by the OS
+        keepalives_idle: str = os.environ.get(f'{db_name}_DB_KEEPALIVES_IDLE')
+
+        # if set, add the keepalive settings
+        if keepalives_idle:
+            connection_str += f" keepalives=1 keepalives_idle={int(keepalives_idle)}"
+
         # return to the caller
         return connection_str
 
     def get_db_connection(self, db_info: namedtuple) -> bool:
         """
         Gets a connection to the DB. performs a check to continue trying until
-        a connection is made.
+        a connection is made or the DB's retry policy gives up.
 
         :return:
         """
         # init the connection status indicator
         good_conn: bool = False
 
-        # until forever
+        # get the delays to use between attempts
+        delays = self.retry_policies[db_info.name].delays()
+
+        # until connected or out of retries
         while not good_conn:
             try:
                 # check the DB connection
@@ -141,7 +278,9 @@ class PGUtilsMultiConnect:
                 # try to get a connection if the check failed
                 if not good_conn:
                     # try to connect to the DB
-                    conn = psycopg2.connect(db_info.conn_str)
+                    metrics.count('db_connects')
+
+                    conn = self.connect(db_info)
 
                     # set the autocommit on the connection
                     conn.autocommit = self.auto_commit
@@ -161,6 +300,9 @@ class PGUtilsMultiConnect:
                         # add the verified connection to the dict
                         self.dbs.update({db_info.name: verified_tuple})
 
+                        # save the time the connection was verified
+                        self.last_good[db_info.name] = time.monotonic()
+
                         # no need to continue
                         break
 
@@ -170,12 +312,34 @@ class PGUtilsMultiConnect:
 
             # are we still looking for a connection
             if good_conn is False:
-                self.logger.error('DB Connection failed to %s. Retrying...', db_info.name)
-                time.sleep(5)
+                # get the time to wait before trying again
+                delay = next(delays, None)
+
+                # out of retries
+                if delay is None:
+                    self.logger.error('DB Connection failed to %s. Giving up.', db_info.name)
+                    break
+
+                self.logger.error('DB Connection failed to %s. Retrying in %.1f seconds...', db_info.name, delay)
+                time.sleep(delay)
 
         # return pass/fail flag
         return good_conn
 
+    def connect(self, db_info: namedtuple):
+        """
+        Opens a new connection to the DB with its configured backend.
+
+        :param db_info:
+        :return: The connection.
+        """
+        # use the in-process stand-in if configured
+        if self.backends[db_info.name] == 'fake':
+            return FakeSupervisorDB.get_instance(db_info.name).connect()
+
+        # return to the caller
+        return psycopg2.connect(db_info.conn_str)
+
     def check_db_connection(self, db_info: namedtuple) -> bool:
         """
         Checks to see if there is a good connection to the DB.
@@ -230,63 +394,407 @@ class PGUtilsMultiConnect:
         # return to the caller
         return ret_val
 
-    def exec_sql(self, db_name: str, sql_stmt: str):
+    def needs_health_check(self, db_name: str) -> bool:
+        """
+        Checks to see if a connection has been idle long enough to be verified before use.
+
+        :param db_name:
+        :return:
+        """
+        # get the interval for this DB
+        interval: float = self.health_check_intervals.get(db_name, 0)
+
+        # negative intervals turn the check off
+        if interval < 0:
+            return False
+
+        # check if the connection has been idle too long
+        return (time.monotonic() - self.last_good.get(db_name, float('-inf'))) >= interval
+
+    def exec_sql(self, db_name: str, sql_stmt: str, params: tuple = None, prepared_name: str = None):
         """
         Executes a sql statement.
 
+        The statement is run optimistically on the existing connection. Only if
+        that fails with a connection level error is the connection re-established
+        and the statement retried, once.
+
         :param db_name:
-        :param sql_stmt:
+        :param sql_stmt: The sql, with %s placeholders for any params.
+        :param params: The values bound to the placeholders.
+        :param prepared_name: The name to use if the DB is set to run server-side prepared statements.
         :return:
         """
+        # only use the statement name if prepared statements are turned on
+        prepared_name = prepared_name if self.use_prepared.get(db_name) else None
+
+        # use the pool if this DB has one
+        if db_name in self.pools:
+            return self.exec_pooled_sql(db_name, sql_stmt, params, prepared_name)
+
         # init the return
         ret_val = None
 
         # get the appropriate db info object
         db_info = self.dbs[db_name]
 
-        # insure we have a valid DB connection
-        success = self.get_db_connection(db_info)
+        # insure we have a valid DB connection if it has been idle a while
+        success = self.get_db_connection(db_info) if self.needs_health_check(db_name) else True
 
         # did we get a connection
         if success:
-            # init the cursor
-            cursor = None
-
-            try:
+            # a dropped connection gets one retry on a new connection
+            for attempt in range(2):
                 # make sure the latest db_info is used
-                db_info = self.dbs[db_name]
+                conn = self.dbs[db_name].conn
 
-                # get a cursor
-                cursor = db_info.conn.cursor()
+                try:
+                    # execute the sql and get the returned value
+                    ret_val = self.fetch_result(conn, sql_stmt, params, prepared_name)
 
-                # execute the sql
-                cursor.execute(sql_stmt)
+                    # the connection is good
+                    self.last_good[db_name] = time.monotonic()
 
-                # get the returned value
-                ret_val = cursor.fetchone()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as err:
+                    # set the error code
+                    ret_val = -1
+
+                    # anything but a lost connection, e.g. a statement timeout, would only fail again on a new one
+                    if not self.is_connection_error(conn, err):
+                        self.logger.exception("Error detected executing SQL: %s.", sql_stmt)
+                        break
+
+                    # is this the first try
+                    if attempt == 0:
+                        self.logger.warning('DB connection error detected executing SQL on %s, reconnecting.', db_name)
 
-                # trap the return
-                if ret_val is None or ret_val[0] is None:
-                    # specify a return code on an empty result
+                        # get a new connection, if that fails the retry will fail too
+                        self.get_db_connection(self.dbs[db_name])
+
+                        # try the statement again
+                        continue
+
+                    self.logger.exception("Error detected executing SQL: %s.", sql_stmt)
+                except Exception:
+                    self.logger.exception("Error detected executing SQL: %s.", sql_stmt)
+
+                    # set the error code
                     ret_val = -1
-                else:
-                    # get the one and only record of json
-                    ret_val = ret_val[0]
 
+                # no need to continue
+                break
+
+        else:
+            # set the error code
+            ret_val = -1
+
+        # return to the caller
+        return ret_val
+
+    @staticmethod
+    def is_connection_error(conn, err: psycopg2.Error) -> bool:
+        """
+        Checks if an error means the connection was lost, rather than the statement failing on a good connection.
+
+        psycopg2 raises OperationalError for both, e.g. a statement timeout (QueryCanceled) or a serialization failure is an
+        OperationalError too. Connection failures have no SQLSTATE (raised by libpq) or one in class 08 (connection exception)
+        or 57P (the server is shutting down).
+
+        :param conn: The connection the statement was run on, or None if there was none.
+        :param err: The error.
+        :return: True if the connection is gone.
+        """
+        # no connection or a closed one is definitely gone
+        if conn is None or conn.closed or isinstance(err, psycopg2.InterfaceError):
+            return True
+
+        # these are always about the statement
+        if isinstance(err, (psycopg2.extensions.QueryCanceledError, psycopg2.extensions.TransactionRollbackError)):
+            return False
+
+        # return to the caller
+        return err.pgcode is None or err.pgcode.startswith(('08', '57P'))
+
+    def exec_pooled_sql(self, db_name: str, sql_stmt: str, params: tuple = None, prepared_name: str = None):
+        """
+        Executes a sql statement on a connection checked out of the DB's pool.
+
+        A connection that fails with a connection level error is discarded and
+        the statement retried, once, on another connection.
+
+        :param db_name:
+        :param sql_stmt: The sql, with %s placeholders for any params.
+        :param params: The values bound to the placeholders.
+        :param prepared_name: The name of the server-side prepared statement to use, if any.
+        :return:
+        """
+        # init the return
+        ret_val = -1
+
+        # get the pool
+        pool: PGConnectionPool = self.pools[db_name]
+
+        # a dropped connection gets one retry on another connection
+        for attempt in range(2):
+            # init the connection and the flag to throw it away
+            conn = None
+            discard: bool = False
+
+            try:
+                # get a connection
+                conn = pool.getconn()
+
+                # execute the sql and get the returned value
+                ret_val = self.fetch_result(conn, sql_stmt, params, prepared_name)
+
+                # pooled connections are not shared, so finish the transaction here
+                if not conn.autocommit:
+                    conn.commit()
+
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as err:
+                # set the error code
+                ret_val = -1
+
+                # anything but a lost connection, e.g. a statement timeout, would only fail again on another one
+                if not self.is_connection_error(conn, err):
+                    self.logger.exception("Error detected executing SQL: %s.", sql_stmt)
+
+                    # clean up the failed transaction, the connection can be used again
+                    if not conn.autocommit:
+                        conn.rollback()
+
+                    break
+
+                # the connection is no good
+                discard = True
+
+                # the DB may have been restarted, so check the other connections before they are used
+                pool.check_idle()
+
+                # is this the first try
+                if attempt == 0:
+                    self.logger.warning('DB connection error detected executing SQL on %s, retrying on a new connection.', db_name)
+
+                    # try the statement again
+                    continue
+
+                self.logger.exception("Error detected executing SQL: %s.", sql_stmt)
             except Exception:
                 self.logger.exception("Error detected executing SQL: %s.", sql_stmt)
 
                 # set the error code
                 ret_val = -1
+
+                # clean up the failed transaction
+                if conn is not None and not conn.autocommit:
+                    conn.rollback()
             finally:
-                # in there is a cursor, close it
-                if cursor is not None:
-                    # close it
-                    cursor.close()
+                # return the connection to the pool
+                if conn is not None:
+                    pool.putconn(conn, close=discard)
+
+            # no need to continue
+            break
+
+        # return to the caller
+        return ret_val
+
+    def fetch_result(self, conn, sql_stmt: str, params: tuple = None, prepared_name: str = None):
+        """
+        Executes a sql statement and gets the single value it returns.
+
+        Errors are raised to the caller.
+
+        :param conn:
+        :param sql_stmt: The sql, with %s placeholders for any params.
+        :param params: The values bound to the placeholders.
+        :param prepared_name: The name of the server-side prepared statement to use, if any.
+        :return: The value, or -1 if there was none.
+        """
+        # get a cursor
+        cursor = conn.cursor()
 
+        # count the trip to the DB
+        metrics.count('db_round_trips')
+
+        try:
+            # execute the sql and get the returned value
+            with metrics.stage('db_statement'):
+                if prepared_name is None:
+                    cursor.execute(sql_stmt, params)
+                else:
+                    self.execute_prepared(conn, cursor, prepared_name, sql_stmt, params)
+
+                ret_val = cursor.fetchone()
+        finally:
+            try:
+                # close the cursor
+                cursor.close()
+            except psycopg2.InterfaceError:
+                # the connection is already gone
+                pass
+
+        # trap the return
+        if ret_val is None or ret_val[0] is None:
+            # specify a return code on an empty result
+            ret_val = -1
         else:
+            # get the one and only record of json
+            ret_val = ret_val[0]
+
+        # return to the caller
+        return ret_val
+
+    def execute_prepared(self, conn, cursor, prepared_name: str, sql_stmt: str, params: tuple = None):
+        """
+        Executes a sql statement as a server-side prepared statement, preparing it
+        on the connection first if that has not been done yet.
+
+        :param conn:
+        :param cursor:
+        :param prepared_name:
+        :param sql_stmt: The sql, with %s placeholders for any params.
+        :param params: The values bound to the placeholders.
+        :return:
+        """
+        # get the statements already prepared on this connection
+        prepared: set = self.prepared_statements.setdefault(id(conn), set())
+
+        # create the statement that runs the prepared statement
+        exec_stmt: str = f"EXECUTE {prepared_name} ({', '.join(['%s'] * len(params))})" if params else f'EXECUTE {prepared_name}'
+
+        # prepare it if needed
+        if prepared_name not in prepared:
+            self.prepare_statement(conn, cursor, prepared_name, sql_stmt, prepared)
+
+        try:
+            # run the prepared statement
+            cursor.execute(exec_stmt, params)
+        except psycopg2.OperationalError as err:
+            # anything other than a missing prepared statement goes back to the caller
+            if err.pgcode != errorcodes.INVALID_SQL_STATEMENT_NAME:
+                raise
+
+            # this is a different connection that reused the id of an old one, clean up the failed transaction
+            if not conn.autocommit:
+                conn.rollback()
+
+            # prepare it and try again
+            self.prepare_statement(conn, cursor, prepared_name, sql_stmt, prepared)
+            cursor.execute(exec_stmt, params)
+
+    @staticmethod
+    def prepare_statement(conn, cursor, prepared_name: str, sql_stmt: str, prepared: set):
+        """
+        Prepares a statement on the server.
+
+        :param conn:
+        :param cursor:
+        :param prepared_name:
+        :param sql_stmt: The sql, with %s placeholders that are converted to server-side $n parameters.
+        :param prepared: The names of the statements prepared on the connection.
+        :return:
+        """
+        # split the sql on the placeholders
+        parts: list = sql_stmt.split('%s')
+
+        # number the parameters
+        server_sql: str = parts[0] + ''.join(f'${index}{part}' for index, part in enumerate(parts[1:], 1))
+
+        try:
+            # prepare the statement
+            cursor.execute(f'PREPARE {prepared_name} AS {server_sql}')
+        except psycopg2.ProgrammingError as err:
+            # anything other than a duplicate goes back to the caller
+            if err.pgcode != errorcodes.DUPLICATE_PREPARED_STATEMENT:
+                raise
+
+            # it was already there, clean up the failed transaction
+            if not conn.autocommit:
+                conn.rollback()
+
+        # save the name
+        prepared.add(prepared_name)
+
+    def exec_copy(self, db_name: str, setup_stmts: list, copy_stmt: str, rows) -> int:
+        """
+        Streams rows into a table with COPY, in a single transaction after running
+        any setup statements. The rows are pulled from the iterable as the DB
+        consumes them so the full data set never has to be held in memory.
+
+        The rows can only be consumed once, so there is no retry on a dropped connection.
+
+        :param db_name:
+        :param setup_stmts: A list of (sql, params) tuples to run before the copy.
+        :param copy_stmt: The COPY ... FROM STDIN statement.
+        :param rows: An iterable of COPY text format lines.
+        :return: The number of rows copied or -1 on an error.
+        """
+        # init the return
+        ret_val: int = -1
+
+        # get a connection from the pool or the single connection
+        pool: PGConnectionPool = self.pools.get(db_name)
+
+        # init the connection and the flag to throw it away
+        conn = None
+        discard: bool = False
+
+        try:
+            # get a connection
+            if pool is not None:
+                conn = pool.getconn()
+            elif not self.needs_health_check(db_name) or self.get_db_connection(self.dbs[db_name]):
+                conn = self.dbs[db_name].conn
+
+            # did we get a connection
+            if conn is not None:
+                # count the trip to the DB
+                metrics.count('db_round_trips')
+
+                # the transaction is managed here whatever the autocommit setting
+                with metrics.stage('db_copy'), conn.cursor() as cursor:
+                    # start the transaction if the connection has not already done it for us
+                    if conn.autocommit:
+                        cursor.execute('BEGIN')
+
+                    try:
+                        # run the setup
+                        for sql_stmt, params in setup_stmts:
+                            cursor.execute(sql_stmt, params)
+
+                        # stream in the rows
+                        cursor.copy_expert(copy_stmt, CopyRowStream(rows))
+
+                        # get the row count
+                        ret_val = cursor.rowcount
+
+                        # all good
+                        cursor.execute('COMMIT')
+                    except Exception:
+                        # undo it all
+                        cursor.execute('ROLLBACK')
+
+                        raise
+
+                # the connection is good
+                self.last_good[db_name] = time.monotonic()
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as err:
+            self.logger.exception("DB error detected executing COPY: %s.", copy_stmt)
+
+            # throw the connection away if it is no good
+            discard = self.is_connection_error(conn, err)
+            ret_val = -1
+        except Exception:
+            self.logger.exception("Error detected executing COPY: %s.", copy_stmt)
+
             # set the error code
             ret_val = -1
+        finally:
+            # return the connection to the pool
+            if pool is not None and conn is not None:
+                pool.putconn(conn, close=discard)
 
         # return to the caller
         return ret_val
@@ -298,7 +806,69 @@ class PGUtilsMultiConnect:
         :param db_name:
         :return:
         """
+        # pooled connections finish their transaction when the statement is executed
+        if db_name in self.pools:
+            return
+
         # if this connection is set to not auto commit
         if not self.dbs[db_name].conn.autocommit:
             # issue the commit
             self.dbs[db_name].conn.commit()
+
+
+class CopyRowStream:
+    """
+    Class that presents an iterable of text lines as a readable file for COPY.
+
+    Only as many lines as are needed to fill each read request are pulled from
+    the iterable.
+    """
+
+    def __init__(self, rows):
+        """
+        Init the stream
+
+        :param rows: An iterable of COPY text format lines.
+        """
+        # save the row iterator
+        self.rows = iter(rows)
+
+        # init the encoded data not yet read
+        self.buffer: bytes = b''
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Reads up to size bytes.
+
+        :param size: The maximum number of bytes, or -1 for everything.
+        :return: The data, empty at the end of the rows.
+        """
+        # init the pieces of data to return
+        chunks: list = [self.buffer]
+        length: int = len(self.buffer)
+
+        # pull rows until there is enough data
+        while size < 0 or length < size:
+            # get the next row
+            row = next(self.rows, None)
+
+            # no more rows
+            if row is None:
+                break
+
+            # encode it and save it
+            chunk: bytes = row.encode('utf-8')
+            chunks.append(chunk)
+            length += len(chunk)
+
+        # put it all together
+        data: bytes = b''.join(chunks)
+
+        # keep anything over the size requested for the next read
+        if 0 <= size < len(data):
+            data, self.buffer = data[:size], data[size:]
+        else:
+            self.buffer = b''
+
+        # return to the caller
+        return data
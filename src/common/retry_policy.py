@@ -0,0 +1,85 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Retry policy with exponential backoff and jitter.
+"""
+
+import time
+import random
+
+
+class RetryPolicy:
+    """
+    Class that computes the delays between retries of a failing operation.
+
+    The delay doubles after each failure, starting at base_delay and capped at
+    max_delay. Half of each delay is randomized so that many clients that lost
+    the same resource at the same time do not all retry in lockstep.
+    """
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 60.0, max_attempts: int = 0, deadline: float = 0.0):
+        """
+        Init the retry policy
+
+        :param base_delay: The delay (seconds) after the first failure.
+        :param max_delay: The largest delay (seconds) between attempts.
+        :param max_attempts: The total number of attempts allowed, 0 for no limit.
+        :param deadline: The number of seconds after the first attempt to give up, 0 for no limit.
+        """
+        # save the params
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.max_attempts: int = max_attempts
+        self.deadline: float = deadline
+
+    def delays(self):
+        """
+        Gets the delays to wait before each retry. Call this before the first
+        attempt, the deadline is counted from then.
+
+        :return: A generator of delays in seconds, exhausted when the attempts or the deadline run out.
+        """
+        # return to the caller, the start time is taken now rather than when the first delay is asked for
+        return self.generate_delays(time.monotonic())
+
+    def generate_delays(self, start: float):
+        """
+        Generates the delay to wait before each retry.
+
+        :param start: The monotonic time of the first attempt.
+        :return: A generator of delays in seconds.
+        """
+        # init the count of failed attempts
+        failures: int = 0
+
+        # until the limits are reached
+        while True:
+            # count the failure that got us here
+            failures += 1
+
+            # have we run out of attempts
+            if 0 < self.max_attempts <= failures:
+                return
+
+            # get the full backoff delay for this attempt, keeping the exponent sane
+            delay: float = min(self.max_delay, self.base_delay * (2 ** min(failures - 1, 32)))
+
+            # randomize the second half of it
+            delay = delay / 2 + random.uniform(0, delay / 2)
+
+            # is there a deadline to observe
+            if self.deadline > 0:
+                # get the time left
+                remaining: float = self.deadline - (time.monotonic() - start)
+
+                # out of time
+                if remaining <= 0:
+                    return
+
+                # do not sleep past the deadline
+                delay = min(delay, remaining)
+
+            # return the delay to the caller
+            yield delay
@@ -0,0 +1,21 @@
+-- BSD 3-Clause All rights reserved.
+--
+-- SPDX-License-Identifier: BSD 3-Clause
+
+-- The run result details table in the irods-sv supervisor DB.
+--
+-- Apply this with the supervisor DB schema, by a role that can create objects
+-- in the public schema. The forensics service only deletes and copies rows so
+-- its DB user needs just those privileges on the table, e.g.:
+--   GRANT SELECT, INSERT, DELETE ON public.run_result_details TO <forensics user>;
+
+CREATE TABLE IF NOT EXISTS public.run_result_details
+(
+    run_id      INTEGER NOT NULL,
+    suite_name  TEXT    NOT NULL,
+    detail_type TEXT    NOT NULL,
+    seq         INTEGER NOT NULL,
+    detail      JSON    NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS run_result_details_run_id_idx ON public.run_result_details (run_id);
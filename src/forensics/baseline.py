@@ -0,0 +1,172 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Baseline comparison for the forensics microservice.
+
+    A run's testcase results are compared with those of a reference run to
+    find the tests that newly fail, newly pass or got significantly slower.
+    The baseline is loaded from the testcase file saved in the baseline run's
+    directory, or from the test history if that is not available. The
+    comparison is a handful of set operations on (test suite, testcase) keys
+    so it stays fast on suites with tens of thousands of testcases.
+"""
+import os
+import json
+import gzip
+
+from src.forensics.history import HistoryIndex
+
+
+class BaselineDiff:
+    """
+    Class that compares the results of a run with a baseline run
+
+    """
+    # the name of the file in the run directory that holds the run's per testcase data
+    TESTCASES_FILE: str = 'forensics-testcases.json.gz'
+
+    # the name of the file in the run directory that holds the comparison with the baseline run
+    DIFF_FILE: str = 'forensics-baseline-diff.json'
+
+    # the outcomes that count as failing
+    FAILING: tuple = ('failure', 'error')
+
+    def __init__(self, slower_ratio: float = 1.5, slower_min_secs: float = 1.0, max_items: int = 500, history: HistoryIndex = None,
+                 _logger=None):
+        """
+        Init the baseline comparison
+
+        :param slower_ratio: How many times longer than the baseline a testcase must take to be counted as slower.
+        :param slower_min_secs: How many seconds longer than the baseline a testcase must take to be counted as slower.
+        :param max_items: The maximum number of tests saved in each list of the comparison, the counts are always complete.
+        :param history: The test history, used when the baseline run has no testcase file.
+        :param _logger: A logger to use for reporting.
+        """
+        # save the params
+        self.slower_ratio: float = slower_ratio
+        self.slower_min_secs: float = slower_min_secs
+        self.max_items: int = max_items
+        self.history: HistoryIndex = history
+        self.logger = _logger
+
+    def save(self, full_run_dir: str, testcases: dict):
+        """
+        Saves the per testcase data of a run so it can be used as a baseline later.
+
+        :param full_run_dir: The run directory, i.e. <run_dir>/<run_id>.
+        :param testcases: The per testcase data, by test suite name.
+        :return:
+        """
+        try:
+            # write it out
+            with gzip.open(os.path.join(full_run_dir, self.TESTCASES_FILE), 'wt', encoding='utf-8') as fp:
+                json.dump(testcases, fp, separators=(',', ':'))
+        except OSError:
+            if self.logger is not None:
+                self.logger.exception('Error saving the testcase results in: %s', full_run_dir)
+
+    def save_diff(self, full_run_dir: str, diff: dict) -> bool:
+        """
+        Saves the comparison of a run with its baseline in the run directory.
+
+        :param full_run_dir: The run directory, i.e. <run_dir>/<run_id>.
+        :param diff: The comparison.
+        :return: True if it was saved.
+        """
+        try:
+            # write it out
+            with open(os.path.join(full_run_dir, self.DIFF_FILE), 'w', encoding='utf-8') as fp:
+                json.dump(diff, fp, indent=2)
+        except OSError:
+            if self.logger is not None:
+                self.logger.exception('Error saving the baseline comparison in: %s', full_run_dir)
+
+            return False
+
+        # return to the caller
+        return True
+
+    def load(self, run_dir: str, baseline_run_id: str) -> tuple:
+        """
+        Loads the per testcase data of the baseline run.
+
+        :param run_dir: The directory that holds the run directories.
+        :param baseline_run_id: The id of the baseline run.
+        :return: A tuple of where the baseline came from ('file', 'history' or None if it was not found) and its per testcase data.
+        """
+        try:
+            # try the file in the baseline run directory first
+            with gzip.open(os.path.join(run_dir, baseline_run_id, self.TESTCASES_FILE), 'rt', encoding='utf-8') as fp:
+                return 'file', json.load(fp)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            if self.logger is not None:
+                self.logger.warning('The baseline testcase results of run id: %s could not be read.', baseline_run_id)
+
+        # then the history
+        if self.history is not None:
+            # get the run's results
+            testcases: dict = self.history.get_run_results(baseline_run_id)
+
+            # if it was recorded
+            if testcases:
+                return 'history', testcases
+
+        # return to the caller
+        return None, {}
+
+    @staticmethod
+    def get_results(testcases: dict) -> dict:
+        """
+        Flattens the per testcase data of a run.
+
+        :param testcases: The per testcase data, by test suite name.
+        :return: A dict of (outcome, time) by (test suite name, testcase name).
+        """
+        # return to the caller
+        return {(suite_name, name): (outcome, duration) for suite_name, suite_testcases in testcases.items()
+                for name, outcome, duration in zip(suite_testcases['names'], suite_testcases['outcomes'], suite_testcases['times'])}
+
+    def compare(self, testcases: dict, baseline_testcases: dict) -> dict:
+        """
+        Compares the results of a run with the baseline.
+
+        Newly failing tests are failing now and were not failing in the
+        baseline (including tests that are new). Newly passing tests pass now
+        and were failing in the baseline. Slower tests ran in both and took
+        slower_ratio times and slower_min_secs seconds longer than in the
+        baseline.
+
+        :param testcases: The per testcase data of the run, by test suite name.
+        :param baseline_testcases: The per testcase data of the baseline run, by test suite name.
+        :return: The comparison.
+        """
+        # flatten the results
+        results: dict = self.get_results(testcases)
+        baseline: dict = self.get_results(baseline_testcases)
+
+        # get the failing and passing sets
+        failing: set = {key for key, (outcome, _) in results.items() if outcome in self.FAILING}
+        passing: set = {key for key, (outcome, _) in results.items() if outcome == 'passed'}
+        baseline_failing: set = {key for key, (outcome, _) in baseline.items() if outcome in self.FAILING}
+
+        # compare them
+        newly_failing: list = sorted(failing - baseline_failing)
+        newly_passing: list = sorted(passing & baseline_failing)
+
+        # find the tests that got slower, slowest change first
+        slower: list = sorted(((key, results[key][1], baseline[key][1]) for key in results.keys() & baseline.keys()
+                               if results[key][1] - baseline[key][1] >= self.slower_min_secs and
+                               results[key][1] >= baseline[key][1] * self.slower_ratio),
+                              key=lambda item: (item[2] - item[1], item[0]))
+
+        # return to the caller
+        return {'newly_failing_count': len(newly_failing), 'newly_passing_count': len(newly_passing), 'slower_count': len(slower),
+                'newly_failing': [f'{suite_name}::{name}' for suite_name, name in newly_failing[:self.max_items]],
+                'newly_passing': [f'{suite_name}::{name}' for suite_name, name in newly_passing[:self.max_items]],
+                'slower': [{'test': f'{suite_name}::{name}', 'time': duration, 'baseline_time': baseline_duration}
+                           for (suite_name, name), duration, baseline_duration in slower[:self.max_items]],
+                'missing_count': len(baseline.keys() - results.keys())}
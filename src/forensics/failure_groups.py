@@ -0,0 +1,99 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Failure fingerprinting for the forensics microservice.
+
+    When a build goes bad many testcases fail with the same traceback. Rather
+    than saving every copy, the error/failure details are normalized (memory
+    addresses, line numbers and temporary paths removed) and fingerprinted,
+    and each distinct failure is saved once with a count and the testcases
+    that hit it.
+"""
+import re
+import hashlib
+
+
+class FailureGrouper:
+    """
+    Class that groups identical test failures
+
+    """
+    # the patterns of the run specific noise in a failure and what they are replaced with, applied in order
+    NORMALIZERS: tuple = (
+        # temporary files and directories
+        (re.compile(r'(?:/var)?/tmp/[^\s\'",:)]+'), '<tmp>'),
+        (re.compile(r'\btmp[a-zA-Z0-9_]{6,}\b'), '<tmp>'),
+        # memory addresses
+        (re.compile(r'\b0x[0-9a-fA-F]+\b'), '0x?'),
+        # python traceback line numbers
+        (re.compile(r'\bline \d+'), 'line ?'),
+        # file:line references
+        (re.compile(r'(\.\w+):\d+(?::\d+)?\b'), r'\1:?'),
+    )
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        """
+        Removes the parts of a failure message or traceback that differ between otherwise identical failures.
+
+        :param text: The text to normalize.
+        :return: The normalized text.
+        """
+        # nothing to do on an empty value
+        if not text:
+            return ''
+
+        # apply each of the normalizations
+        for pattern, replacement in cls.NORMALIZERS:
+            text = pattern.sub(replacement, text)
+
+        # return to the caller
+        return text.strip()
+
+    @classmethod
+    def get_fingerprint(cls, detail: dict) -> str:
+        """
+        Gets the fingerprint of an error/failure detail.
+
+        :param detail: The detail attributes, including the text.
+        :return: The fingerprint.
+        """
+        # the type, message and traceback identify the failure
+        key: str = '\0'.join(cls.normalize(detail.get(name)) for name in ('type', 'message', 'text'))
+
+        # return to the caller
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    @classmethod
+    def group(cls, details: list, testcase_names: list) -> list:
+        """
+        Groups identical error/failure details.
+
+        Each group holds the first occurrence of the failure, its fingerprint,
+        the number of times it occurred and the names of the testcases that
+        hit it. Groups are in the order they were first seen.
+
+        :param details: The detail attributes, including the text.
+        :param testcase_names: The name of the testcase for each detail.
+        :return: The list of groups.
+        """
+        # init the groups by fingerprint
+        groups: dict = {}
+
+        # for each detail
+        for detail, testcase_name in zip(details, testcase_names):
+            # get the identity of the failure
+            fingerprint: str = cls.get_fingerprint(detail)
+
+            # is this the first time this one was seen
+            if fingerprint not in groups:
+                groups[fingerprint] = {**detail, 'fingerprint': fingerprint, 'count': 0, 'testcases': []}
+
+            # add this one to the group
+            groups[fingerprint]['count'] += 1
+            groups[fingerprint]['testcases'].append(testcase_name)
+
+        # return to the caller
+        return list(groups.values())
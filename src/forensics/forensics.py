@@ -8,12 +8,26 @@
 import os
 import time
 import json
+import sqlite3
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
-import xml.etree.ElementTree as ElTree
-
+from src.common import metrics
 from src.common.logger import LoggingUtil
 from src.common.pg_impl import PGImplementation
 from src.common.enum_utils import ReturnCodes
+from src.forensics.report_parser import ReportParser
+from src.forensics.watcher import DirectoryWatcher
+from src.forensics.report_tracker import ReportTracker
+from src.forensics.report_cache import ReportCache
+from src.forensics.text_limiter import TextLimiter
+from src.forensics.history import HistoryIndex
+from src.forensics.baseline import BaselineDiff
+from src.forensics.timings import TimingStats
+from src.forensics.shard_planner import ShardPlanner
+from src.forensics import profiler
+from src.forensics.poller import BackoffPoller
+from src.forensics.settings import ForensicsSettings
 
 
 class Forensics:
@@ -22,16 +36,29 @@ class Forensics:
 
     """
 
-    def __init__(self):
+    def __init__(self, db_info=None):
+        """
+        Init the forensics object
+
+        :param db_info: An optional object to use in place of the irods-sv DB connection, e.g. one set up by a caller. It must provide the
+                        PGImplementation methods used here.
+        """
         # get the app version
         self.app_version: str = os.getenv('APP_VERSION', 'Version number not set')
 
         # get the environment this instance is running on
         self.system: str = os.getenv('SYSTEM', 'System name not set')
 
-        # set the time limits (seconds)
-        self.max_wait: int = int(os.getenv('FORENSICS_MAX_WAIT', '600'))
-        self.check_interval: int = int(os.getenv('FORENSICS_CHECK_INTERVAL', '15'))
+        # get the run settings
+        self.settings: ForensicsSettings = ForensicsSettings.from_env()
+
+        # create the test report parser. the streaming mode keeps memory bounded on large reports. multiple reports are
+        # parsed with a process pool of up to FORENSICS_PARSE_WORKERS once there are FORENSICS_PARSE_PARALLEL_THRESHOLD of them.
+        # FORENSICS_GROUP_FAILURES saves each distinct error/failure once with a count rather than every occurrence
+        self.report_parser: ReportParser = ReportParser(os.getenv('FORENSICS_PARSE_MODE', 'stream'),
+                                                        int(os.getenv('FORENSICS_PARSE_WORKERS', str(os.cpu_count() or 1))),
+                                                        int(os.getenv('FORENSICS_PARSE_PARALLEL_THRESHOLD', '4')),
+                                                        os.getenv('FORENSICS_GROUP_FAILURES', 'false').lower() == 'true')
 
         # get the log level and directory from the environment.
         log_level, log_path = LoggingUtil.prep_for_logging()
@@ -39,12 +66,54 @@ class Forensics:
         # create a logger
         self.logger = LoggingUtil.init_logging("iRODS.Forensics", level=log_level, line_format='medium', log_file_path=log_path)
 
-        # specify the DB to get a connection
-        # note the extra comma makes this single item a singleton tuple
-        db_names: tuple = ('irods-sv',)
+        # use the DB given if there is one
+        if db_info is not None:
+            self.db_info: PGImplementation = db_info
+        else:
+            # specify the DB to get a connection
+            # note the extra comma makes this single item a singleton tuple
+            db_names: tuple = ('irods-sv',)
+
+            # create a DB connection object
+            self.db_info: PGImplementation = PGImplementation(db_names, _logger=self.logger)
+
+        # set the limits (KB, as UTF-8 bytes) on the error/failure text saved, the head and tail kept of each field and the total kept for a run.
+        # 0 is no limit. the full text of anything that is cut is saved in a side file in the run directory unless turned off
+        self.text_limiter: TextLimiter = TextLimiter(int(float(os.getenv('FORENSICS_TEXT_HEAD_KB', '0')) * 1024),
+                                                     int(float(os.getenv('FORENSICS_TEXT_TAIL_KB', '0')) * 1024),
+                                                     int(float(os.getenv('FORENSICS_TEXT_BUDGET_KB', '0')) * 1024),
+                                                     os.getenv('FORENSICS_TEXT_SPILL', 'true').lower() == 'true', self.logger)
+
+        # the head/tail limits are applied by the parser as the text is captured so the full text is never kept
+        self.report_parser.text_limiter = self.text_limiter
+
+        # set where the testcase outcome history across runs is kept, blank turns it off
+        history_db: str = os.getenv('FORENSICS_HISTORY_DB', '')
+
+        # create the history index
+        self.history: HistoryIndex = HistoryIndex(history_db, self.logger) if history_db else None
+
+        # set whether the testcase timing statistics and the FORENSICS_TIMING_TOP_N slowest testcases are added to each suite summary
+        self.timing_stats: TimingStats = None
+
+        if os.getenv('FORENSICS_TIMING_STATS', 'false').lower() == 'true':
+            self.timing_stats = TimingStats(int(os.getenv('FORENSICS_TIMING_TOP_N', '10')))
+
+        # set whether a balanced plan of the run's tests over its executors is written to the run directory for use on the next run
+        self.shard_planner: ShardPlanner = ShardPlanner() if os.getenv('FORENSICS_SHARD_PLAN', 'false').lower() == 'true' else None
 
-        # create a DB connection object
-        self.db_info: PGImplementation = PGImplementation(db_names, _logger=self.logger)
+        # set whether runs are compared with a baseline run. the baseline is the run request's baseline_run_id, or
+        # FORENSICS_BASELINE_RUN_ID if there is not one. each run's testcase results are saved in its run directory for this
+        self.baseline: BaselineDiff = None
+
+        if os.getenv('FORENSICS_BASELINE_DIFF', 'false').lower() == 'true':
+            self.baseline = BaselineDiff(float(os.getenv('FORENSICS_DIFF_SLOWER_RATIO', '1.5')),
+                                         float(os.getenv('FORENSICS_DIFF_SLOWER_MIN_SECS', '1')),
+                                         int(os.getenv('FORENSICS_DIFF_MAX_ITEMS', '500')), self.history, self.logger)
+
+        # the reports are parsed in this process when profiling so the parsing shows up in the profile
+        if self.settings.profile_kinds:
+            self.report_parser.workers = 1
 
     def run(self, run_id: str, run_dir: str) -> int:
         """
@@ -57,69 +126,65 @@ class Forensics:
 
         :return:
         """
+        # tag the log records of this run
+        context_token = LoggingUtil.set_context(run_id=run_id, stage='get_run_def')
+
         self.logger.info('Forensics version %s start: run_id: %s, run_dir: %s', self.app_version, run_id, run_dir)
 
         # init the return value
         ret_val: int = ReturnCodes.EXIT_CODE_SUCCESS
 
+        # make the metrics of this run current, if turned on
+        metrics_token = metrics.current_metrics.set(metrics.RunMetrics(run_id) if self.settings.metrics_enabled else None)
+
+        # start profiling the run, if turned on
+        run_profiler: profiler.RunProfiler = None
+
+        if self.settings.profile_kinds:
+            run_profiler = profiler.RunProfiler('cpu' in self.settings.profile_kinds, 'memory' in self.settings.profile_kinds,
+                                                self.settings.profile_top_n, _logger=self.logger)
+            run_profiler.start()
+
+        profiler_token = profiler.current_profiler.set(run_profiler)
+
         try:
             # make sure the directory exists
             if os.path.isdir(run_dir):
                 # get the run request record
-                run_data: json = self.db_info.get_run_def(run_id)
+                with metrics.stage('get_run_def'):
+                    run_data: json = self.db_info.get_run_def(run_id)
 
                 # did getting the data to go ok
                 if run_data != ReturnCodes.DB_ERROR:
-                    # get the test executor run location
-                    executor = next(iter(run_data['request_data']['tests']))
-
-                    # get the tests
-                    tests_requested = run_data['request_data']['tests'][executor]
+                    # get the test executors that have tests requested
+                    executors: list = [executor for executor, tests_requested in run_data['request_data']['tests'].items()
+                                       if len(tests_requested) > 0]
 
                     # if there were tests requested
-                    if len(tests_requested) > 0:
-                        # init the check counter
-                        count: int = 0
-
-                        # init the flag for processing complete
-                        keep_running: bool = True
-
-                        # get the full run directory
-                        full_run_dir: str = os.path.join(run_dir, run_id)
-
-                        # do work
-                        while keep_running:
-                            # get the list of tests for this run
-                            testing_complete: int = self.get_tests_done(full_run_dir, executor)
-
-                            # were the tests all completed?
-                            if testing_complete == ReturnCodes.TEST_RESULTS_FOUND:
-                                self.logger.info('End of testing marker found in: %s', full_run_dir)
-
-                                # parse the test reports found in <full_run_dir>\<test executor>\test-reports\
-                                ret_val = self.parse_test_reports(run_id, os.path.join(full_run_dir, executor))
-
-                                # no need to continue
-                                keep_running = False
-                            elif testing_complete == ReturnCodes.TEST_RESULTS_NOT_FOUND:
-                                self.logger.info('End of testing marker NOT found in: %s', full_run_dir)
-
-                                # have we exceeded the maximum wait time? default is 40 tries * 15 seconds
-                                if (count * self.check_interval) >= self.max_wait:
-                                    self.logger.error('Results max wait time of %s seconds exceeded for run id: %s, run_dir: %s.', self.max_wait,
-                                                      run_id, run_dir)
-
-                                    # set the error code
-                                    ret_val = ReturnCodes.ERROR_TIMEOUT
-
-                                    # no need to continue
-                                    break
-
-                                # increment the counter
-                                count += 1
-
-                                # keep waiting for the file that signifies testing complete
-                                time.sleep(self.check_interval)
+                    if len(executors) > 0:
+                        # get a copy of the run's context for each executor so they all record into the run metrics
+                        contexts: list = [contextvars.copy_context() for _ in executors]
+
+                        # watch and parse each executor concurrently, the results come back in executor order
+                        with ThreadPoolExecutor(max_workers=len(executors), thread_name_prefix='forensics') as pool:
+                            results: list = list(pool.map(lambda context, executor: context.run(profiler.call_profiled,
+                                                                                                  self.process_executor, run_id, run_dir,
+                                                                                                  executor, self.get_expected_duration(run_data)),
+                                                          contexts, executors))
+
+                        # find the first executor that had a problem, if any
+                        ret_val = next((ret_code for ret_code, _ in results if ret_code != ReturnCodes.EXIT_CODE_SUCCESS),
+                                       ReturnCodes.EXIT_CODE_SUCCESS)
+
+                        # if all went well
+                        if ret_val == ReturnCodes.EXIT_CODE_SUCCESS:
+                            # combine the summaries
+                            LoggingUtil.set_context(stage='summarize')
+
+                            run_summary: dict = self.merge_summaries(executors, [summary for _, summary in results])
+
+                            # finish up the combined summary and persist it
+                            ret_val = self.complete_run_summary(run_id, os.path.join(run_dir, run_id), run_data, run_summary)
                     else:
                         self.logger.error('Error: No tests found for run id: %s, run_dir: %s.', run_id, run_dir)
                         ret_val = ReturnCodes.ERROR_NO_TESTS
@@ -136,16 +201,154 @@ class Forensics:
             self.logger.exception('Exception: Error processing request for run id: %s, run_dir: %s', run_id, run_dir)
             ret_val = ReturnCodes.EXCEPTION_RUN_PROCESSING
 
-        # if there was an issue
-        if ret_val != ReturnCodes.EXIT_CODE_SUCCESS:
-            # persist the summary to the DB
-            ret_val = self.db_info.update_run_results(run_id, {'Error': ret_val})
+        # if there was an issue, persist it to the DB. the first executor's error is returned unless it could not be saved
+        if ret_val != ReturnCodes.EXIT_CODE_SUCCESS and self.db_info.update_run_results(run_id, {'Error': ret_val}) == ReturnCodes.DB_ERROR:
+            ret_val = ReturnCodes.DB_ERROR
+
+        # save the run metrics and put back the ones that were current before
+        self.save_metrics(os.path.join(run_dir, run_id))
+        metrics.current_metrics.reset(metrics_token)
+
+        # save the run profile, if turned on
+        if run_profiler is not None:
+            run_profiler.stop(os.path.join(run_dir, run_id))
+
+        profiler.current_profiler.reset(profiler_token)
 
         self.logger.info('Forensics complete: run_id: %s, run_dir: %s, ret_val: %s', run_id, run_dir, ret_val)
 
+        # put back the log context
+        LoggingUtil.reset_context(context_token)
+
         # return to the caller
         return ret_val
 
+    def process_executor(self, run_id: str, run_dir: str, executor: str, expected_duration: float = None) -> tuple:
+        """
+        Waits for an executor to complete its testing and parses the test reports it produced.
+
+        :param run_id: The id of the run.
+        :param run_dir: The directory path to use for the forensics operations.
+        :param executor: The name of the test executor.
+        :param expected_duration: The number of seconds the tests are expected to take, if known.
+        :return: A tuple of the return code and the executor's run summary.
+        """
+        # init the return values
+        ret_val: int = ReturnCodes.EXIT_CODE_SUCCESS
+        run_summary: dict = {}
+
+        # init the flag for processing complete
+        keep_running: bool = True
+
+        # get the full run directory
+        full_run_dir: str = os.path.join(run_dir, run_id)
+
+        # get the wait intervals, they start short and back off toward the check interval until the time at which waiting for
+        # the results gives up
+        poller = BackoffPoller(time.monotonic() + self.settings.max_wait, *self.settings.check_intervals, expected_duration)
+
+        # tag the log records of this executor, this thread has its own copy of the run's log context
+        LoggingUtil.set_context(executor=executor, stage='wait')
+
+        # create a tracker to collect the parsed reports, it will also parse them as they are completed if requested
+        tracker = ReportTracker(os.path.join(full_run_dir, executor, 'test-reports/'), self.report_parser, self.settings.report_settle_time,
+                                self.get_report_cache(full_run_dir), self.logger, full_run_dir)
+
+        # watch the run directory so the end of testing marker is seen as soon as it appears
+        with DirectoryWatcher(full_run_dir, self.settings.watch_mode, self.logger) as watcher:
+            # do work
+            while keep_running:
+                # get the list of tests for this run
+                metrics.count('marker_checks')
+
+                testing_complete: int = self.get_tests_done(full_run_dir, executor)
+
+                # were the tests all completed?
+                if testing_complete == ReturnCodes.TEST_RESULTS_FOUND:
+                    self.logger.info('End of testing marker found in: %s for %s', full_run_dir, executor)
+
+                    LoggingUtil.set_context(stage='parse_reports')
+
+                    # parse the test reports found in <full_run_dir>\<test executor>\test-reports\
+                    ret_val, run_summary = self.collect_test_reports(os.path.join(full_run_dir, executor), tracker)
+
+                    # no need to continue
+                    keep_running = False
+                elif testing_complete == ReturnCodes.TEST_RESULTS_NOT_FOUND:
+                    self.logger.debug('End of testing marker NOT found in: %s for %s', full_run_dir, executor)
+
+                    # have we exceeded the maximum wait time?
+                    if poller.remaining() <= 0:
+                        self.logger.error('Results max wait time of %s seconds exceeded for run id: %s, run_dir: %s, executor: %s.',
+                                          self.settings.max_wait, run_id, run_dir, executor)
+
+                        # set the error code
+                        ret_val = ReturnCodes.ERROR_TIMEOUT
+
+                        # no need to continue
+                        break
+
+                    # parse any reports that have been completed so far
+                    if self.settings.incremental_parse:
+                        with metrics.stage('poll_reports'):
+                            tracker.poll()
+
+                    # keep waiting for the file that signifies testing complete. this returns early on a directory change
+                    # and is a plain sleep where change notification is not available
+                    with metrics.stage('wait'):
+                        changed: bool = watcher.wait(poller.next_interval())
+
+                    # something is going on, check again soon if the marker did not show up
+                    if changed:
+                        poller.reset()
+
+        # return to the caller
+        return ret_val, run_summary
+
+    def merge_summaries(self, executors: list, summaries: list) -> dict:
+        """
+        Merges the run summaries of the test executors into one.
+
+        Test suites are keyed by name as they always have been. If the same
+        test suite name is reported by more than one executor the later ones
+        are prefixed with the executor name so nothing is lost.
+
+        :param executors: The names of the test executors.
+        :param summaries: The run summaries, in the same order as the executors.
+        :return: The merged run summary.
+        """
+        # init the return value
+        ret_val: dict = {}
+
+        # for each executor's summary
+        for executor, summary in zip(executors, summaries):
+            # for each test suite summary
+            for suite_name, suite_data in summary.items():
+                # is this name already in use by another executor
+                if suite_name in ret_val:
+                    self.logger.warning('Test suite %s reported by more than one executor, saving %s results as %s:%s.', suite_name,
+                                        executor, executor, suite_name)
+
+                    # make the name unique
+                    suite_name = f'{executor}:{suite_name}'
+
+                # save the test suite summary
+                ret_val[suite_name] = suite_data
+
+        # return to the caller
+        return ret_val
+
+    @staticmethod
+    def get_expected_duration(run_data: dict):
+        """
+        Gets how long the tests of a run are expected to take, from the optional expected_duration (seconds) of the run request.
+
+        :param run_data: The run request record.
+        :return: The number of seconds or None if it is not known.
+        """
+        # return to the caller
+        return float(run_data['request_data'].get('expected_duration') or 0) or None
+
     @staticmethod
     def get_tests_done(full_run_dir, executor: str) -> ReturnCodes:
         """
@@ -158,56 +361,444 @@ class Forensics:
         # init the retval
         ret_val: ReturnCodes = ReturnCodes.TEST_RESULTS_NOT_FOUND
 
-        # if the end of test marker found
-        if os.path.isfile(os.path.join(full_run_dir, f'{executor}_tests.complete')):
-            # set the success return code
-            ret_val = ReturnCodes.TEST_RESULTS_FOUND
+        # get the name of the end of test marker
+        marker: str = f'{executor}_tests.complete'
+
+        try:
+            # look for the marker in one pass over the directory, the entry types come with the listing
+            with os.scandir(full_run_dir) as entries:
+                if any(entry.name == marker and entry.is_file() for entry in entries):
+                    # set the success return code
+                    ret_val = ReturnCodes.TEST_RESULTS_FOUND
+        except OSError:
+            # the run directory is not there (yet)
+            pass
 
         # return to the caller
         return ret_val
 
-    def parse_test_reports(self, run_id: str, full_run_dir: str) -> ReturnCodes:
+    def get_report_cache(self, full_run_dir: str):
         """
-        Parses the test reports
+        Gets the parse result cache to use for a run, if caching is turned on.
+
+        :param full_run_dir: The run directory, i.e. <run_dir>/<run_id>.
+        :return: The report cache or None.
+        """
+        # caching is off
+        if not self.settings.report_cache_dir:
+            return None
+
+        # get the cache directory, the run's own or a shared one
+        cache_dir: str = os.path.join(full_run_dir, '.forensics-cache') if self.settings.report_cache_dir == 'run' else self.settings.report_cache_dir
+
+        # return to the caller
+        return ReportCache(cache_dir, self.settings.report_cache_max_bytes, self.report_parser.get_fingerprint(), self.logger)
+
+    def parse_test_reports(self, run_id: str, full_run_dir: str, tracker: ReportTracker = None) -> ReturnCodes:
+        """
+        Parses the test reports and persists the summary
 
         :param run_id:
         :param full_run_dir:
+        :param tracker: An optional report tracker holding the reports already parsed while the tests were running.
+        :return:
+        """
+        # parse the reports
+        ret_val, run_summary = self.collect_test_reports(full_run_dir, tracker)
+
+        # if the reports were parsed finish up the summary and persist it. there is no run request here
+        if ret_val == ReturnCodes.EXIT_CODE_SUCCESS:
+            ret_val = self.complete_run_summary(run_id, full_run_dir, None, run_summary)
+
+        # return to the caller
+        return ret_val
+
+    def complete_run_summary(self, run_id: str, full_run_dir: str, run_data, run_summary: dict) -> int:
+        """
+        Runs the stages that follow the parsing of a run's reports: the timing statistics and text limits are applied to the
+        summary, the run is compared with the baseline, the summary is persisted, and on success the run is added to the test
+        history and the next run planned.
+
+        :param run_id: The id of the run.
+        :param full_run_dir: The run directory, i.e. <run_dir>/<run_id>, where the side files of the run are saved.
+        :param run_data: The run request record or None if there is not one, in which case the stages that need it are skipped.
+        :param run_summary: The run summary, updated in place.
+        :return: The result of persisting the summary.
+        """
+        # add the testcase timing statistics
+        with metrics.stage('timing_stats'):
+            self.add_timing_stats(run_summary)
+
+        # keep the size of the error/failure text in check
+        with metrics.stage('limit_text'):
+            self.limit_run_text(run_summary, full_run_dir)
+
+        # compare the results with the baseline run
+        with metrics.stage('baseline_diff'):
+            self.diff_baseline(run_id, full_run_dir, run_data, run_summary)
+
+        # persist the summary to the DB
+        LoggingUtil.set_context(stage='persist')
+
+        with metrics.stage('persist'):
+            ret_val: int = self.persist_run_summary(run_id, run_summary)
+
+        # see the peak memory use of the run, if profiling
+        profiler.take_snapshot('persist')
+
+        # add the run to the test history and plan the next run with the timings
+        if ret_val == ReturnCodes.EXIT_CODE_SUCCESS:
+            with metrics.stage('history'):
+                self.record_history(run_id, run_summary)
+
+            # the plan is made from the tests requested
+            if run_data is not None:
+                with metrics.stage('shard_plan'):
+                    self.plan_shards(full_run_dir, run_data, run_summary)
+
+        # return to the caller
+        return ret_val
+
+    @staticmethod
+    def get_run_testcases(run_summary: dict) -> dict:
+        """
+        Gets the per testcase data of each test suite in the run summary.
+
+        :param run_summary: The run summary.
+        :return: The per testcase data, by test suite name.
+        """
+        # return to the caller
+        return {suite_name: suite_data[ReportParser.TESTCASES_KEY] for suite_name, suite_data in run_summary.items()
+                if isinstance(suite_data, dict) and ReportParser.TESTCASES_KEY in suite_data}
+
+    def add_timing_stats(self, run_summary: dict):
+        """
+        Adds the testcase timing statistics to each test suite summary, if turned on.
+
+        :param run_summary: The run summary, updated in place.
+        :return:
+        """
+        # are the statistics turned on
+        if self.timing_stats is not None:
+            # for each test suite with testcases
+            for suite_name, testcases in self.get_run_testcases(run_summary).items():
+                # get the statistics
+                stats: dict = self.timing_stats.get_stats(testcases)
+
+                # save them if there are any
+                if stats:
+                    run_summary[suite_name]['timing'] = stats
+
+    def diff_baseline(self, run_id: str, full_run_dir: str, run_data, run_summary: dict):
+        """
+        Compares the testcase results of the run with the baseline run, if turned on.
+
+        The comparison is saved as forensics-baseline-diff.json in the run directory, next to the run's testcase results, rather
+        than in the run summary, which only holds test suites.
+
+        :param run_id: The id of the run.
+        :param full_run_dir: The run directory, i.e. <run_dir>/<run_id>. The baseline run is looked for next to it.
+        :param run_data: The run request record or None if there is not one.
+        :param run_summary: The run summary.
+        :return:
+        """
+        # is the comparison turned on
+        if self.baseline is None:
+            return
+
+        # get the results of this run
+        testcases: dict = self.get_run_testcases(run_summary)
+
+        # save them so this run can be used as a baseline
+        self.baseline.save(full_run_dir, testcases)
+
+        # get the baseline run to compare with
+        baseline_run_id: str = str((run_data or {}).get('request_data', {}).get('baseline_run_id') or self.settings.baseline_run_id)
+
+        # nothing to compare with
+        if not baseline_run_id or baseline_run_id == run_id:
+            return
+
+        # load the baseline results
+        source, baseline_testcases = self.baseline.load(os.path.dirname(os.path.normpath(full_run_dir)), baseline_run_id)
+
+        # if they were found
+        if source is not None:
+            # compare the results
+            diff: dict = {'baseline_run_id': baseline_run_id, 'source': source, **self.baseline.compare(testcases, baseline_testcases)}
+
+            self.logger.info('Baseline run id: %s comparison for run id: %s: %s newly failing, %s newly passing, %s slower.',
+                             baseline_run_id, run_id, diff['newly_failing_count'], diff['newly_passing_count'], diff['slower_count'])
+
+            # save the comparison in the run directory
+            if self.baseline.save_diff(full_run_dir, diff):
+                self.logger.info('Baseline comparison saved in: %s', os.path.join(full_run_dir, BaselineDiff.DIFF_FILE))
+        else:
+            self.logger.warning('Baseline run id: %s results were not found for run id: %s.', baseline_run_id, run_id)
+
+    def plan_shards(self, full_run_dir: str, run_data: dict, run_summary: dict):
+        """
+        Writes a plan of the run's tests spread evenly over its executors, by test duration, if turned on.
+
+        The plan is saved as forensics-shard-plan.json in the run directory in the
+        same shape as request_data['tests']. Test durations are the recent
+        averages from the test history if it is turned on, otherwise the
+        durations in this run. A test is matched to the test suite of the same
+        name, including the suites saved as <executor>:<suite> by merge_summaries.
+        No plan is written if none of the tests have a duration.
+
+        :param full_run_dir: The run directory, i.e. <run_dir>/<run_id>.
+        :param run_data: The run request record.
+        :param run_summary: The run summary.
         :return:
         """
+        # is the planning turned on
+        if self.shard_planner is None:
+            return
+
+        # get the tests requested of each executor that had tests
+        current: dict = {executor: tests for executor, tests in run_data['request_data']['tests'].items() if len(tests) > 0}
+
+        # get all the tests, and all the executors since any of them may have saved a suite under its name
+        tests: list = list(dict.fromkeys(test for executor_tests in current.values() for test in executor_tests))
+        executors: list = list(run_data['request_data']['tests'].keys())
+
+        # init the test durations
+        durations: dict = {}
+
+        # get the recent averages from the history if there is one, the suites may be recorded under the plain or executor:suite names
+        if self.history is not None:
+            suite_names: list = tests + [f'{executor}:{test}' for executor in executors for test in tests]
+
+            try:
+                durations = self.get_test_durations(self.history.get_suite_durations(suite_names, self.settings.shard_plan_runs), executors)
+            except sqlite3.Error:
+                self.logger.exception('Exception: Error getting the test durations from the test history.')
+
+        # else use this run's suite totals
+        if not durations:
+            durations = self.get_test_durations({suite_name: sum(testcases['times'])
+                                                 for suite_name, testcases in self.get_run_testcases(run_summary).items()}, executors)
+
+        # a plan with no durations to go on would be arbitrary
+        if not any(durations.get(test) for test in tests):
+            self.logger.warning('No test durations found for the tests of: %s, the shard plan is not saved.', full_run_dir)
+            return
+
+        # plan the run
+        assignments, loads = self.shard_planner.plan(tests, list(current.keys()), durations)
+
+        self.logger.info('Shard plan for: %s: expected time %.1f seconds, currently %.1f seconds. Executor times: %s', full_run_dir,
+                         max(loads.values(), default=0.0), self.shard_planner.get_makespan(current, durations), loads)
+
+        try:
+            # save the plan
+            with open(os.path.join(full_run_dir, 'forensics-shard-plan.json'), 'w', encoding='utf-8') as fp:
+                json.dump(assignments, fp, indent=2)
+        except OSError:
+            self.logger.exception('Exception: Error saving the shard plan in: %s', full_run_dir)
+
+    @staticmethod
+    def get_test_durations(suite_durations: dict, executors: list) -> dict:
+        """
+        Gets the test durations from test suite durations, adding the durations of a suite saved as <executor>:<suite> to the
+        suite's own.
+
+        :param suite_durations: The durations (seconds), by test suite name.
+        :param executors: The names of the run's executors.
+        :return: The durations (seconds), by test name.
+        """
+        # init the return value
+        ret_val: dict = {}
+
+        # for each test suite
+        for suite_name, duration in suite_durations.items():
+            # remove the executor prefix if there is one
+            prefix, _, name = suite_name.partition(':')
+
+            if not name or prefix not in executors:
+                name = suite_name
+
+            # add it to the test
+            ret_val[name] = ret_val.get(name, 0.0) + duration
+
+        # return to the caller
+        return ret_val
+
+    def record_history(self, run_id: str, run_summary: dict):
+        """
+        Adds the testcase outcomes of a run to the test history, if it is turned on.
+
+        Problems are logged and do not affect the result of the run.
+
+        :param run_id: The id of the run.
+        :param run_summary: The run summary.
+        :return:
+        """
+        # is the history turned on
+        if self.history is not None:
+            try:
+                # save the results
+                count: int = self.history.record_run(run_id, self.get_run_testcases(run_summary))
+
+                self.logger.debug('%s testcase results added to the test history for run id: %s', count, run_id)
+            except sqlite3.Error:
+                self.logger.exception('Exception: Error adding run id: %s to the test history.', run_id)
+
+    def limit_run_text(self, run_summary: dict, full_run_dir: str):
+        """
+        Limits the size of the error/failure text in the run summary, if limits are set.
+
+        :param run_summary: The run summary, updated in place.
+        :param full_run_dir: The run directory, where the full text of anything cut is saved.
+        :return:
+        """
+        # are there limits to apply
+        if self.text_limiter.is_enabled():
+            # apply them
+            count: int = self.text_limiter.apply(run_summary, full_run_dir)
+
+            # let someone know
+            if count > 0:
+                self.logger.info('%s error/failure text fields were cut to size in: %s', count, full_run_dir)
+
+    def persist_run_summary(self, run_id: str, run_summary: dict):
+        """
+        Persists the run summary to the DB.
+
+        If streaming of the details is turned on the error/failure details are
+        streamed into the run result details table first, and the summary sent
+        on its own with a count of the details in place of each details list.
+        If that fails the complete summary is sent as usual.
+
+        :param run_id: The id of the run.
+        :param run_summary: The run summary.
+        :return: The result of the DB update.
+        """
+        # the per testcase data is for the later stages only, it is not saved with the summary
+        run_summary = {suite_name: {key: value for key, value in suite_data.items() if key != ReportParser.TESTCASES_KEY}
+                       if isinstance(suite_data, dict) else suite_data for suite_name, suite_data in run_summary.items()}
+
+        # are the details to be streamed separately
+        if self.settings.stream_details:
+            # init the summary headers
+            headers: dict = {}
+
+            # for each test suite
+            for suite_name, suite_data in run_summary.items():
+                # copy everything except the details
+                headers[suite_name] = {key: value for key, value in suite_data.items() if not key.endswith('_details')}
+
+                # note how many details there are of each type
+                for tag in ReportParser.CAPTURED_TAGS:
+                    if f'{tag}_details' in suite_data:
+                        headers[suite_name][f'{tag}_details_count'] = len(suite_data[f'{tag}_details'])
+
+            # get the details, one record at a time
+            details = ((suite_name, tag, detail) for suite_name, suite_data in run_summary.items() for tag in ReportParser.CAPTURED_TAGS
+                       for detail in suite_data.get(f'{tag}_details', []))
+
+            # stream the details in
+            count: int = self.db_info.update_run_details(run_id, details)
+
+            # if that worked send the headers
+            if count >= 0:
+                self.logger.debug('%s result details saved for run id: %s', count, run_id)
+
+                # return to the caller
+                return self.db_info.update_run_results(run_id, headers)
+
+            self.logger.warning('Streaming the result details failed for run id: %s, sending the complete summary.', run_id)
+
+        # return to the caller
+        return self.db_info.update_run_results(run_id, run_summary)
+
+    def save_metrics(self, full_run_dir: str):
+        """
+        Saves the metrics of the current run, if there are any, as forensics-metrics.json in the run directory and in the
+        Prometheus textfile if one is set.
+
+        Problems are logged and do not affect the result of the run.
+
+        :param full_run_dir: The run directory, i.e. <run_dir>/<run_id>.
+        :return:
+        """
+        # get the metrics of the run
+        run_metrics: metrics.RunMetrics = metrics.get_current()
+
+        # nothing to do if they are turned off
+        if run_metrics is None:
+            return
+
+        try:
+            # save them with the run if the run directory is there
+            if os.path.isdir(full_run_dir):
+                record: dict = run_metrics.write(os.path.join(full_run_dir, 'forensics-metrics.json'))
+            else:
+                record: dict = run_metrics.get_record()
+
+            # save them for the node metrics collector
+            if self.settings.metrics_textfile:
+                run_metrics.write(self.settings.metrics_textfile)
+
+            self.logger.info('Run metrics for run id: %s: %s', run_metrics.run_id, json.dumps(record, separators=(',', ':')))
+        except OSError:
+            self.logger.exception('Exception: Error saving the run metrics in: %s', full_run_dir)
+
+    def collect_test_reports(self, full_run_dir: str, tracker: ReportTracker = None) -> tuple:
+        """
+        Parses the test reports into a run summary
+
+        :param full_run_dir:
+        :param tracker: An optional report tracker holding the reports already parsed while the tests were running.
+        :return: A tuple of the return code and the run summary.
+        """
         # init the return
         ret_val: ReturnCodes = ReturnCodes.ERROR_RESULT_PARSE_FAILURE
 
+        # init the summary data variable
+        run_summary: dict = {}
+
         # append the test reports directory to the path
         test_reports_dir = os.path.join(full_run_dir, 'test-reports/')
 
         # check if the directory exists
         if os.path.isdir(test_reports_dir):
-            # get the files to parse
-            files: list = [file for file in os.listdir(test_reports_dir) if file.endswith('.xml')]
+            # get the reports (plain, gzipped or archived) to parse. they are sorted so the summary is always built in the same order
+            with metrics.stage('list_reports'):
+                files: list = sorted(file for file in os.listdir(test_reports_dir) if ReportParser.is_report(file))
 
-            # were there any xml files?
+            # were there any report files?
             if len(files):
-                # init the summary data variable
-                run_summary: dict = {}
+                # get the full paths to the files
+                file_paths: list = [os.path.join(test_reports_dir, file) for file in files]
+
+                # use a tracker on the parent run directory if one was not given
+                if tracker is None:
+                    tracker = ReportTracker(test_reports_dir, self.report_parser, self.settings.report_settle_time,
+                                            self.get_report_cache(os.path.dirname(os.path.normpath(full_run_dir))), self.logger, full_run_dir)
 
-                # for each file in the test results directory
-                for file in files:
-                    # parse the xml file
-                    tree = ElTree.parse(os.path.join(test_reports_dir, file))
+                # parse the xml files that were not already parsed, using the process pool if there are enough of them
+                with metrics.stage('parse_reports'):
+                    results: list = tracker.collect(file_paths)
 
-                    # get root element of the XML
-                    root = tree.getroot()
+                # see what memory the parsing left behind, if profiling
+                profiler.take_snapshot('parse_reports')
 
-                    # capture the summary data on the root element in the XML
-                    run_summary[root.attrib['name']] = root.attrib
+                # for each parsed file in the test results directory, an archive may hold many reports
+                for result in results:
+                    for suite_name, suite_data in result:
+                        # capture the summary data for the test suite
+                        run_summary[suite_name] = suite_data
 
-                    # capture the data at these tags if it exists
-                    for tag in ['error', 'failure']:
-                        # get the data and save it if it exists
-                        self.get_tag_data(root, run_summary, tag)
+                # count what was read, if the run metrics are turned on
+                if metrics.get_current() is not None:
+                    metrics.count('report_files', len(file_paths))
+                    metrics.count('report_bytes', sum(os.path.getsize(file_path) for file_path in file_paths))
+                    metrics.count('testcases', sum(len(testcases['names']) for testcases in self.get_run_testcases(run_summary).values()))
 
-                # persist the summary to the DB
-                ret_val = self.db_info.update_run_results(run_id, run_summary)
+                # set the return code
+                ret_val = ReturnCodes.EXIT_CODE_SUCCESS
             else:
                 # set the return code
                 ret_val = ReturnCodes.ERROR_NO_RESULT_DATA
@@ -216,30 +807,4 @@ class Forensics:
             ret_val = ReturnCodes.ERROR_NO_RESULT_DIR
 
         # return to the caller
-        return ret_val
-
-    @staticmethod
-    def get_tag_data(root: ElTree.Element, run_summary: dict, tag: str):
-        """
-        gets the data at the tag specified
-
-        :param root:
-        :param run_summary:
-        :param tag:
-        :return:
-        """
-        # get a list of the errors
-        data = root.findall(f"./testcase/{tag}")
-
-        # if there were any found
-        if data:
-            # add on a list for the entries
-            run_summary[root.attrib['name']].update({f'{tag}_details': []})
-
-            # for each entry
-            for item in data:
-                # flatten out the elements
-                item.attrib.update({'text': item.text})
-
-                # add the entry into the list
-                run_summary[root.attrib['name']][f'{tag}_details'].extend([item.attrib])
+        return ret_val, run_summary
@@ -0,0 +1,240 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Cross-run test history for the forensics microservice.
+
+    The outcome and duration of every testcase in every run are kept in a
+    small SQLite database, keyed by (test suite, testcase, run). Runs are
+    numbered in the order they are recorded so the recent history of a test
+    is a single index range scan, which keeps questions like "how flaky has
+    this test been over the last 50 runs" in the millisecond range no matter
+    how much history has built up.
+"""
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class HistoryIndex:
+    """
+    Class that records and queries the test outcome history
+
+    """
+    # the outcome codes stored in the DB
+    OUTCOMES: dict = {'passed': 0, 'failure': 1, 'error': 2, 'skipped': 3}
+
+    # the DB schema
+    SCHEMA: tuple = (
+        'CREATE TABLE IF NOT EXISTS runs (run_seq INTEGER PRIMARY KEY, run_id TEXT NOT NULL UNIQUE, recorded REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS tests (test_id INTEGER PRIMARY KEY, suite_name TEXT NOT NULL, testcase_name TEXT NOT NULL, '
+        'UNIQUE (suite_name, testcase_name))',
+        'CREATE TABLE IF NOT EXISTS results (test_id INTEGER NOT NULL, run_seq INTEGER NOT NULL, outcome INTEGER NOT NULL, '
+        'duration REAL NOT NULL, PRIMARY KEY (test_id, run_seq)) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS results_run_seq ON results (run_seq)',
+    )
+
+    def __init__(self, db_path: str, _logger=None):
+        """
+        Init the test history
+
+        :param db_path: The path of the SQLite DB file.
+        :param _logger: A logger to use for reporting.
+        """
+        # save the params
+        self.db_path: str = db_path
+        self.logger = _logger
+
+        # the lock used to keep to one writer in this process
+        self.lock: threading.Lock = threading.Lock()
+
+        # create the schema
+        with self.lock, self.get_connection() as conn:
+            for sql_stmt in self.SCHEMA:
+                conn.execute(sql_stmt)
+
+    @contextmanager
+    def get_connection(self):
+        """
+        Opens a connection to the history DB for a single transaction.
+
+        :return: A context manager that gives the connection, commits (or rolls back) and closes it.
+        """
+        # open the DB, waiting a while if another process is writing to it
+        conn: sqlite3.Connection = sqlite3.connect(self.db_path, timeout=30)
+
+        try:
+            # allow readers while a run is being recorded
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+
+            # return the connection to the caller inside a transaction
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record_run(self, run_id: str, testcases: dict) -> int:
+        """
+        Records the testcase outcomes of a run. Recording a run again replaces its results.
+
+        :param run_id: The id of the run.
+        :param testcases: The per testcase data of each test suite (see ReportParser.TESTCASES_KEY), by test suite name.
+        :return: The number of results recorded.
+        """
+        # init the return value
+        ret_val: int = 0
+
+        with self.lock, self.get_connection() as conn:
+            # get the run's sequence number, adding the run if it is new
+            conn.execute('INSERT OR IGNORE INTO runs (run_id, recorded) VALUES (?, ?)', (run_id, time.time()))
+            run_seq: int = conn.execute('SELECT run_seq FROM runs WHERE run_id = ?', (run_id,)).fetchone()[0]
+
+            # remove anything recorded for this run before
+            conn.execute('DELETE FROM results WHERE run_seq = ?', (run_seq,))
+
+            # for each test suite
+            for suite_name, suite_testcases in testcases.items():
+                # add any testcases not seen before
+                conn.executemany('INSERT OR IGNORE INTO tests (suite_name, testcase_name) VALUES (?, ?)',
+                                 ((suite_name, name) for name in suite_testcases['names']))
+
+                # get the ids of the suite's testcases
+                test_ids: dict = dict(conn.execute('SELECT testcase_name, test_id FROM tests WHERE suite_name = ?', (suite_name,)))
+
+                # save the results. a testcase name repeated in a suite keeps the last result
+                conn.executemany('INSERT OR REPLACE INTO results (test_id, run_seq, outcome, duration) VALUES (?, ?, ?, ?)',
+                                 ((test_ids[name], run_seq, self.OUTCOMES.get(outcome, self.OUTCOMES['error']), duration)
+                                  for name, outcome, duration in zip(suite_testcases['names'], suite_testcases['outcomes'],
+                                                                     suite_testcases['times'])))
+
+                # count them
+                ret_val += len(suite_testcases['names'])
+
+        # return to the caller
+        return ret_val
+
+    def get_recent_results(self, suite_name: str, testcase_name: str, last_runs: int = 50) -> list:
+        """
+        Gets the most recent results of a testcase.
+
+        :param suite_name: The name of the test suite.
+        :param testcase_name: The name of the testcase.
+        :param last_runs: The number of runs to look back over.
+        :return: A list of (run id, outcome, duration) tuples, oldest first.
+        """
+        # get the outcome names by code
+        outcome_names: dict = {code: name for name, code in self.OUTCOMES.items()}
+
+        with self.get_connection() as conn:
+            # get the results, newest first so the scan stops after last_runs
+            rows: list = conn.execute('SELECT runs.run_id, results.outcome, results.duration FROM tests '
+                                      'JOIN results ON results.test_id = tests.test_id '
+                                      'JOIN runs ON runs.run_seq = results.run_seq '
+                                      'WHERE tests.suite_name = ? AND tests.testcase_name = ? '
+                                      'ORDER BY results.run_seq DESC LIMIT ?', (suite_name, testcase_name, last_runs)).fetchall()
+
+        # return to the caller
+        return [(run_id, outcome_names[outcome], duration) for run_id, outcome, duration in reversed(rows)]
+
+    def get_flakiness(self, suite_name: str, testcase_name: str, last_runs: int = 50) -> dict:
+        """
+        Gets how flaky a testcase has been over its most recent runs.
+
+        Skipped runs are ignored. The flip rate is the fraction of consecutive
+        runs where the testcase went from passing to not passing or back, so a
+        test that is consistently broken has a high failure rate but a low flip
+        rate, and a flaky one has a high flip rate.
+
+        :param suite_name: The name of the test suite.
+        :param testcase_name: The name of the testcase.
+        :param last_runs: The number of runs to look back over.
+        :return: A dict of the run count, failure count, failure rate, flip count, flip rate and the run the current failing
+                 streak started in, if it is failing.
+        """
+        # get the pass/fail history, oldest first
+        history: list = [(run_id, outcome == 'passed') for run_id, outcome, _ in self.get_recent_results(suite_name, testcase_name, last_runs)
+                          if outcome != 'skipped']
+
+        # count the failures and the changes between passing and failing
+        failures: int = sum(1 for _, passed in history if not passed)
+        flips: int = sum(1 for (_, previous), (_, current) in zip(history, history[1:]) if previous != current)
+
+        # find where the current failing streak started
+        failing_since = None
+
+        for run_id, passed in reversed(history):
+            if passed:
+                break
+
+            failing_since = run_id
+
+        # return to the caller
+        return {'runs': len(history), 'failures': failures, 'failure_rate': failures / len(history) if history else 0.0, 'flips': flips,
+                'flip_rate': flips / (len(history) - 1) if len(history) > 1 else 0.0, 'failing_since': failing_since}
+
+    def get_run_results(self, run_id: str) -> dict:
+        """
+        Gets the testcase outcomes of a recorded run.
+
+        :param run_id: The id of the run.
+        :return: The per testcase data of each test suite (see ReportParser.TESTCASES_KEY), by test suite name. Empty if the run
+                 was not recorded.
+        """
+        # init the return value
+        ret_val: dict = {}
+
+        # get the outcome names by code
+        outcome_names: dict = {code: name for name, code in self.OUTCOMES.items()}
+
+        with self.get_connection() as conn:
+            # get the results of the run
+            rows = conn.execute('SELECT tests.suite_name, tests.testcase_name, results.outcome, results.duration FROM runs '
+                                'JOIN results ON results.run_seq = runs.run_seq '
+                                'JOIN tests ON tests.test_id = results.test_id '
+                                'WHERE runs.run_id = ?', (run_id,))
+
+            # put them back into the per testcase data layout
+            for suite_name, testcase_name, outcome, duration in rows:
+                testcases: dict = ret_val.setdefault(suite_name, {'names': [], 'outcomes': [], 'times': []})
+
+                testcases['names'].append(testcase_name)
+                testcases['outcomes'].append(outcome_names[outcome])
+                testcases['times'].append(duration)
+
+        # return to the caller
+        return ret_val
+
+    def get_suite_durations(self, suite_names: list, last_runs: int = 5) -> dict:
+        """
+        Gets the average total duration of test suites over their most recent runs.
+
+        :param suite_names: The names of the test suites.
+        :param last_runs: The number of runs to average over.
+        :return: The average duration (seconds), by test suite name. Suites that were never recorded are left out.
+        """
+        # init the run totals of each suite, newest first
+        totals: dict = {}
+
+        # nothing to look up
+        if not suite_names:
+            return totals
+
+        with self.get_connection() as conn:
+            # get the suite totals of each run, newest first
+            rows = conn.execute(f'SELECT tests.suite_name, SUM(results.duration) FROM tests '
+                                f'JOIN results ON results.test_id = tests.test_id '
+                                f'WHERE tests.suite_name IN ({", ".join("?" * len(suite_names))}) '
+                                f'GROUP BY tests.suite_name, results.run_seq ORDER BY results.run_seq DESC', tuple(suite_names))
+
+            # keep the most recent runs of each suite
+            for suite_name, duration in rows:
+                suite_totals: list = totals.setdefault(suite_name, [])
+
+                if len(suite_totals) < last_runs:
+                    suite_totals.append(duration)
+
+        # return to the caller
+        return {suite_name: sum(suite_totals) / len(suite_totals) for suite_name, suite_totals in totals.items()}
@@ -0,0 +1,88 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Adaptive polling intervals for the forensics microservice wait loop.
+
+    Checking for the end of testing marker at a fixed interval either finds it
+    late on short runs or checks far too often on long ones. The poller
+    starts with short intervals that grow by a factor up to a cap. If the run
+    is expected to take a known time, the intervals are half of the time left
+    until then (within the same limits) so the checks close in on the expected
+    end, after which they back off again from the shortest interval. All
+    times come from the monotonic clock and no interval goes past the
+    deadline.
+"""
+import time
+
+
+class BackoffPoller:
+    """
+    Class that gives the intervals to wait between checks
+
+    """
+
+    def __init__(self, deadline: float, min_interval: float = 1.0, max_interval: float = 15.0, factor: float = 1.5,
+                 expected_duration: float = None):
+        """
+        Init the poller
+
+        :param deadline: The monotonic time at which waiting gives up.
+        :param min_interval: The first and shortest interval (seconds).
+        :param max_interval: The longest interval (seconds).
+        :param factor: How much each interval grows over the last one.
+        :param expected_duration: The number of seconds from now the wait is expected to end, if known.
+        """
+        # save the params
+        self.deadline: float = deadline
+        self.min_interval: float = min(min_interval, max_interval)
+        self.max_interval: float = max_interval
+        self.factor: float = max(factor, 1.0)
+
+        # get the expected end time, if there is one
+        self.expected_end: float = None
+
+        if expected_duration is not None and expected_duration > 0:
+            self.expected_end = time.monotonic() + expected_duration
+
+        # init the next backoff interval
+        self.interval: float = self.min_interval
+
+    def remaining(self) -> float:
+        """
+        Gets the time left before the deadline.
+
+        :return: The number of seconds left, 0 or less when the deadline has passed.
+        """
+        # return to the caller
+        return self.deadline - time.monotonic()
+
+    def reset(self):
+        """
+        Goes back to the shortest interval, e.g. after a sign of activity.
+
+        :return:
+        """
+        self.interval = self.min_interval
+
+    def next_interval(self) -> float:
+        """
+        Gets the time to wait before the next check.
+
+        :return: The number of seconds to wait, never past the deadline.
+        """
+        # get the current time
+        now: float = time.monotonic()
+
+        # close in on the expected end if it is still ahead
+        if self.expected_end is not None and now < self.expected_end:
+            ret_val: float = min(self.max_interval, max(self.min_interval, (self.expected_end - now) / 2))
+        else:
+            # use the next backoff interval and grow it for the time after
+            ret_val: float = self.interval
+
+            self.interval = min(self.interval * self.factor, self.max_interval)
+
+        # return to the caller
+        return max(min(ret_val, self.deadline - now), 0.0)
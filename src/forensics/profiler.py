@@ -0,0 +1,273 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Opt-in run profiling for the forensics microservice.
+
+    A RunProfiler captures a cProfile profile of a run and/or tracemalloc
+    snapshots of the memory held at points of interest, e.g. after the
+    reports are parsed. Like the run metrics it is made current for the run
+    with a context variable, and each thread of the run is profiled
+    separately with the results merged when the run ends. The output is
+    written into the run directory so it can be pulled off the pod:
+     - forensics-profile.pstats: the merged profile, for pstats/snakeviz,
+     - forensics-profile.txt: the top functions by cumulative time,
+     - forensics-memory.txt: the top allocation sites of each snapshot.
+
+    The text reports hold a fixed number of lines and the number of
+    snapshots is capped, which bounds the output size.
+
+    tracemalloc is process wide. When several runs are profiled at once, e.g.
+    in service mode, it is started by the first profiler and only stopped
+    when the last one finishes. The memory reports then include the
+    allocations of the other runs.
+"""
+import io
+import os
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import contextvars
+
+# the profiler of the current run
+current_profiler: contextvars.ContextVar = contextvars.ContextVar('current_profiler', default=None)
+
+
+class RunProfiler:
+    """
+    Class that profiles the CPU time and memory use of a run
+
+    """
+    # the maximum number of memory snapshots kept
+    MAX_SNAPSHOTS: int = 8
+
+    # the number of profilers tracing memory, whether tracemalloc was started by them, and the lock used to update those
+    tracing_count: int = 0
+    started_tracing: bool = False
+    tracing_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, cpu: bool = True, memory: bool = True, top_n: int = 50, frames: int = 5, _logger=None):
+        """
+        Init the run profiler
+
+        :param cpu: True to profile the CPU time.
+        :param memory: True to take memory snapshots.
+        :param top_n: The number of functions and allocation sites listed in the reports.
+        :param frames: The number of stack frames saved with each memory allocation.
+        :param _logger: A logger to use for reporting.
+        """
+        # save the params
+        self.cpu: bool = cpu
+        self.memory: bool = memory
+        self.top_n: int = top_n
+        self.frames: int = frames
+        self.logger = _logger
+
+        # the finished profiles of the run's threads
+        self.profiles: list = []
+
+        # the report of each memory snapshot
+        self.snapshots: list = []
+
+        # the lock used when saving from more than one thread
+        self.lock: threading.Lock = threading.Lock()
+
+        # the profile of the thread that started the run
+        self.main_profile: cProfile.Profile = None
+
+        # whether this profiler is counted as tracing memory
+        self.tracing: bool = False
+
+    def start(self):
+        """
+        Starts profiling the calling thread and tracing memory allocations.
+
+        :return:
+        """
+        # start tracing the memory
+        if self.memory:
+            with RunProfiler.tracing_lock:
+                # the first profiler starts tracing, unless something else already did
+                if RunProfiler.tracing_count == 0:
+                    if not tracemalloc.is_tracing():
+                        tracemalloc.start(self.frames)
+                        RunProfiler.started_tracing = True
+
+                    # the peak is for the profiled runs only
+                    tracemalloc.reset_peak()
+
+                # count this profiler
+                RunProfiler.tracing_count += 1
+                self.tracing = True
+
+        # start the profile of this thread
+        self.main_profile = self.enable_profile()
+
+    def enable_profile(self):
+        """
+        Starts a CPU profile of the calling thread.
+
+        :return: The profile or None if the CPU time is not being profiled.
+        """
+        # is the CPU being profiled
+        if not self.cpu:
+            return None
+
+        # create the profile
+        profile: cProfile.Profile = cProfile.Profile()
+
+        try:
+            # start it
+            profile.enable()
+        except ValueError:
+            # only one profile can run at a time on newer interpreters, the first thread's is kept
+            if self.logger is not None:
+                self.logger.debug('A profile is already running, %s is not profiled.', threading.current_thread().name)
+
+            return None
+
+        # return to the caller
+        return profile
+
+    def save_profile(self, profile: cProfile.Profile):
+        """
+        Stops a thread's CPU profile and saves it.
+
+        :param profile: The profile.
+        :return:
+        """
+        # is there a profile
+        if profile is not None:
+            # stop it
+            profile.disable()
+
+            # save it
+            with self.lock:
+                self.profiles.append(profile)
+
+    def call(self, func, *args):
+        """
+        Calls a function with the calling thread profiled.
+
+        :param func: The function.
+        :param args: The function arguments.
+        :return: The function return value.
+        """
+        # start a profile of this thread
+        profile: cProfile.Profile = self.enable_profile()
+
+        try:
+            # return to the caller
+            return func(*args)
+        finally:
+            self.save_profile(profile)
+
+    def snapshot(self, label: str):
+        """
+        Saves the top allocation sites of the memory held now, along with the current and peak memory use.
+
+        :param label: The name of the point in the run.
+        :return:
+        """
+        # is the memory being traced and is there room for the snapshot
+        if not self.memory or not tracemalloc.is_tracing() or len(self.snapshots) >= self.MAX_SNAPSHOTS:
+            return
+
+        # get the current and peak memory use
+        current, peak = tracemalloc.get_traced_memory()
+
+        # take the snapshot, leaving out the tracing itself
+        snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+        # init the report with the totals
+        lines: list = [f'== {label} (thread {threading.current_thread().name}): current {current / 1048576:.1f} MB, peak {peak / 1048576:.1f} MB']
+
+        # add the top allocation sites
+        lines.extend(str(stat) for stat in snapshot.statistics('lineno')[:self.top_n])
+
+        # save the report
+        with self.lock:
+            self.snapshots.append('\n'.join(lines))
+
+    def stop(self, full_run_dir: str):
+        """
+        Stops profiling and writes the reports into the run directory.
+
+        Problems are logged and do not affect the result of the run.
+
+        :param full_run_dir: The run directory, i.e. <run_dir>/<run_id>.
+        :return:
+        """
+        # stop the profile of the thread that started the run
+        self.save_profile(self.main_profile)
+
+        # stop tracing the memory if this is the last profiler and tracing was started by the profilers
+        if self.tracing:
+            with RunProfiler.tracing_lock:
+                RunProfiler.tracing_count -= 1
+                self.tracing = False
+
+                if RunProfiler.tracing_count == 0 and RunProfiler.started_tracing:
+                    tracemalloc.stop()
+                    RunProfiler.started_tracing = False
+
+        # nowhere to write the reports
+        if not os.path.isdir(full_run_dir):
+            return
+
+        try:
+            # write the CPU profile
+            if self.profiles:
+                # merge the thread profiles
+                stats: pstats.Stats = pstats.Stats(*self.profiles, stream=io.StringIO())
+
+                # save them for pstats and the like
+                stats.dump_stats(os.path.join(full_run_dir, 'forensics-profile.pstats'))
+
+                # save the top functions as text
+                with open(os.path.join(full_run_dir, 'forensics-profile.txt'), 'w', encoding='utf-8') as fp:
+                    stats.stream = fp
+                    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+
+            # write the memory snapshots
+            if self.snapshots:
+                with open(os.path.join(full_run_dir, 'forensics-memory.txt'), 'w', encoding='utf-8') as fp:
+                    fp.write('\n\n'.join(self.snapshots) + '\n')
+
+            if self.logger is not None:
+                self.logger.info('Run profile saved in: %s', full_run_dir)
+        except OSError:
+            if self.logger is not None:
+                self.logger.exception('Exception: Error saving the run profile in: %s', full_run_dir)
+
+
+def call_profiled(func, *args):
+    """
+    Calls a function with the calling thread profiled, if there is a current run profiler.
+
+    :param func: The function.
+    :param args: The function arguments.
+    :return: The function return value.
+    """
+    # get the current profiler
+    profiler: RunProfiler = current_profiler.get()
+
+    # return to the caller
+    return func(*args) if profiler is None else profiler.call(func, *args)
+
+
+def take_snapshot(label: str):
+    """
+    Saves a memory snapshot, if there is a current run profiler.
+
+    :param label: The name of the point in the run.
+    :return:
+    """
+    # get the current profiler
+    profiler: RunProfiler = current_profiler.get()
+
+    # take the snapshot
+    if profiler is not None:
+        profiler.snapshot(label)
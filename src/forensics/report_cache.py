@@ -0,0 +1,258 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    On-disk cache of test report parse results for the forensics microservice.
+
+    Each report's parse result is stored in its own zlib compressed JSON entry,
+    keyed by the report path and the parser settings. An entry is used if the
+    report's size and mtime are unchanged, or, failing that, if the content hash
+    still matches. When the cache grows past its size limit the least recently
+    used entries are removed.
+"""
+import os
+import json
+import zlib
+import hashlib
+import threading
+
+
+class ReportCache:
+    """
+    Class that caches test report parse results on disk
+
+    """
+    # the entry format version, bump this when the layout of an entry changes
+    VERSION: int = 3
+
+    # the entry file name suffix
+    SUFFIX: str = '.rcache'
+
+    def __init__(self, cache_dir: str, max_bytes: int, fingerprint: str = '', _logger=None):
+        """
+        Init the report cache
+
+        :param cache_dir: The directory to keep the cache entries in.
+        :param max_bytes: The maximum total size of the entries.
+        :param fingerprint: A string that identifies the parser settings that produced the results.
+        :param _logger: A logger to use for reporting.
+        """
+        # save the params
+        self.cache_dir: str = cache_dir
+        self.max_bytes: int = max_bytes
+        self.fingerprint: str = fingerprint
+        self.logger = _logger
+
+        # the lock for updates of the cache size
+        self.lock: threading.Lock = threading.Lock()
+
+        # make sure the directory exists
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # get the current size of the cache
+        self.total_bytes: int = sum(size for _, _, size in self.get_entries())
+
+        # init the hit/miss counts
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @staticmethod
+    def get_digest(file_path: str) -> str:
+        """
+        Gets the content hash of a file.
+
+        :param file_path: The path to the file.
+        :return: The hex digest.
+        """
+        # init the hash
+        digest = hashlib.blake2b(digest_size=20)
+
+        # hash the file a block at a time
+        with open(file_path, 'rb') as fp:
+            for block in iter(lambda: fp.read(1024 * 1024), b''):
+                digest.update(block)
+
+        # return to the caller
+        return digest.hexdigest()
+
+    def get_entry_path(self, file_path: str) -> str:
+        """
+        Gets the path of the cache entry for a report.
+
+        :param file_path: The path to the report.
+        :return: The path to the cache entry.
+        """
+        # the key is the full report path and the parser settings
+        key: str = hashlib.sha1(f'{os.path.abspath(file_path)}\0{self.fingerprint}'.encode('utf-8')).hexdigest()
+
+        # return to the caller
+        return os.path.join(self.cache_dir, f'{key}{self.SUFFIX}')
+
+    def get_entries(self) -> list:
+        """
+        Gets the cache entries.
+
+        :return: A list of (entry path, last used time, size) tuples.
+        """
+        # init the return value
+        ret_val: list = []
+
+        # for each entry in the cache directory
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                # only the cache entries are of interest
+                if entry.name.endswith(self.SUFFIX):
+                    try:
+                        # get the stats
+                        stats = entry.stat()
+
+                        # save the details
+                        ret_val.append((entry.path, stats.st_mtime_ns, stats.st_size))
+                    except FileNotFoundError:
+                        # removed by someone else
+                        continue
+
+        # return to the caller
+        return ret_val
+
+    def get(self, file_path: str):
+        """
+        Gets the cached parse result of a report.
+
+        :param file_path: The path to the report.
+        :return: The parse result, or None if it is not cached or has changed.
+        """
+        # init the return value
+        ret_val = None
+
+        # get the entry location
+        entry_path: str = self.get_entry_path(file_path)
+
+        try:
+            # get the report's current stats
+            stats = os.stat(file_path)
+
+            # load the entry
+            with open(entry_path, 'rb') as fp:
+                entry: dict = json.loads(zlib.decompress(fp.read()))
+
+            # is this the right kind of entry for the same sized file
+            if entry['version'] == self.VERSION and entry['fingerprint'] == self.fingerprint and entry['size'] == stats.st_size:
+                # an unchanged mtime is good enough, otherwise the content must match
+                if entry['mtime_ns'] == stats.st_mtime_ns:
+                    ret_val = entry['result']
+                elif entry['digest'] == self.get_digest(file_path):
+                    ret_val = entry['result']
+
+                    # save the new mtime so the hash is not needed next time
+                    self.put(file_path, ret_val, entry['digest'])
+
+            # mark the entry as recently used
+            if ret_val is not None:
+                os.utime(entry_path)
+        except FileNotFoundError:
+            # nothing cached
+            pass
+        except (OSError, ValueError, KeyError, zlib.error):
+            # a damaged entry is treated as a miss, it gets overwritten
+            if self.logger is not None:
+                self.logger.warning('Ignoring damaged report cache entry %s for %s.', entry_path, file_path)
+
+        with self.lock:
+            # count it
+            if ret_val is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        # return to the caller. the result was a list of tuples before it went through json
+        return [tuple(item) for item in ret_val] if ret_val is not None else None
+
+    def put(self, file_path: str, result, digest: str = None):
+        """
+        Saves the parse result of a report.
+
+        :param file_path: The path to the report.
+        :param result: The parse result.
+        :param digest: The content hash of the report if already known.
+        :return:
+        """
+        # get the entry location
+        entry_path: str = self.get_entry_path(file_path)
+
+        try:
+            # get the report's stats before hashing, if it changes after this the entry will just miss
+            stats = os.stat(file_path)
+
+            # create the entry
+            data: bytes = zlib.compress(json.dumps({'version': self.VERSION, 'fingerprint': self.fingerprint, 'path': file_path,
+                                                    'size': stats.st_size, 'mtime_ns': stats.st_mtime_ns,
+                                                    'digest': digest or self.get_digest(file_path), 'result': result},
+                                                   separators=(',', ':')).encode('utf-8'))
+
+            # get the size of any entry being replaced
+            try:
+                old_size: int = os.path.getsize(entry_path)
+            except FileNotFoundError:
+                old_size: int = 0
+
+            # write it out so a reader never sees a partial entry
+            temp_path: str = f'{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+            with open(temp_path, 'wb') as fp:
+                fp.write(data)
+
+            os.replace(temp_path, entry_path)
+
+            with self.lock:
+                # update the cache size
+                self.total_bytes += len(data) - old_size
+
+                # is it time to make room
+                evict: bool = self.total_bytes > self.max_bytes
+
+            # remove the least recently used entries
+            if evict:
+                self.evict()
+        except OSError:
+            if self.logger is not None:
+                self.logger.warning('Error saving the report cache entry for %s.', file_path)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is under 90% of its maximum size.
+
+        :return:
+        """
+        with self.lock:
+            # get the entries, least recently used first
+            entries: list = sorted(self.get_entries(), key=lambda entry: entry[1])
+
+            # get the actual size
+            self.total_bytes = sum(size for _, _, size in entries)
+
+            # remove entries until there is enough room
+            for entry_path, _, size in entries:
+                # is there enough room yet
+                if self.total_bytes <= self.max_bytes * 0.9:
+                    break
+
+                try:
+                    # remove it
+                    os.remove(entry_path)
+                except FileNotFoundError:
+                    pass
+
+                # update the size
+                self.total_bytes -= size
+
+    def get_stats(self) -> dict:
+        """
+        Gets the cache statistics.
+
+        :return: A dict of the statistics.
+        """
+        with self.lock:
+            # return to the caller
+            return {'hits': self.hits, 'misses': self.misses, 'bytes': self.total_bytes, 'max_bytes': self.max_bytes}
@@ -0,0 +1,526 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    JUnit XML test report parsing for the forensics microservice.
+
+    Two parse modes are supported:
+     - dom: builds the entire document in memory (the original behaviour),
+     - stream: uses iterparse to walk the document in a single pass, releasing
+       each testcase element once it has been handled so peak memory is bounded
+       no matter how large the report is.
+
+    Both modes produce an identical summary for a report.
+
+    Multiple reports can be fanned out to a process pool. Results are always
+    returned in the order of the files requested so the output is deterministic.
+    There is one pool for the whole process, shared by every run and executor
+    being parsed at the time, so the worker count is a process wide limit. Its
+    workers are started from a forkserver rather than forked from this
+    (threaded) process.
+
+    Reports may also be gzipped (*.xml.gz) or bundled into tar (optionally
+    compressed) or zip archives. These are decompressed on the fly and each
+    member is fed straight to the XML parser, nothing is extracted to disk.
+
+    Optionally the error/failure details are grouped by their fingerprint so
+    each distinct failure is saved once (see FailureGrouper), and the text of
+    each one is cut down to its head and tail as it is captured (see
+    TextLimiter), with the full text written to a side file per report.
+
+    The name, outcome and time of every testcase are also captured, in
+    parallel lists under the _testcases key of the suite summary. These are for
+    the stages that run after parsing and are not persisted with the summary.
+"""
+import os
+import gzip
+import tarfile
+import zipfile
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import xml.etree.ElementTree as ElTree
+
+from src.forensics.failure_groups import FailureGrouper
+from src.forensics.text_limiter import TextLimiter
+
+
+class ReportParser:
+    """
+    Class that contains the test report parsing functionality
+
+    """
+    # the parse modes supported
+    PARSE_MODES: tuple = ('dom', 'stream')
+
+    # the testcase child tags that are captured into the summary
+    CAPTURED_TAGS: tuple = ('error', 'failure')
+
+    # the file name suffixes of the reports that can be parsed, and of the reports inside an archive
+    REPORT_SUFFIXES: tuple = ('.xml', '.xml.gz', '.tar', '.tar.gz', '.tgz', '.zip')
+    MEMBER_SUFFIXES: tuple = ('.xml', '.xml.gz')
+
+    # the suite summary key of the per testcase data
+    TESTCASES_KEY: str = '_testcases'
+
+    # the testcase child tags that give the testcase outcome, a testcase without any of them passed
+    OUTCOME_TAGS: tuple = ('error', 'failure', 'skipped')
+
+    # the process pool shared by all the parsers in this process, created on first use, and the lock used when creating it
+    pool: ProcessPoolExecutor = None
+    pool_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, parse_mode: str = 'stream', workers: int = 1, parallel_threshold: int = 4, group_failures: bool = False,
+                 text_limiter: TextLimiter = None):
+        """
+        Init the report parser
+
+        :param parse_mode: The parse mode to use, one of PARSE_MODES.
+        :param workers: The maximum number of worker processes to use when parsing multiple files. The first parser to use the shared
+                        process pool sets its size.
+        :param parallel_threshold: The minimum number of files needed to use the process pool.
+        :param group_failures: True to save <tag>_groups of distinct failures rather than the <tag>_details lists.
+        :param text_limiter: An optional limiter whose head/tail limits are applied to the error/failure text as it is captured.
+        """
+        # make sure this is a mode we can handle
+        if parse_mode not in self.PARSE_MODES:
+            raise ValueError(f'Invalid report parse mode: {parse_mode}')
+
+        # save the params
+        self.parse_mode: str = parse_mode
+        self.workers: int = workers
+        self.parallel_threshold: int = parallel_threshold
+        self.group_failures: bool = group_failures
+        self.text_limiter: TextLimiter = text_limiter
+
+    def get_fingerprint(self) -> str:
+        """
+        Gets a string identifying the settings that affect the parse results, for use in cache keys.
+
+        The parse mode is not included as both modes produce the same results.
+
+        :return:
+        """
+        # get the text limits, if they are applied here
+        limits: str = f';{self.text_limiter.get_fingerprint()}' if self.is_text_limited() else ''
+
+        # return to the caller
+        return f'tags={",".join(self.CAPTURED_TAGS)};group={int(self.group_failures)}{limits}'
+
+    def is_text_limited(self) -> bool:
+        """
+        Checks if the error/failure text is cut to size as it is captured.
+
+        :return: True if there are head/tail limits to apply.
+        """
+        # return to the caller
+        return self.text_limiter is not None and self.text_limiter.is_field_limited()
+
+    @classmethod
+    def is_report(cls, file_name: str) -> bool:
+        """
+        Checks if a file is a test report, or an archive of them, that can be parsed.
+
+        :param file_name: The name of the file.
+        :return: True if the file can be parsed.
+        """
+        # return to the caller
+        return file_name.lower().endswith(cls.REPORT_SUFFIXES)
+
+    def parse_report(self, file_path: str, spill_dir: str = '') -> list:
+        """
+        Parses a test report file, a gzipped test report or an archive of test reports.
+
+        Archive members are read in the order they are stored in the archive.
+        Tar archives are read as a stream so even a compressed one is only
+        decompressed once, front to back.
+
+        :param file_path: The path to the report or archive.
+        :param spill_dir: The directory the full text of the error/failure text that was cut is saved in, blank to not save it.
+        :return: A list of (test suite name, summary data) tuples, one per report.
+        """
+        # init the return value
+        ret_val: list = []
+
+        # init the full text records of the fields that are cut
+        spilled: list = self.get_spilled(file_path, spill_dir)
+
+        # get the name to check the type with
+        file_name: str = file_path.lower()
+
+        # a gzipped report
+        if file_name.endswith('.xml.gz'):
+            with gzip.open(file_path, 'rb') as fp:
+                ret_val.append(self.parse_file(fp, spilled))
+        # a zip archive
+        elif file_name.endswith('.zip'):
+            with zipfile.ZipFile(file_path) as archive:
+                # for each report in the archive
+                for info in archive.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(self.MEMBER_SUFFIXES):
+                        # decompress it straight into the parser
+                        with archive.open(info) as fp:
+                            ret_val.append(self.parse_member(info.filename, fp, spilled))
+        # a tar archive, compressed or not
+        elif file_name.endswith(('.tar', '.tar.gz', '.tgz')):
+            with tarfile.open(file_path, mode='r|*') as archive:
+                # for each report in the archive
+                for member in archive:
+                    if member.isfile() and member.name.lower().endswith(self.MEMBER_SUFFIXES):
+                        # read it from the stream into the parser
+                        with archive.extractfile(member) as fp:
+                            ret_val.append(self.parse_member(member.name, fp, spilled))
+        # a plain report
+        else:
+            ret_val.append(self.parse_file(file_path, spilled))
+
+        # write out the full text of the fields that were cut
+        if spilled:
+            self.text_limiter.write_spill_file(os.path.join(spill_dir, spilled.spill_file), spilled)
+
+        # return to the caller
+        return ret_val
+
+    def get_spilled(self, file_path: str, spill_dir: str):
+        """
+        Gets the list to collect the full text of the fields cut from a report in.
+
+        :param file_path: The path to the report or archive.
+        :param spill_dir: The directory the full text is saved in, blank to not save it.
+        :return: The spill list, None if the text is not cut.
+        """
+        # is the text cut
+        if not self.is_text_limited():
+            return None
+
+        # set the side file, if the full text is saved
+        if spill_dir and self.text_limiter.spill:
+            return SpillList(self.text_limiter.get_spill_name(file_path), file_path)
+
+        # return to the caller
+        return SpillList()
+
+    def parse_member(self, member_name: str, fp, spilled: list = None) -> tuple:
+        """
+        Parses a test report read from an archive.
+
+        :param member_name: The name of the report in the archive.
+        :param fp: The file object of the report.
+        :param spilled: The full text records of the fields that are cut, if the text is cut.
+        :return: A tuple of the test suite name and its summary data.
+        """
+        # a gzipped report inside the archive
+        if member_name.lower().endswith('.gz'):
+            with gzip.GzipFile(fileobj=fp, mode='rb') as gz_fp:
+                return self.parse_file(gz_fp, spilled)
+
+        # return to the caller
+        return self.parse_file(fp, spilled)
+
+    def parse_file(self, file_path, spilled: list = None) -> tuple:
+        """
+        Parses a test report file using the configured parse mode.
+
+        :param file_path: The path to, or file object of, the XML test report.
+        :param spilled: The full text records of the fields that are cut, if the text is cut.
+        :return: A tuple of the test suite name and its summary data.
+        """
+        # cut the text even when the caller is not collecting what is cut
+        if spilled is None and self.is_text_limited():
+            spilled = SpillList()
+
+        # use the streaming parser if requested
+        if self.parse_mode == 'stream':
+            return self.parse_stream(file_path, spilled)
+
+        # else build the whole document
+        return self.parse_dom(file_path, spilled)
+
+    def parse_files(self, file_paths: list, spill_dir: str = '') -> list:
+        """
+        Parses a list of test report files, in parallel if warranted.
+
+        :param file_paths: The paths to the test reports or archives.
+        :param spill_dir: The directory the full text of the error/failure text that was cut is saved in, blank to not save it.
+        :return: A list of the parse_report() results in the same order as file_paths.
+        """
+        # get the number of workers
+        workers: int = self.workers
+
+        # small jobs are not worth the process startup cost
+        if workers <= 1 or len(file_paths) < max(self.parallel_threshold, 2):
+            return [self.parse_report(file_path, spill_dir) for file_path in file_paths]
+
+        # get the shared pool
+        pool: ProcessPoolExecutor = self.get_pool()
+
+        try:
+            # fan the files out to the pool. map() returns the results in the submitted order
+            ret_val: list = list(pool.map(partial(self.parse_report, spill_dir=spill_dir), file_paths,
+                                          chunksize=max(1, len(file_paths) // (workers * 4))))
+        except BrokenProcessPool:
+            # a worker died, e.g. it ran out of memory. the pool can not be used again so the next caller gets a new one
+            with self.pool_lock:
+                if ReportParser.pool is pool:
+                    ReportParser.pool = None
+
+            raise
+
+        # return to the caller
+        return ret_val
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        """
+        Gets the process pool shared by all the parsers, creating it if needed.
+
+        :return: The process pool.
+        """
+        with self.pool_lock:
+            # create the pool if there is not one yet. the workers come from a forkserver, forking a process with running threads
+            # may copy locks that are held and deadlock the child
+            if ReportParser.pool is None:
+                ReportParser.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver'))
+
+            # return to the caller
+            return ReportParser.pool
+
+    @classmethod
+    def shutdown_pool(cls):
+        """
+        Shuts down the shared process pool, if there is one.
+
+        :return:
+        """
+        with cls.pool_lock:
+            # get the pool and forget it
+            pool, cls.pool = cls.pool, None
+
+        # wait for the workers to exit
+        if pool is not None:
+            pool.shutdown()
+
+    def parse_dom(self, source, spilled: list = None) -> tuple:
+        """
+        Parses a test report by loading the entire document into memory.
+
+        :param source: A file path or file object of the XML test report.
+        :param spilled: The full text records of the fields that are cut, if the text is cut.
+        :return: A tuple of the test suite name and its summary data.
+        """
+        # parse the xml file
+        tree = ElTree.parse(source)
+
+        # get root element of the XML
+        root = tree.getroot()
+
+        # init the summary data for this report
+        suite_data: dict = root.attrib
+
+        # init the detail lists and the names of the testcases they came from, one per captured tag
+        details: dict = {tag: [] for tag in self.CAPTURED_TAGS}
+        testcase_names: dict = {tag: [] for tag in self.CAPTURED_TAGS}
+
+        # init the per testcase data
+        testcases: dict = self.get_testcases_init()
+
+        # for each testcase
+        for testcase in root.iterfind('./testcase'):
+            # capture the data at these tags if it exists
+            self.capture_items(testcase, suite_data, details, testcase_names, spilled)
+
+            # capture the testcase
+            self.add_testcase(testcases, testcase)
+
+        # add the details that were found and the per testcase data to the summary
+        self.add_details(suite_data, details, testcase_names)
+
+        suite_data[self.TESTCASES_KEY] = testcases
+
+        # return to the caller
+        return root.attrib['name'], suite_data
+
+    def parse_stream(self, source, spilled: list = None) -> tuple:
+        """
+        Parses a test report in a single pass using iterparse.
+
+        Only the root testsuite element and the testcase currently being
+        handled are kept in memory. Testcase details are captured in the same
+        order the DOM parser would find them.
+
+        :param source: A file path or file object of the XML test report.
+        :param spilled: The full text records of the fields that are cut, if the text is cut.
+        :return: A tuple of the test suite name and its summary data.
+        """
+        # init the storage for the root element and its attributes
+        root = None
+        suite_data: dict = {}
+
+        # init the detail lists and the names of the testcases they came from, one per captured tag
+        details: dict = {tag: [] for tag in self.CAPTURED_TAGS}
+        testcase_names: dict = {tag: [] for tag in self.CAPTURED_TAGS}
+
+        # init the per testcase data
+        testcases: dict = self.get_testcases_init()
+
+        # init the element depth tracker
+        depth: int = 0
+
+        # walk the document
+        for event, elem in ElTree.iterparse(source, events=('start', 'end')):
+            # is this the opening of an element
+            if event == 'start':
+                # the first element is the testsuite
+                if root is None:
+                    # save the root and capture the summary data on it
+                    root = elem
+                    suite_data = elem.attrib
+
+                # going down a level
+                depth += 1
+            else:
+                # going up a level
+                depth -= 1
+
+                # direct children of the root are handled and then released
+                if depth == 1:
+                    # testcases may hold the details we want
+                    if elem.tag == 'testcase':
+                        # capture the data at these tags if it exists
+                        self.capture_items(elem, suite_data, details, testcase_names, spilled)
+
+                        # capture the testcase
+                        self.add_testcase(testcases, elem)
+
+                    # release the element and everything under it
+                    elem.clear()
+                    root.remove(elem)
+
+        # add the details that were found and the per testcase data to the summary
+        self.add_details(suite_data, details, testcase_names)
+
+        suite_data[self.TESTCASES_KEY] = testcases
+
+        # return to the caller
+        return suite_data['name'], suite_data
+
+    def capture_items(self, testcase: ElTree.Element, suite_data: dict, details: dict, testcase_names: dict, spilled: list):
+        """
+        Captures the error/failure entries of a testcase, cutting their text to size if limits are set.
+
+        :param testcase: The testcase element.
+        :param suite_data: The test suite summary data.
+        :param details: The detail lists, by tag, added to.
+        :param testcase_names: The names of the testcases the details came from, by tag, added to.
+        :param spilled: The full text records of the fields that are cut, if the text is cut.
+        :return:
+        """
+        # for each child of the testcase
+        for item in testcase:
+            # is this a tag we are interested in
+            if item.tag in details:
+                # get the testcase name
+                testcase_name: str = self.get_testcase_name(testcase)
+
+                # flatten out the elements
+                item.attrib.update({'text': item.text})
+
+                # cut the text to size now so the full text is not kept
+                if spilled is not None:
+                    self.text_limiter.limit_entry(item.attrib, spilled, spilled.spill_file,
+                                                  {'report': spilled.report, 'suite': suite_data.get('name'), 'testcase': testcase_name,
+                                                   'tag': item.tag})
+
+                # add the entry into the list
+                details[item.tag].append(item.attrib)
+                testcase_names[item.tag].append(testcase_name)
+
+    def add_details(self, suite_data: dict, details: dict, testcase_names: dict):
+        """
+        Adds the captured error/failure entries to the test suite summary.
+
+        :param suite_data: The test suite summary data.
+        :param details: The detail lists, by tag.
+        :param testcase_names: The names of the testcases the details came from, by tag.
+        :return:
+        """
+        # for each captured tag
+        for tag in self.CAPTURED_TAGS:
+            # only add entries that have data
+            if details[tag]:
+                # save the distinct failures if requested
+                if self.group_failures:
+                    suite_data.update({f'{tag}_groups': FailureGrouper.group(details[tag], testcase_names[tag])})
+                else:
+                    suite_data.update({f'{tag}_details': details[tag]})
+
+    @staticmethod
+    def get_testcases_init() -> dict:
+        """
+        Gets the empty per testcase data.
+
+        :return: A dict of parallel lists of the testcase names, outcomes and times (seconds).
+        """
+        # return to the caller
+        return {'names': [], 'outcomes': [], 'times': []}
+
+    @classmethod
+    def add_testcase(cls, testcases: dict, testcase: ElTree.Element):
+        """
+        Adds a testcase to the per testcase data.
+
+        :param testcases: The per testcase data.
+        :param testcase: The testcase element.
+        :return:
+        """
+        # the first child that gives an outcome decides it
+        outcome: str = next((item.tag for item in testcase if item.tag in cls.OUTCOME_TAGS), 'passed')
+
+        try:
+            # get the run time
+            duration: float = float(testcase.attrib.get('time') or 0)
+        except ValueError:
+            duration: float = 0.0
+
+        # save it
+        testcases['names'].append(cls.get_testcase_name(testcase))
+        testcases['outcomes'].append(outcome)
+        testcases['times'].append(duration)
+
+    @staticmethod
+    def get_testcase_name(testcase: ElTree.Element) -> str:
+        """
+        Gets the full name of a testcase.
+
+        :param testcase: The testcase element.
+        :return: The name, prefixed with the class name if there is one.
+        """
+        # get the names
+        class_name: str = testcase.attrib.get('classname', '')
+        name: str = testcase.attrib.get('name', '')
+
+        # return to the caller
+        return f'{class_name}.{name}' if class_name else name
+
+
+class SpillList(list):
+    """
+    Class that collects the full text of the error/failure fields cut from a report, for its side file
+
+    """
+
+    def __init__(self, spill_file: str = '', report: str = ''):
+        """
+        Init the spill list
+
+        :param spill_file: The name of the side file or blank if the full text is not saved.
+        :param report: The path to the report or archive the text was cut from.
+        """
+        super().__init__()
+
+        # save the params
+        self.spill_file: str = spill_file
+        self.report: str = report
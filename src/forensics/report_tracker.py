@@ -0,0 +1,178 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Incremental test report tracking for the forensics microservice.
+
+    While the tests are still running the tracker is polled to parse each
+    report as soon as it has finished being written, i.e. its size and mtime
+    have not changed between two polls and it has been left alone for a
+    settle period. When testing completes only the reports that were not
+    already parsed (or that changed since) need to be parsed.
+
+    If a report cache is given, reports parsed by an earlier invocation on the
+    same run directory are taken from it rather than parsed again.
+"""
+import os
+import time
+import zlib
+import tarfile
+import zipfile
+
+import xml.etree.ElementTree as ElTree
+
+from src.forensics.report_parser import ReportParser
+from src.forensics.report_cache import ReportCache
+
+
+class ReportTracker:
+    """
+    Class that tracks and parses test reports as they are completed
+
+    """
+
+    def __init__(self, test_reports_dir: str, report_parser: ReportParser, settle_time: float = 2.0, cache: ReportCache = None, _logger=None,
+                 _spill_dir: str = ''):
+        """
+        Init the report tracker
+
+        :param test_reports_dir: The directory the test reports are written to.
+        :param report_parser: The parser to use on the reports.
+        :param settle_time: The number of seconds a report must be unchanged before it is considered complete.
+        :param cache: An optional cache of parse results.
+        :param _logger: A logger to use for reporting.
+        :param _spill_dir: The directory the full text of the error/failure text cut by the parser is saved in, blank to not save it.
+        """
+        # save the params
+        self.test_reports_dir: str = test_reports_dir
+        self.report_parser: ReportParser = report_parser
+        self.settle_time: float = settle_time
+        self.cache: ReportCache = cache
+        self.logger = _logger
+        self.spill_dir: str = _spill_dir
+
+        # the last seen (size, mtime) of the reports that are not parsed yet, by file path
+        self.pending: dict = {}
+
+        # the (size, mtime) and parse results of the completed reports, by file path
+        self.parsed: dict = {}
+
+    @staticmethod
+    def get_signature(file_path: str):
+        """
+        Gets the size and modification time of a file.
+
+        :param file_path: The path to the file.
+        :return: A (size, mtime in ns) tuple, or None if the file is gone.
+        """
+        try:
+            # get the file stats
+            stats = os.stat(file_path)
+        except OSError:
+            return None
+
+        # return to the caller
+        return stats.st_size, stats.st_mtime_ns
+
+    def poll(self) -> int:
+        """
+        Parses any reports that have finished being written since the last poll.
+
+        :return: The number of reports parsed.
+        """
+        # init the return value
+        ret_val: int = 0
+
+        # nothing to do until the executor creates the directory
+        if not os.path.isdir(self.test_reports_dir):
+            return ret_val
+
+        # for each report in the directory
+        for file in os.listdir(self.test_reports_dir):
+            # only reports and archives of them are of interest
+            if not ReportParser.is_report(file):
+                continue
+
+            # get the full path and current signature
+            file_path: str = os.path.join(self.test_reports_dir, file)
+            signature = self.get_signature(file_path)
+
+            # skip files that disappeared or are already parsed as is
+            if signature is None or (file_path in self.parsed and self.parsed[file_path][0] == signature):
+                continue
+
+            # the report is stable if it has not changed since the last poll and has been quiet for the settle time
+            if self.pending.get(file_path) == signature and (time.time() - signature[1] / 1e9) >= self.settle_time:
+                try:
+                    # parse the report and keep the results
+                    self.parsed[file_path] = (signature, self.parse_files([file_path])[0])
+
+                    # no longer waiting on this one
+                    del self.pending[file_path]
+
+                    # count it
+                    ret_val += 1
+                except (ElTree.ParseError, EOFError, OSError, tarfile.TarError, zipfile.BadZipFile, zlib.error):
+                    # the file (or archive) may still be getting written, try again on the next poll
+                    if self.logger is not None:
+                        self.logger.debug('Report %s is not parsable yet.', file_path)
+            else:
+                # save the signature for the next poll
+                self.pending[file_path] = signature
+
+        # return to the caller
+        return ret_val
+
+    def collect(self, file_paths: list) -> list:
+        """
+        Gets the parse results for the reports, parsing only those not already done.
+
+        :param file_paths: The paths to the test reports or archives.
+        :return: A list of the parse results, each a list of (test suite name, summary data) tuples, in the same order as file_paths.
+        """
+        # get the current signatures of the reports
+        signatures: dict = {file_path: self.get_signature(file_path) for file_path in file_paths}
+
+        # find the reports that were never parsed or have changed since
+        stragglers: list = [file_path for file_path in file_paths
+                            if file_path not in self.parsed or self.parsed[file_path][0] != signatures[file_path]]
+
+        if self.logger is not None:
+            self.logger.debug('%s of %s reports already parsed in %s.', len(file_paths) - len(stragglers), len(file_paths),
+                              self.test_reports_dir)
+
+        # parse the rest
+        for file_path, result in zip(stragglers, self.parse_files(stragglers)):
+            self.parsed[file_path] = (signatures[file_path], result)
+
+        # return the results in the order requested
+        return [self.parsed[file_path][1] for file_path in file_paths]
+
+    def parse_files(self, file_paths: list) -> list:
+        """
+        Parses reports, using the cached results where possible.
+
+        :param file_paths: The paths to the test reports or archives.
+        :return: A list of parse results in the same order as file_paths.
+        """
+        # without a cache everything gets parsed
+        if self.cache is None:
+            return self.report_parser.parse_files(file_paths, self.spill_dir)
+
+        # get what is in the cache
+        ret_val: list = [self.cache.get(file_path) for file_path in file_paths]
+
+        # find the ones that were not
+        misses: list = [index for index, result in enumerate(ret_val) if result is None]
+
+        # parse those and save them in the cache
+        for index, result in zip(misses, self.report_parser.parse_files([file_paths[index] for index in misses], self.spill_dir)):
+            # save the result
+            ret_val[index] = result
+
+            # cache it
+            self.cache.put(file_paths[index], result)
+
+        # return to the caller
+        return ret_val
@@ -0,0 +1,224 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Long-running service mode for the forensics microservice.
+
+    Rather than paying for interpreter startup, logger setup and a new DB
+    connection on every run, the service keeps one Forensics object warm and
+    takes run requests from a spool directory.
+
+    A run request is a JSON file dropped into the spool directory, e.g.
+    {"run_id": "123", "run_dir": "/data"}. Write it under a name that does not
+    end in .json and rename it when complete so it is never picked up half
+    written. Requests are claimed by moving them into the working/ directory,
+    and when the run finishes the request, with the run's return value added,
+    is moved to done/ (or failed/ if it could not be processed).
+"""
+import os
+import json
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from src.common.enum_utils import ReturnCodes
+from src.forensics.forensics import Forensics
+from src.forensics.report_parser import ReportParser
+from src.forensics.watcher import DirectoryWatcher
+
+
+class ForensicsService:
+    """
+    Class that runs forensics requests from a spool directory
+
+    """
+
+    def __init__(self, forensics: Forensics):
+        """
+        Init the forensics service
+
+        :param forensics: The forensics object used to process the runs.
+        """
+        # save the forensics object and use its logger
+        self.forensics: Forensics = forensics
+        self.logger = forensics.logger
+
+        # get the spool directory and the number of runs that may be processed at the same time
+        self.spool_dir: str = os.getenv('FORENSICS_SPOOL_DIR', '/data/forensics-spool')
+        self.concurrency: int = max(1, int(os.getenv('FORENSICS_SERVICE_CONCURRENCY', '4')))
+
+        # the runs share the forensics object's DB connections, so runs processed at the same time each need their own connection
+        # from a pool rather than taking turns reconnecting the same one
+        if self.concurrency > 1:
+            for db_name in forensics.db_info.db_names:
+                if not forensics.db_info.enable_pool(db_name, self.concurrency):
+                    self.logger.warning('The %s DB can not use a connection pool, its single connection is shared by %s runs at a time.',
+                                        db_name, self.concurrency)
+
+        # get the spool sub-directories for requests being worked on and finished
+        self.working_dir: str = os.path.join(self.spool_dir, 'working')
+        self.done_dir: str = os.path.join(self.spool_dir, 'done')
+        self.failed_dir: str = os.path.join(self.spool_dir, 'failed')
+
+        # init the flag used to shut down the service and how often it is checked (seconds)
+        self.stop_event: threading.Event = threading.Event()
+        self.stop_check_interval: float = 1.0
+
+    def stop(self, *_):
+        """
+        Requests the service to stop once the runs in progress are complete.
+
+        :return:
+        """
+        self.logger.info('Forensics service stop requested.')
+
+        # set the flag
+        self.stop_event.set()
+
+    def serve(self) -> int:
+        """
+        Processes run requests until a stop is requested.
+
+        :return: The exit code.
+        """
+        # make sure the spool directories exist
+        for dir_name in (self.spool_dir, self.working_dir, self.done_dir, self.failed_dir):
+            os.makedirs(dir_name, exist_ok=True)
+
+        # requests claimed by a previous instance that did not finish are put back in the queue
+        self.requeue_abandoned()
+
+        # stop cleanly on a termination request
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        self.logger.info('Forensics service version %s start: spool_dir: %s, concurrency: %s', self.forensics.app_version, self.spool_dir,
+                         self.concurrency)
+
+        # init the runs in progress
+        in_progress: set = set()
+
+        # create the pool that runs the requests and watch the spool directory for new ones
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='forensics-run') as pool, \
+                DirectoryWatcher(self.spool_dir, self.forensics.settings.watch_mode, self.logger) as watcher:
+            # until told to stop
+            while not self.stop_event.is_set():
+                # claim as many requests as there are free slots
+                for request_file in self.claim_requests(self.concurrency - len(in_progress)):
+                    in_progress.add(pool.submit(self.process_request, request_file))
+
+                # if all the slots are in use wait for a run to complete
+                if len(in_progress) >= self.concurrency:
+                    _, in_progress = wait(in_progress, timeout=self.stop_check_interval, return_when=FIRST_COMPLETED)
+                else:
+                    # wait for a new request to show up
+                    watcher.wait(self.stop_check_interval)
+
+                    # drop the runs that are finished
+                    in_progress = {future for future in in_progress if not future.done()}
+
+            self.logger.info('Forensics service waiting on %s run(s) in progress.', len(in_progress))
+
+        # stop the report parsing workers
+        ReportParser.shutdown_pool()
+
+        self.logger.info('Forensics service complete.')
+
+        # return to the caller
+        return ReturnCodes.EXIT_CODE_SUCCESS
+
+    def requeue_abandoned(self):
+        """
+        Puts requests that were claimed but never finished back into the spool.
+
+        A spool directory is expected to be served by a single service
+        instance, so anything still in working/ at startup was abandoned.
+
+        :return:
+        """
+        # for each request left in the working directory
+        for file in os.listdir(self.working_dir):
+            self.logger.warning('Re-queueing abandoned run request: %s', file)
+
+            # move it back into the spool
+            os.replace(os.path.join(self.working_dir, file), os.path.join(self.spool_dir, file))
+
+    def claim_requests(self, max_count: int) -> list:
+        """
+        Claims up to max_count run requests from the spool directory, oldest first.
+
+        :param max_count: The maximum number of requests to claim.
+        :return: The paths to the claimed request files.
+        """
+        # init the return value
+        ret_val: list = []
+
+        # nothing to do if there is no room
+        if max_count <= 0:
+            return ret_val
+
+        # get the requests, oldest first
+        with os.scandir(self.spool_dir) as entries:
+            requests: list = sorted((entry for entry in entries if entry.is_file() and entry.name.endswith('.json')),
+                                    key=lambda entry: entry.stat().st_mtime_ns)
+
+        # for each request
+        for entry in requests[:max_count]:
+            # get the claimed location
+            claimed_file: str = os.path.join(self.working_dir, entry.name)
+
+            try:
+                # claim it. the rename is atomic so a request is only ever claimed once
+                os.rename(entry.path, claimed_file)
+
+                # save the claimed request
+                ret_val.append(claimed_file)
+            except FileNotFoundError:
+                # it was withdrawn before it could be claimed
+                continue
+
+        # return to the caller
+        return ret_val
+
+    def process_request(self, request_file: str):
+        """
+        Processes a claimed run request.
+
+        :param request_file: The path to the claimed request file.
+        :return:
+        """
+        # init the destination of the request when complete
+        dest_dir: str = self.failed_dir
+
+        # init the request data
+        request: dict = {}
+
+        try:
+            # load the request
+            with open(request_file, encoding='utf-8') as fp:
+                request = json.load(fp)
+
+            # validate the inputs
+            if not request.get('run_id') or not request.get('run_dir'):
+                self.logger.error('Error: Invalid run request %s: %s', request_file, request)
+            else:
+                # do the forensics
+                request['ret_val'] = int(self.forensics.run(str(request['run_id']), request['run_dir']))
+
+                # the request was processed
+                dest_dir = self.done_dir
+        except Exception:
+            self.logger.exception('Exception: Error processing run request: %s', request_file)
+
+        try:
+            # write out the request with the result, if there is one
+            if 'ret_val' in request:
+                with open(request_file, 'w', encoding='utf-8') as fp:
+                    json.dump(request, fp)
+
+            # move it to its final location
+            os.replace(request_file, os.path.join(dest_dir, os.path.basename(request_file)))
+        except Exception:
+            self.logger.exception('Exception: Error completing run request: %s', request_file)
@@ -0,0 +1,83 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Run settings for the forensics microservice.
+
+    The settings that only steer how a run is processed (time limits, watch
+    and parse options, caching, metrics and profiling) are read from the
+    environment once into a ForensicsSettings tuple. The objects that do the
+    work (the parser, text limiter, history, ...) are created by Forensics.
+"""
+import os
+from typing import NamedTuple
+
+
+class ForensicsSettings(NamedTuple):
+    """
+    Class that holds the environment driven settings of a forensics run
+
+    """
+    # the time limit (seconds)
+    max_wait: int = 600
+
+    # the intervals between checks for the end of testing marker: the first (seconds), the longest (seconds) and how much each one
+    # grows over the last
+    check_intervals: tuple = (1.0, 15.0, 1.5)
+
+    # how the run directory is watched for the end of testing marker, 'auto' (inotify if possible) or 'poll'
+    watch_mode: str = 'auto'
+
+    # whether reports are parsed while the tests are still running, and how long a report must be unchanged to be complete
+    incremental_parse: bool = False
+    report_settle_time: float = 2.0
+
+    # where parse results are cached so reports are not parsed again when forensics is re-run on the same run directory. blank turns
+    # the cache off, 'run' keeps it in a .forensics-cache directory in the run directory, otherwise it is a directory path
+    report_cache_dir: str = ''
+    report_cache_max_bytes: int = 256 * 1024 * 1024
+
+    # whether the error/failure details are streamed into their own table rather than sent inside the run summary
+    stream_details: bool = False
+
+    # the number of recent runs the test durations of a shard plan are averaged over when the test history is turned on
+    shard_plan_runs: int = 5
+
+    # the baseline run used when the run request does not name one
+    baseline_run_id: str = ''
+
+    # the run metrics settings. the metrics are saved in the run directory and optionally in a Prometheus textfile
+    metrics_enabled: bool = False
+    metrics_textfile: str = ''
+
+    # what to profile (cpu and/or memory) and the number of entries in each profile listing
+    profile_kinds: frozenset = frozenset()
+    profile_top_n: int = 50
+
+    @classmethod
+    def from_env(cls):
+        """
+        Gets the settings from the environment.
+
+        :return: The settings.
+        """
+        # get what to profile, a comma separated list of cpu and memory, or true for both. off by default
+        profile: str = os.getenv('FORENSICS_PROFILE', '').lower()
+
+        # return to the caller
+        return cls(max_wait=int(os.getenv('FORENSICS_MAX_WAIT', '600')),
+                   check_intervals=(float(os.getenv('FORENSICS_CHECK_MIN_INTERVAL', '1')), float(os.getenv('FORENSICS_CHECK_INTERVAL', '15')),
+                                    float(os.getenv('FORENSICS_CHECK_BACKOFF', '1.5'))),
+                   watch_mode=os.getenv('FORENSICS_WATCH_MODE', 'auto'),
+                   incremental_parse=os.getenv('FORENSICS_INCREMENTAL_PARSE', 'false').lower() == 'true',
+                   report_settle_time=float(os.getenv('FORENSICS_REPORT_SETTLE_TIME', '2')),
+                   report_cache_dir=os.getenv('FORENSICS_CACHE_DIR', ''),
+                   report_cache_max_bytes=int(float(os.getenv('FORENSICS_CACHE_MAX_MB', '256')) * 1024 * 1024),
+                   stream_details=os.getenv('FORENSICS_STREAM_DETAILS', 'false').lower() == 'true',
+                   shard_plan_runs=int(os.getenv('FORENSICS_SHARD_PLAN_RUNS', '5')),
+                   baseline_run_id=os.getenv('FORENSICS_BASELINE_RUN_ID', ''),
+                   metrics_enabled=os.getenv('FORENSICS_METRICS', 'false').lower() == 'true',
+                   metrics_textfile=os.getenv('FORENSICS_METRICS_TEXTFILE', ''),
+                   profile_kinds=frozenset({'cpu', 'memory'} if profile == 'true' else {kind.strip() for kind in profile.split(',') if kind.strip()}),
+                   profile_top_n=int(os.getenv('FORENSICS_PROFILE_TOP_N', '50')))
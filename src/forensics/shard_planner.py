@@ -0,0 +1,108 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Test shard planning for the forensics microservice.
+
+    The wall clock time of a run is set by its slowest executor. Given the
+    durations of the tests from earlier runs, the planner spreads the tests
+    over the executors with the longest processing time first (LPT) greedy
+    method: the tests are taken longest first and each is given to the
+    executor with the least work so far. The plan has the same shape as a run
+    request's request_data['tests'] so it can be used for the next run.
+"""
+import heapq
+import statistics
+
+
+class ShardPlanner:
+    """
+    Class that plans a balanced assignment of tests to executors
+
+    """
+
+    def __init__(self, default_duration: float = None):
+        """
+        Init the shard planner
+
+        :param default_duration: The duration (seconds) used for tests without a known duration. None uses the median of the
+                                 known durations.
+        """
+        # save the params
+        self.default_duration: float = default_duration
+
+    def get_default_duration(self, tests: list, durations: dict) -> float:
+        """
+        Gets the duration used for tests without a known duration.
+
+        :param tests: The names of the tests.
+        :param durations: The known test durations (seconds), by test name.
+        :return: The duration in seconds.
+        """
+        # use the one given if there is one
+        if self.default_duration is not None:
+            return self.default_duration
+
+        # else use the typical duration of the known tests
+        known: list = [durations[test] for test in tests if test in durations]
+
+        # return to the caller
+        return statistics.median(known) if known else 0.0
+
+    def plan(self, tests: list, executors: list, durations: dict) -> tuple:
+        """
+        Assigns the tests to the executors so their total durations are as even as possible.
+
+        :param tests: The names of the tests to assign.
+        :param executors: The names of the executors.
+        :param durations: The known test durations (seconds), by test name.
+        :return: A tuple of the tests assigned to each executor, by executor name, and the expected duration of each executor.
+        """
+        # get the duration to use for the tests that have not been timed
+        default_duration: float = self.get_default_duration(tests, durations)
+
+        # init the return values
+        assignments: dict = {executor: [] for executor in executors}
+        loads: dict = {executor: 0.0 for executor in executors}
+
+        # nothing to do without executors
+        if not executors:
+            return assignments, loads
+
+        # init the executor heap, least loaded first. ties go to the executor with the fewest tests, then by position so the plan
+        # is always the same
+        heap: list = [(0.0, 0, position, executor) for position, executor in enumerate(executors)]
+
+        # for each test, longest first
+        for test in sorted(dict.fromkeys(tests), key=lambda name: (-durations.get(name, default_duration), name)):
+            # get the least loaded executor
+            load, count, position, executor = heapq.heappop(heap)
+
+            # give it the test
+            assignments[executor].append(test)
+            load += durations.get(test, default_duration)
+
+            # put it back
+            heapq.heappush(heap, (load, count + 1, position, executor))
+
+        # get the final loads
+        for load, _, _, executor in heap:
+            loads[executor] = round(load, 3)
+
+        # return to the caller
+        return assignments, loads
+
+    def get_makespan(self, assignments: dict, durations: dict) -> float:
+        """
+        Gets the expected wall clock time of an assignment, i.e. the duration of its longest executor.
+
+        :param assignments: The tests assigned to each executor, by executor name.
+        :param durations: The known test durations (seconds), by test name.
+        :return: The expected time in seconds.
+        """
+        # get the duration to use for the tests that have not been timed
+        default_duration: float = self.get_default_duration([test for tests in assignments.values() for test in tests], durations)
+
+        # return to the caller
+        return max((sum(durations.get(test, default_duration) for test in tests) for tests in assignments.values()), default=0.0)
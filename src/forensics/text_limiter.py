@@ -0,0 +1,280 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Bounded capture of the error/failure text for the forensics microservice.
+
+    A single testcase can put megabytes of log output into its failure text.
+    The report parser cuts each captured text field down to its head and tail
+    as it is read, so the full text is never held in the summary, passed back
+    from a parse worker or cached. Before the run summary is saved, the field
+    that reaches the run's total text budget is cut and the fields after it
+    are emptied. The full text of every field that was cut is saved in a
+    gzipped JSON lines side file in the run directory (one per report for the
+    head/tail cuts) and, unless it was emptied, referenced from the summary as
+    <side file>:<line number>.
+
+    All the sizes are UTF-8 encoded bytes.
+"""
+import os
+import json
+import gzip
+import hashlib
+
+
+class TextLimiter:
+    """
+    Class that limits the size of the text captured in a run summary
+
+    """
+    # the fields of an error/failure entry that are limited
+    FIELDS: tuple = ('message', 'text')
+
+    # the name of the side file that holds the full text
+    SPILL_FILE: str = 'forensics-text.jsonl.gz'
+
+    def __init__(self, head_size: int = 0, tail_size: int = 0, run_budget: int = 0, spill: bool = True, _logger=None):
+        """
+        Init the text limiter
+
+        :param head_size: The number of bytes kept from the start of a field.
+        :param tail_size: The number of bytes kept from the end of a field.
+        :param run_budget: The total number of bytes kept across all the fields in a run, 0 for no limit.
+        :param spill: True to save the full text of the fields that were cut in the side file.
+        :param _logger: A logger to use for reporting.
+        """
+        # save the params
+        self.head_size: int = head_size
+        self.tail_size: int = tail_size
+        self.run_budget: int = run_budget
+        self.spill: bool = spill
+        self.logger = _logger
+
+    def is_enabled(self) -> bool:
+        """
+        Checks if there are any limits to apply.
+
+        :return: True if there are limits.
+        """
+        # return to the caller
+        return self.head_size > 0 or self.tail_size > 0 or self.run_budget > 0
+
+    def is_field_limited(self) -> bool:
+        """
+        Checks if there is a per field limit to apply.
+
+        :return: True if there is a head or tail limit.
+        """
+        # return to the caller
+        return self.head_size > 0 or self.tail_size > 0
+
+    def get_fingerprint(self) -> str:
+        """
+        Gets a string identifying the per field limits, for use in cache keys.
+
+        :return:
+        """
+        # return to the caller
+        return f'head={self.head_size};tail={self.tail_size};spill={int(self.spill)}'
+
+    @staticmethod
+    def get_spill_name(file_path: str) -> str:
+        """
+        Gets the name of the side file that holds the full text cut from the fields of a report.
+
+        :param file_path: The path to the report or archive.
+        :return: The file name.
+        """
+        # return to the caller
+        return f'forensics-text-{hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()[:16]}.jsonl.gz'
+
+    @staticmethod
+    def shorten(text: str, head_size: int, tail_size: int) -> str:
+        """
+        Cuts the middle out of a text. A character split by a cut is dropped.
+
+        :param text: The text to shorten.
+        :param head_size: The number of bytes to keep from the start.
+        :param tail_size: The number of bytes to keep from the end.
+        :return: The shortened text, with a marker where the text was removed.
+        """
+        # nothing to do if it fits, no character takes more than 4 bytes
+        if len(text) * 4 <= head_size + tail_size:
+            return text
+
+        # get the bytes
+        data: bytes = text.encode('utf-8')
+
+        # nothing to do if it fits
+        if len(data) <= head_size + tail_size:
+            return text
+
+        # return to the caller
+        return (f"{data[:head_size].decode('utf-8', 'ignore')}\n...[{len(data) - head_size - tail_size} bytes removed]...\n"
+                f"{data[len(data) - tail_size:].decode('utf-8', 'ignore')}")
+
+    def limit_entry(self, entry: dict, spilled: list, spill_file: str, record: dict) -> int:
+        """
+        Cuts the fields of an error/failure entry down to their head and tail, in place.
+
+        :param entry: The error/failure entry.
+        :param spilled: The full text records for the side file, added to.
+        :param spill_file: The name of the side file or blank if the full text is not saved.
+        :param record: The fields that identify the entry in the side file records.
+        :return: The number of fields that were cut.
+        """
+        # init the return value
+        ret_val: int = 0
+
+        # for each field that can be limited
+        for field in self.FIELDS:
+            # get the text
+            value = entry.get(field)
+
+            # only text can be limited
+            if not isinstance(value, str):
+                continue
+
+            # apply the per field limit
+            limited: str = self.shorten(value, self.head_size, self.tail_size)
+
+            # nothing more to do if it was not cut
+            if limited is value:
+                continue
+
+            # save the limited text and the original size
+            entry[field] = limited
+            entry[f'{field}_size'] = len(value.encode('utf-8'))
+
+            # count it
+            ret_val += 1
+
+            # save the full text for the side file and reference it
+            if spill_file:
+                entry[f'{field}_spill'] = f'{spill_file}:{len(spilled)}'
+
+                spilled.append({**record, 'field': field, 'text': value})
+
+        # return to the caller
+        return ret_val
+
+    def apply(self, run_summary: dict, spill_dir: str) -> int:
+        """
+        Limits the error/failure text in a run summary, in place. Fields that were already cut to their head and tail by the
+        report parser are only cut further by the run budget, their full text is already in a side file.
+
+        :param run_summary: The run summary.
+        :param spill_dir: The directory to write the side file to.
+        :return: The number of fields that were cut.
+        """
+        # init the count of the fields that were cut and the full text of them
+        ret_val: int = 0
+        spilled: list = []
+
+        # init the bytes left in the budget
+        remaining: int = self.run_budget
+
+        # the side file name is only saved in the summary if it is going to be written
+        spill_file: str = self.SPILL_FILE if self.spill else ''
+
+        # for each field of each error/failure entry
+        for suite_name, key, index, entry in self.get_entries(run_summary):
+            for field in self.FIELDS:
+                # get the text
+                value = entry.get(field)
+
+                # only text can be limited
+                if not isinstance(value, str):
+                    continue
+
+                # apply the per field limit, unless the parser already did
+                limited: str = value
+
+                if self.is_field_limited() and f'{field}_size' not in entry:
+                    limited = self.shorten(value, self.head_size, self.tail_size)
+
+                # init the flag that the run budget is used up
+                exhausted: bool = False
+
+                # apply the run limit
+                if self.run_budget > 0:
+                    # get the size of what is left
+                    size: int = len(limited.encode('utf-8'))
+
+                    # once the budget is used up the fields are emptied, a cut marker on each would keep growing the run
+                    if remaining <= 0:
+                        if size > 0:
+                            limited = ''
+                            exhausted = True
+                    # keep what fits in the budget
+                    elif size > remaining:
+                        limited = self.shorten(limited, remaining, 0)
+
+                    # use up the budget
+                    remaining -= size
+
+                # nothing more to do if it was not cut
+                if limited is value:
+                    continue
+
+                # save the limited text and the original size, if it is not known already
+                entry[field] = limited
+                entry.setdefault(f'{field}_size', len(value.encode('utf-8')))
+
+                # count it
+                ret_val += 1
+
+                # save the full text for the side file, unless the parser already did. the emptied fields are found in it by their
+                # suite, entry and field rather than each getting a reference
+                if spill_file and f'{field}_spill' not in entry:
+                    if not exhausted:
+                        entry[f'{field}_spill'] = f'{spill_file}:{len(spilled)}'
+
+                    spilled.append({'suite': suite_name, 'key': key, 'index': index, 'field': field, 'text': value})
+
+        # write out the side file
+        if spilled:
+            self.write_spill_file(os.path.join(spill_dir, spill_file), spilled)
+
+        # return to the caller
+        return ret_val
+
+    @staticmethod
+    def get_entries(run_summary: dict):
+        """
+        Gets the error/failure entries in a run summary.
+
+        :param run_summary: The run summary.
+        :return: A generator of (test suite name, summary key, index, entry) tuples.
+        """
+        # for each test suite
+        for suite_name, suite_data in run_summary.items():
+            # skip anything that is not a test suite summary
+            if not isinstance(suite_data, dict):
+                continue
+
+            # for each list of error/failure details or groups
+            for key, entries in suite_data.items():
+                if key.endswith(('_details', '_groups')) and isinstance(entries, list):
+                    # return each entry to the caller
+                    for index, entry in enumerate(entries):
+                        yield suite_name, key, index, entry
+
+    def write_spill_file(self, file_path: str, spilled: list):
+        """
+        Writes out the full text of the fields that were cut.
+
+        :param file_path: The path of the side file.
+        :param spilled: The records to write, one per line.
+        :return:
+        """
+        try:
+            # write the records, one JSON document per line
+            with gzip.open(file_path, 'wt', encoding='utf-8') as fp:
+                for record in spilled:
+                    fp.write(json.dumps(record, separators=(',', ':')))
+                    fp.write('\n')
+        except OSError:
+            if self.logger is not None:
+                self.logger.exception('Error writing the full text side file %s.', file_path)
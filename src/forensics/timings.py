@@ -0,0 +1,81 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Testcase timing statistics for the forensics microservice.
+
+    The testcase times of each suite are sorted once for the percentiles and
+    the maximum, and the slowest testcases are picked with a bounded heap.
+    Only the statistics and a bounded list of the slowest testcases are saved
+    in the summary.
+"""
+import math
+import heapq
+
+
+class TimingStats:
+    """
+    Class that computes the testcase timing statistics of a test suite
+
+    """
+    # the percentiles reported
+    PERCENTILES: tuple = (50, 95)
+
+    def __init__(self, top_n: int = 10):
+        """
+        Init the timing statistics
+
+        :param top_n: The number of slowest testcases to list.
+        """
+        # save the params
+        self.top_n: int = top_n
+
+    @staticmethod
+    def get_percentile(sorted_times: list, percentile: float) -> float:
+        """
+        Gets a percentile using the nearest rank method.
+
+        :param sorted_times: The times, in ascending order.
+        :param percentile: The percentile to get.
+        :return: The time at the percentile.
+        """
+        # get the rank of the value, ranks start at 1
+        rank: int = max(1, math.ceil(percentile / 100 * len(sorted_times)))
+
+        # return to the caller
+        return sorted_times[rank - 1]
+
+    def get_stats(self, testcases: dict) -> dict:
+        """
+        Gets the timing statistics of a test suite.
+
+        :param testcases: The per testcase data of the suite (see ReportParser.TESTCASES_KEY).
+        :return: The statistics, or an empty dict if there are no testcases.
+        """
+        # get the times
+        times: list = testcases['times']
+
+        # nothing to report without testcases
+        if not times:
+            return {}
+
+        # get the times in order, slowest last
+        sorted_times: list = sorted(times)
+
+        # init the return value with the totals
+        ret_val: dict = {'count': len(times), 'total': round(math.fsum(times), 3), 'max': round(sorted_times[-1], 3)}
+
+        # add the percentiles
+        for percentile in self.PERCENTILES:
+            ret_val[f'p{percentile}'] = round(self.get_percentile(sorted_times, percentile), 3)
+
+        # add the slowest testcases, slowest first
+        ret_val['slowest'] = []
+
+        if self.top_n > 0:
+            ret_val['slowest'] = [{'name': testcases['names'][index], 'time': round(times[index], 3)}
+                                  for index in heapq.nlargest(self.top_n, range(len(times)), key=times.__getitem__)]
+
+        # return to the caller
+        return ret_val
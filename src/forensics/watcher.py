@@ -0,0 +1,270 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Directory change notification for the forensics microservice.
+
+    On Linux the watcher blocks on inotify events (via ctypes, no extra
+    dependencies) so callers wake up as soon as something changes in the
+    watched directory. Where notification is not available (other platforms,
+    network mounts, a directory that does not exist yet) waiting degrades to a
+    plain sleep, which gives the caller the original polling behaviour.
+"""
+import os
+import time
+import errno
+import select
+import ctypes
+import ctypes.util
+
+
+class DirectoryWatcher:
+    """
+    Class that waits for changes in a directory
+
+    """
+    # the watch modes supported
+    WATCH_MODES: tuple = ('auto', 'poll')
+
+    # inotify flags, see inotify(7)
+    IN_NONBLOCK: int = 0o4000
+    IN_CLOEXEC: int = 0o2000000
+    IN_MODIFY: int = 0x00000002
+    IN_ATTRIB: int = 0x00000004
+    IN_CLOSE_WRITE: int = 0x00000008
+    IN_MOVED_TO: int = 0x00000080
+    IN_CREATE: int = 0x00000100
+
+    # the events that indicate something worth a look was added or finished in the directory
+    WATCH_MASK: int = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    # file systems where changes made on other nodes are not seen by inotify
+    NETWORK_FS_TYPES: tuple = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ceph', 'glusterfs', 'lustre', '9p')
+
+    # the handle to the C library, loaded once on first use
+    _libc = None
+
+    def __init__(self, path: str, watch_mode: str = 'auto', _logger=None):
+        """
+        Init the directory watcher
+
+        :param path: The directory to watch.
+        :param watch_mode: 'auto' to use notification where possible, 'poll' to always sleep.
+        :param _logger: A logger to use for reporting.
+        """
+        # make sure this is a mode we can handle
+        if watch_mode not in self.WATCH_MODES:
+            raise ValueError(f'Invalid watch mode: {watch_mode}')
+
+        # save the params
+        self.path: str = path
+        self.watch_mode: str = watch_mode
+        self.logger = _logger
+
+        # init the inotify file descriptor
+        self.inotify_fd: int = -1
+
+        # init the flag that notification can not be used for this path
+        self.notify_disabled: bool = watch_mode == 'poll'
+
+    def __enter__(self):
+        """
+        Starts the watch if possible
+
+        :return:
+        """
+        # try to get notifications going
+        self.start()
+
+        # return to the caller
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        Releases the watch
+
+        :return:
+        """
+        self.close()
+
+    @property
+    def active(self) -> bool:
+        """
+        Returns True if change notifications are being received.
+
+        :return:
+        """
+        return self.inotify_fd >= 0
+
+    def start(self) -> bool:
+        """
+        Tries to start receiving change notifications for the directory.
+
+        :return: True if notifications are active.
+        """
+        # nothing to do if it is running or not possible
+        if self.active or self.notify_disabled:
+            return self.active
+
+        # get the C library functions
+        libc = self.get_libc()
+
+        # inotify is linux only
+        if libc is None:
+            self.disable_notify('inotify is not available on this platform')
+
+        # changes made by other nodes are invisible on network file systems
+        elif self.is_network_fs(self.path):
+            self.disable_notify('the directory is on a network file system')
+
+        # the directory may not have been created yet, try again on the next wait
+        elif os.path.isdir(self.path):
+            # create the inotify instance
+            inotify_fd: int = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+
+            # did that work
+            if inotify_fd < 0:
+                self.disable_notify(f'inotify_init1 failed: {os.strerror(ctypes.get_errno())}')
+            # add the watch on the directory
+            elif libc.inotify_add_watch(inotify_fd, os.fsencode(self.path), self.WATCH_MASK) < 0:
+                # get the reason
+                err_no: int = ctypes.get_errno()
+
+                # release the instance
+                os.close(inotify_fd)
+
+                # a missing directory may still show up, anything else is permanent
+                if err_no != errno.ENOENT:
+                    self.disable_notify(f'inotify_add_watch failed: {os.strerror(err_no)}')
+            else:
+                # save the handle
+                self.inotify_fd = inotify_fd
+
+                if self.logger is not None:
+                    self.logger.debug('Watching %s for changes.', self.path)
+
+        # return to the caller
+        return self.active
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits for a change in the directory or until the timeout expires.
+
+        :param timeout: The maximum number of seconds to wait.
+        :return: True if a change was signalled, False on a timeout.
+        """
+        # init the return value
+        ret_val: bool = False
+
+        # the watch may not have been possible before
+        if self.start():
+            # wait for something to read on the descriptor
+            readable, _, _ = select.select([self.inotify_fd], [], [], max(timeout, 0))
+
+            # was there anything
+            if readable:
+                # drain the pending events, only the fact that something happened matters
+                try:
+                    while os.read(self.inotify_fd, 65536):
+                        pass
+                except BlockingIOError:
+                    pass
+
+                # signal the change
+                ret_val = True
+        else:
+            # fall back to a plain sleep
+            time.sleep(max(timeout, 0))
+
+        # return to the caller
+        return ret_val
+
+    def close(self):
+        """
+        Releases the inotify instance, if any
+
+        :return:
+        """
+        # if there is an instance, close it
+        if self.active:
+            os.close(self.inotify_fd)
+            self.inotify_fd = -1
+
+    def disable_notify(self, reason: str):
+        """
+        Stops any further attempts to use notifications for this directory.
+
+        :param reason: The reason for the fall back.
+        :return:
+        """
+        # set the flag
+        self.notify_disabled = True
+
+        if self.logger is not None:
+            self.logger.info('Polling %s for changes, %s.', self.path, reason)
+
+    @classmethod
+    def get_libc(cls):
+        """
+        Gets the C library with the inotify functions, if present.
+
+        :return: The library handle or None.
+        """
+        # load the library once
+        if cls._libc is None:
+            try:
+                # get the library
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+                # make sure the functions exist
+                if hasattr(libc, 'inotify_init1') and hasattr(libc, 'inotify_add_watch'):
+                    cls._libc = libc
+                else:
+                    cls._libc = False
+            except OSError:
+                cls._libc = False
+
+        # return to the caller
+        return cls._libc or None
+
+    @classmethod
+    def is_network_fs(cls, path: str, mounts_file: str = '/proc/mounts') -> bool:
+        """
+        Checks to see if the path lives on a network file system.
+
+        :param path: The path to check.
+        :param mounts_file: The mount table to look the path up in.
+        :return: True if the file system type is a known network type.
+        """
+        # init the best matching mount point and type
+        best_mount: str = ''
+        fs_type: str = ''
+
+        # get the full path
+        real_path: str = os.path.realpath(path)
+
+        try:
+            # find the longest mount point that contains the path
+            with open(mounts_file, encoding='utf-8') as mounts:
+                for line in mounts:
+                    # get the mount point and type
+                    fields: list = line.split()
+
+                    # skip malformed lines
+                    if len(fields) < 3:
+                        continue
+
+                    # mount points with spaces are octal escaped
+                    mount_point: str = fields[1].replace('\\040', ' ')
+
+                    # is this a better match
+                    if len(mount_point) > len(best_mount) and (real_path == mount_point or
+                                                               real_path.startswith(mount_point.rstrip('/') + '/')):
+                        best_mount, fs_type = mount_point, fields[2]
+        except OSError:
+            # no mount information, assume local
+            pass
+
+        # return to the caller
+        return fs_type.split('.')[0] in cls.NETWORK_FS_TYPES or fs_type.startswith('fuse')
@@ -8,10 +8,42 @@
     Author: Phil Owen, RENCI.org
 """
 import os
+import io
+import time
+import gzip
+import tarfile
+import json
+import zlib
+import zipfile
+import queue
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+import psycopg2
 
 from src.forensics.forensics import Forensics
 from src.common.enum_utils import ReturnCodes
+from src.forensics.report_parser import ReportParser
+from src.forensics.text_limiter import TextLimiter
+from src.forensics.history import HistoryIndex
+from src.forensics.baseline import BaselineDiff
+from src.forensics.timings import TimingStats
+from src.forensics.shard_planner import ShardPlanner
+from src.common.pg_impl import PGImplementation
+from src.common.pg_utils_multi import PGUtilsMultiConnect
+from src.common.pg_fake import FakeSupervisorDB
+from src.common.pg_pool import PGConnectionPool
+from src.common.retry_policy import RetryPolicy
+from src.common import metrics
+from src.forensics.profiler import RunProfiler
+from src.forensics.poller import BackoffPoller
+from src.forensics.service import ForensicsService
+from src.forensics.report_cache import ReportCache
+from src.forensics.report_tracker import ReportTracker
+from src.forensics.settings import ForensicsSettings
+from src.common.logger import LoggingUtil, BoundedQueueHandler, JsonFormatter, ContextFilter
 
 
 @pytest.mark.skip(reason="Local test only")
@@ -101,3 +133,868 @@ def test_parse_test_results():
 
     # make sure of a successful return code and a .complete file
     assert ret_val == ReturnCodes.ERROR_NO_RESULT_DATA
+
+
+def test_parse_modes(tmp_path):
+    """
+    tests that the streaming and DOM report parsers produce identical summaries
+
+    :return:
+    """
+    # create a report with errors, failures, nested output and a passing test
+    report: str = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                   '<testsuite name="test_suite" tests="4" errors="1" failures="2" skipped="0" time="1.5">'
+                   '<properties><property name="p" value="v"/></properties>'
+                   '<testcase classname="a.b" name="test_pass" time="0.1"><system-out>lots of output</system-out></testcase>'
+                   '<testcase classname="a.b" name="test_fail_1" time="0.2"><failure message="assert 1" type="AssertionError">trace 1</failure>'
+                   '</testcase>'
+                   '<testcase classname="a.b" name="test_error" time="0.3"><error message="boom" type="RuntimeError">trace 2</error>'
+                   '<system-out>more output</system-out></testcase>'
+                   '<testcase classname="a.b" name="test_fail_2" time="0.4"><failure message="it\'s broken" type="AssertionError">trace 3'
+                   '</failure></testcase>'
+                   '<system-err>suite level output</system-err>'
+                   '</testsuite>')
+
+    # write out the report
+    report_file = tmp_path / 'report.xml'
+    report_file.write_text(report)
+
+    # parse the report both ways
+    dom_name, dom_data = ReportParser('dom').parse_file(str(report_file))
+    stream_name, stream_data = ReportParser('stream').parse_file(str(report_file))
+
+    # make sure the results are identical, including the key order
+    assert dom_name == stream_name == 'test_suite'
+    assert dom_data == stream_data
+    assert list(dom_data.keys()) == list(stream_data.keys())
+    assert [item['text'] for item in stream_data['failure_details']] == ['trace 1', 'trace 3']
+
+    # make sure each testcase was captured
+    assert stream_data[ReportParser.TESTCASES_KEY] == {'names': ['a.b.test_pass', 'a.b.test_fail_1', 'a.b.test_error', 'a.b.test_fail_2'],
+                                                       'outcomes': ['passed', 'failure', 'error', 'failure'], 'times': [0.1, 0.2, 0.3, 0.4]}
+
+
+def test_parse_archives(tmp_path):
+    """
+    tests that gzipped reports and reports inside tar and zip archives are parsed
+
+    :return:
+    """
+    # create a small report for a test suite
+    def get_report(suite_name: str) -> bytes:
+        return (f'<testsuite name="{suite_name}" tests="1" failures="1"><testcase name="test_fail"><failure message="m">trace {suite_name}'
+                '</failure></testcase></testsuite>').encode('utf-8')
+
+    # a gzipped report
+    with gzip.open(tmp_path / 'a.xml.gz', 'wb') as fp:
+        fp.write(get_report('suite_a'))
+
+    # a compressed tar archive holding a plain and a gzipped report
+    with tarfile.open(tmp_path / 'b.tar.gz', 'w:gz') as archive:
+        for member_name, data in (('reports/b1.xml', get_report('suite_b1')), ('reports/b2.xml.gz', gzip.compress(get_report('suite_b2')))):
+            info = tarfile.TarInfo(member_name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+    # a zip archive holding a report and something else
+    with zipfile.ZipFile(tmp_path / 'c.zip', 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('c.xml', get_report('suite_c'))
+        archive.writestr('readme.txt', 'not a report')
+
+    # for each parse mode
+    for parse_mode in ReportParser.PARSE_MODES:
+        # parse all the reports
+        results: list = ReportParser(parse_mode).parse_files([str(tmp_path / file) for file in ('a.xml.gz', 'b.tar.gz', 'c.zip')])
+
+        # make sure every report was found, in order
+        assert [[suite_name for suite_name, _ in result] for result in results] == [['suite_a'], ['suite_b1', 'suite_b2'], ['suite_c']]
+        assert results[1][1][1]['failure_details'][0]['text'] == 'trace suite_b2'
+
+    # make sure parsers share one process pool and get the same results from it
+    try:
+        parsers: list = [ReportParser(parse_mode, workers=2, parallel_threshold=2) for parse_mode in ReportParser.PARSE_MODES]
+
+        assert parsers[0].parse_files([str(tmp_path / file) for file in ('a.xml.gz', 'b.tar.gz', 'c.zip')]) == results
+        assert parsers[1].get_pool() is parsers[0].get_pool() is ReportParser.pool
+    finally:
+        ReportParser.shutdown_pool()
+
+    assert ReportParser.pool is None
+
+
+def test_group_failures(tmp_path):
+    """
+    tests that identical failures are saved once with a count and the testcases that hit them
+
+    :return:
+    """
+    # create a report where two failures differ only by address, line number and temp path
+    report: str = ('<testsuite name="test_suite" tests="3" failures="3">'
+                   '<testcase classname="a.b" name="test_1"><failure message="object at 0x7f3a12 failed" type="AssertionError">'
+                   'File "/tmp/tmpab12cd34/test.py", line 10, in test_1</failure></testcase>'
+                   '<testcase classname="a.b" name="test_2"><failure message="object at 0x7f9b34 failed" type="AssertionError">'
+                   'File "/tmp/tmpzz98yy76/test.py", line 22, in test_1</failure></testcase>'
+                   '<testcase classname="a.b" name="test_3"><failure message="connection refused" type="OSError">trace</failure>'
+                   '</testcase>'
+                   '</testsuite>')
+
+    # write out the report
+    report_file = tmp_path / 'report.xml'
+    report_file.write_text(report)
+
+    # parse the report both ways
+    _, dom_data = ReportParser('dom', group_failures=True).parse_file(str(report_file))
+    _, stream_data = ReportParser('stream', group_failures=True).parse_file(str(report_file))
+
+    # make sure the results are identical and the details were replaced by the groups
+    assert dom_data == stream_data
+    assert 'failure_details' not in stream_data
+
+    # make sure the same failures were grouped
+    groups: list = stream_data['failure_groups']
+    assert [(group['count'], group['testcases']) for group in groups] == [(2, ['a.b.test_1', 'a.b.test_2']), (1, ['a.b.test_3'])]
+    assert groups[0]['message'] == 'object at 0x7f3a12 failed'
+
+
+def test_text_limits(tmp_path):
+    """
+    tests that oversized error/failure text is cut to size and the full text saved in the side file
+
+    :return:
+    """
+    # create a summary with a huge failure, a small one and an error that will not fit in the run budget
+    run_summary: dict = {'test_suite': {'name': 'test_suite', 'failure_details': [{'message': 'm', 'text': 'a' * 50 + 'b' * 100 + 'c' * 50},
+                                                                                  {'message': 'm', 'text': 'small'}],
+                                        'error_details': [{'message': 'e', 'text': 'd' * 200}]}}
+
+    # keep 50 characters from each end of a field and 200 characters over the run
+    count: int = TextLimiter(50, 50, 200).apply(run_summary, str(tmp_path))
+
+    # make sure the huge failure and the error were cut
+    assert count == 2
+
+    # the huge failure keeps its head and tail
+    failure: dict = run_summary['test_suite']['failure_details'][0]
+    assert failure['text'].startswith('a' * 50) and failure['text'].endswith('c' * 50) and 'bb' not in failure['text']
+    assert failure['text_size'] == 200
+
+    # the small failure is untouched
+    assert run_summary['test_suite']['failure_details'][1] == {'message': 'm', 'text': 'small'}
+
+    # the error only gets what was left of the budget
+    error: dict = run_summary['test_suite']['error_details'][0]
+    assert error['text'].startswith('d') and error['text'].count('d') < 100 and error['text_size'] == 200
+
+    # make sure the full text can be found from the reference
+    file_name, line = error['text_spill'].split(':')
+
+    with gzip.open(tmp_path / file_name, 'rt', encoding='utf-8') as fp:
+        assert json.loads(fp.readlines()[int(line)])['text'] == 'd' * 200
+
+
+def test_parse_text_limits(tmp_path):
+    """
+    tests that the parser cuts the error/failure text to size in bytes as it is captured and saves the full text per report
+
+    :return:
+    """
+    # create a report with a huge multibyte failure and a small error
+    huge: str = 'é' * 1000
+
+    report_file = tmp_path / 'report.xml'
+    report_file.write_text(f'<testsuite name="s"><testcase name="t1"><failure message="m">{huge}</failure></testcase>'
+                           '<testcase name="t2"><error message="e">small</error></testcase></testsuite>', encoding='utf-8')
+
+    # for each parse mode
+    for parse_mode in ReportParser.PARSE_MODES:
+        # keep 100 bytes from each end of a field
+        parser = ReportParser(parse_mode, text_limiter=TextLimiter(100, 100))
+
+        # parse the report, saving the full text in the run directory
+        suite_name, suite_data = parser.parse_files([str(report_file)], str(tmp_path))[0][0]
+
+        # make sure the failure was cut to the byte limits and the error was not
+        failure: dict = suite_data['failure_details'][0]
+
+        assert suite_name == 's' and failure['text'].startswith('é' * 50) and failure['text'].endswith('é' * 50)
+        assert failure['text'].count('é') == 100 and failure['text_size'] == 2000
+        assert suite_data['error_details'][0] == {'message': 'e', 'text': 'small'}
+
+        # make sure the full text can be found from the reference
+        file_name, line = failure['text_spill'].split(':')
+
+        with gzip.open(tmp_path / file_name, 'rt', encoding='utf-8') as fp:
+            assert json.loads(fp.readlines()[int(line)]) == {'report': str(report_file), 'suite': 's', 'testcase': 't1', 'tag': 'failure',
+                                                             'field': 'text', 'text': huge}
+
+        # make sure the run budget cuts further without saving the text again
+        run_summary: dict = {suite_name: suite_data}
+
+        assert TextLimiter(100, 100, 50).apply(run_summary, str(tmp_path)) == 1
+        assert len(failure['text'].split('\n')[0].encode('utf-8')) <= 50 - len('emsmall') and failure['text_size'] == 2000
+        assert failure['text_spill'] == f'{file_name}:{line}' and not (tmp_path / TextLimiter.SPILL_FILE).exists()
+
+    # make sure the limits are part of the cache key
+    assert ReportParser(text_limiter=TextLimiter(100, 100)).get_fingerprint() != ReportParser().get_fingerprint()
+
+
+def test_history(tmp_path):
+    """
+    tests the cross-run test history and flakiness queries
+
+    :return:
+    """
+    # create the history
+    history = HistoryIndex(str(tmp_path / 'history.db'))
+
+    # the outcomes of a flaky test and a test that broke, over five runs
+    outcomes: list = [('passed', 'passed'), ('failure', 'passed'), ('passed', 'passed'), ('failure', 'failure'), ('passed', 'error')]
+
+    # record the runs, run 3 twice to make sure it is replaced
+    for run_id, (flaky, broken) in list(enumerate(outcomes)) + [(3, outcomes[3])]:
+        history.record_run(str(run_id), {'suite': {'names': ['test_flaky', 'test_broken'], 'outcomes': [flaky, broken], 'times': [1.0, 2.0]}})
+
+    # make sure the flaky test flips and the broken one is failing since run 3
+    flaky: dict = history.get_flakiness('suite', 'test_flaky')
+    assert (flaky['runs'], flaky['failures'], flaky['flips'], flaky['failing_since']) == (5, 2, 4, None)
+
+    broken: dict = history.get_flakiness('suite', 'test_broken')
+    assert (broken['runs'], broken['failures'], broken['flips'], broken['failing_since']) == (5, 2, 1, '3')
+
+    # make sure the look back is limited
+    assert [run_id for run_id, _, _ in history.get_recent_results('suite', 'test_flaky', 2)] == ['3', '4']
+
+
+def test_baseline_diff(tmp_path, monkeypatch):
+    """
+    tests the comparison of a run with a baseline run
+
+    :return:
+    """
+    # the baseline and current results
+    baseline_testcases: dict = {'suite': {'names': ['test_a', 'test_b', 'test_c', 'test_d'], 'outcomes': ['passed', 'failure', 'passed', 'passed'],
+                                          'times': [1.0, 1.0, 1.0, 10.0]}}
+    testcases: dict = {'suite': {'names': ['test_a', 'test_b', 'test_c', 'test_e'], 'outcomes': ['failure', 'passed', 'passed', 'error'],
+                                 'times': [1.0, 1.0, 5.0, 1.0]}}
+
+    # save the baseline in its run directory and load it back
+    os.makedirs(tmp_path / '1')
+
+    baseline = BaselineDiff(slower_ratio=2, slower_min_secs=1)
+    baseline.save(str(tmp_path / '1'), baseline_testcases)
+
+    source, loaded = baseline.load(str(tmp_path), '1')
+    assert source == 'file' and loaded == baseline_testcases
+
+    # a run that was never saved is not found
+    assert baseline.load(str(tmp_path), '2') == (None, {})
+
+    # compare the runs
+    diff: dict = baseline.compare(testcases, loaded)
+
+    assert diff['newly_failing'] == ['suite::test_a', 'suite::test_e']
+    assert diff['newly_passing'] == ['suite::test_b']
+    assert diff['slower'] == [{'test': 'suite::test_c', 'time': 5.0, 'baseline_time': 1.0}]
+    assert diff['missing_count'] == 1
+
+    # make sure a run's comparison is saved in its run directory and the summary only holds test suites
+    monkeypatch.setenv('FORENSICS_BASELINE_DIFF', 'true')
+    monkeypatch.setenv('FORENSICS_BASELINE_RUN_ID', '1')
+
+    os.makedirs(tmp_path / '2')
+
+    run_summary: dict = {'suite': {'name': 'suite', ReportParser.TESTCASES_KEY: testcases['suite']}}
+
+    Forensics(db_info=object()).diff_baseline('2', str(tmp_path / '2'), None, run_summary)
+    assert list(run_summary.keys()) == ['suite']
+    with open(tmp_path / '2' / BaselineDiff.DIFF_FILE, encoding='utf-8') as fp:
+        assert json.load(fp) == {'baseline_run_id': '1', 'source': 'file', **diff}
+
+
+def test_timing_stats():
+    """
+    tests the testcase timing statistics
+
+    :return:
+    """
+    # 100 testcases taking 1.1 to 100.1 seconds, in no particular order
+    times: list = [(index * 37) % 100 + 1.1 for index in range(100)]
+
+    # get the statistics
+    stats: dict = TimingStats(3).get_stats({'names': [f'test_{int(duration)}' for duration in times], 'outcomes': ['passed'] * 100,
+                                            'times': times})
+
+    # make sure of the values, without any loss of precision
+    assert (stats['count'], stats['total'], stats['max'], stats['p50'], stats['p95']) == (100, 5060.0, 100.1, 50.1, 95.1)
+    assert stats['slowest'] == [{'name': 'test_100', 'time': 100.1}, {'name': 'test_99', 'time': 99.1}, {'name': 'test_98', 'time': 98.1}]
+
+    # no testcases, no statistics
+    assert not TimingStats().get_stats({'names': [], 'outcomes': [], 'times': []})
+
+
+def test_shard_planner(tmp_path, monkeypatch):
+    """
+    tests the balancing of tests over executors
+
+    :return:
+    """
+    # the test durations, test_f has never been timed
+    durations: dict = {'test_a': 8.0, 'test_b': 7.0, 'test_c': 6.0, 'test_d': 5.0, 'test_e': 4.0}
+    current: dict = {'PROVIDER': ['test_a', 'test_b', 'test_c'], 'CONSUMER': ['test_d', 'test_e', 'test_f']}
+
+    # plan the tests over the executors
+    planner = ShardPlanner()
+    assignments, loads = planner.plan([test for tests in current.values() for test in tests], list(current.keys()), durations)
+
+    # the untimed test gets the median duration and everything is assigned once, longest first
+    assert assignments == {'PROVIDER': ['test_a', 'test_f', 'test_e'], 'CONSUMER': ['test_b', 'test_c', 'test_d']}
+    assert loads == {'PROVIDER': 18.0, 'CONSUMER': 18.0}
+
+    # the plan is better than what it replaces
+    assert max(loads.values()) < planner.get_makespan(current, durations) == 21.0
+
+    # make sure suites saved as executor:suite count towards the suite, whether the durations come from the history or the run
+    assert Forensics.get_test_durations({'test_a': 1.0, 'CONSUMER:test_a': 2.0, 'other:test_b': 3.0}, list(current.keys())) == \
+        {'test_a': 3.0, 'other:test_b': 3.0}
+
+    # make sure a plan is saved from the run's durations, and not when none of the tests were timed
+    monkeypatch.setenv('FORENSICS_SHARD_PLAN', 'true')
+
+    forensics = Forensics(db_info=object())
+    run_summary: dict = {'test_a': {ReportParser.TESTCASES_KEY: {'times': [1.0]}}, 'CONSUMER:test_a': {ReportParser.TESTCASES_KEY: {'times': [2.0]}}}
+
+    forensics.plan_shards(str(tmp_path), {'request_data': {'tests': {'PROVIDER': ['test_x'], 'CONSUMER': ['test_y']}}}, run_summary)
+    assert not (tmp_path / 'forensics-shard-plan.json').exists()
+
+    forensics.plan_shards(str(tmp_path), {'request_data': {'tests': {'PROVIDER': ['test_a'], 'CONSUMER': ['test_x']}}}, run_summary)
+    with open(tmp_path / 'forensics-shard-plan.json', encoding='utf-8') as fp:
+        assert json.load(fp) == {'PROVIDER': ['test_a'], 'CONSUMER': ['test_x']}
+
+
+def test_fake_db(tmp_path, monkeypatch):
+    """
+    tests the supervisor DB calls against the in-process stand-in DB, with and without injected failures
+
+    :return:
+    """
+    # start with no stand-in DBs
+    monkeypatch.setattr(FakeSupervisorDB, 'instances', {})
+
+    # save a run request to load
+    with open(tmp_path / 'run_defs.json', 'w', encoding='utf-8') as fp:
+        json.dump({'1': {'run_id': 1, 'request_group': 'group-1'}}, fp)
+
+    # use the stand-in, give up quickly when it can not be reached
+    for param, value in {'BACKEND': 'fake', 'FAKE_RUN_DEFS': str(tmp_path / 'run_defs.json'), 'RETRY_BASE_DELAY': '0',
+                         'RETRY_MAX_ATTEMPTS': '1', 'PREPARED_STATEMENTS': 'true', 'HEALTH_CHECK_INTERVAL': '0'}.items():
+        monkeypatch.setenv(f'IRODS_SV_DB_{param}', value)
+
+    # create the DB class
+    db_info = PGImplementation(('irods-sv',))
+
+    # make sure the run request is there and the run goes from pending to complete
+    assert db_info.get_run_def('1') == {'run_id': 1, 'request_group': 'group-1'}
+    assert db_info.get_run_status('group-1') == [{'run_id': '1', 'status': 'Pending'}]
+    assert db_info.update_run_results('1', {'Failed': 1}) == 0
+    assert db_info.get_run_status('group-1') == [{'run_id': '1', 'status': 'Complete'}]
+    assert FakeSupervisorDB.get_instance('irods-sv').get_results('1') == {'Failed': 1}
+
+    # make sure the details are copied in and replaced on a second save
+    for _ in range(2):
+        assert db_info.update_run_details('1', [('suite', 'failure_details', {'message': 'a\tb\n'})] * 3) == 3
+
+    assert FakeSupervisorDB.get_instance('irods-sv').db.execute('SELECT COUNT(*) FROM run_result_details').fetchone()[0] == 3
+
+    # make sure a run id that does not fit the table is refused up front
+    assert db_info.update_run_details('run-1', [('suite', 'failure_details', {'message': 'm'})]) == -1
+
+    # drop every statement and make sure the error is returned once the retries are used up
+    FakeSupervisorDB.get_instance('irods-sv').failure_rate = 1.0
+
+    assert db_info.get_run_def('1') == -1
+    assert FakeSupervisorDB.get_instance('irods-sv').get_stats()['failures'] > 0
+
+
+def test_statement_errors(monkeypatch):
+    """
+    tests that only a lost connection gets a new connection and a retry
+
+    :return:
+    """
+    # use a new stand-in DB, checking the connection only when it is first made
+    monkeypatch.setattr(FakeSupervisorDB, 'instances', {})
+    monkeypatch.setenv('IRODS_SV_DB_BACKEND', 'fake')
+    monkeypatch.setenv('IRODS_SV_DB_HEALTH_CHECK_INTERVAL', '-1')
+
+    # create the DB class
+    db_info = PGImplementation(('irods-sv',))
+    fake_db: FakeSupervisorDB = FakeSupervisorDB.get_instance('irods-sv')
+
+    # make every supervisor DB function time out
+    calls: list = []
+
+    def time_out(function_name, params):
+        calls.append((function_name, params))
+        raise psycopg2.extensions.QueryCanceledError('canceling statement due to statement timeout')
+
+    monkeypatch.setattr(fake_db, 'call_function', time_out)
+
+    # make sure the statement is not sent again and the connection is kept
+    connects: int = fake_db.get_stats()['connects']
+
+    assert db_info.update_run_results('1', {'Failed': 1}) == -1
+    assert len(calls) == 1 and fake_db.get_stats()['connects'] == connects and not db_info.dbs['irods-sv'].conn.closed
+
+    # make sure the errors are told apart
+    conn = fake_db.connect()
+
+    assert not PGUtilsMultiConnect.is_connection_error(conn, psycopg2.extensions.QueryCanceledError('timeout'))
+    assert PGUtilsMultiConnect.is_connection_error(conn, psycopg2.OperationalError('server closed the connection unexpectedly'))
+    assert PGUtilsMultiConnect.is_connection_error(None, psycopg2.OperationalError('could not connect to server'))
+
+    conn.close()
+
+    assert PGUtilsMultiConnect.is_connection_error(conn, psycopg2.extensions.QueryCanceledError('timeout'))
+
+    # make sure the stand-in keeps its single connection when a pool is asked for
+    assert not db_info.enable_pool('irods-sv', 4) and not db_info.pools
+
+
+def test_pool_checkout(monkeypatch):
+    """
+    tests that pooled connections are checked on checkout and new ones are retried with backoff
+
+    :return:
+    """
+    # use a new stand-in DB
+    monkeypatch.setattr(FakeSupervisorDB, 'instances', {})
+
+    fake_db: FakeSupervisorDB = FakeSupervisorDB.get_instance('irods-sv')
+
+    class StubPool:
+        """
+        stands in for the psycopg2 pool, handing out stand-in connections
+        """
+        def __init__(self):
+            self.idle: list = []
+
+        def getconn(self):
+            """ hands out an idle connection or a new one """
+            return self.idle.pop() if self.idle else fake_db.connect()
+
+        def putconn(self, conn, close=False):
+            """ takes a connection back """
+            if close:
+                conn.close()
+            else:
+                self.idle.append(conn)
+
+        def closeall(self):
+            """ forgets the idle connections """
+            self.idle.clear()
+
+    # create a pool that checks every connection that has been used before
+    pool: PGConnectionPool = PGConnectionPool('irods-sv', '', 1, 2, RetryPolicy(0, 0, 2), logging.getLogger(__name__), True, 1.0, 0)
+    pool.pool = StubPool()
+
+    # check out two connections and give them back
+    first = pool.getconn()
+    second = pool.getconn()
+
+    pool.putconn(first)
+    pool.putconn(second)
+
+    # restart the DB, the idle connections are now dead
+    fake_db.failure_rate = 1.0
+
+    # make sure both dead connections are thrown away and a new one is made
+    conn = pool.getconn()
+
+    assert conn not in (first, second) and first.closed and second.closed and pool.get_stats()['stale'] == 2
+
+    pool.putconn(conn, close=True)
+
+    # make sure the connection is retried with backoff and then given up on after two attempts
+    fake_db.connect_failure_rate = 1.0
+    connects: int = fake_db.get_stats()['connects']
+
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+
+    assert fake_db.get_stats()['connects'] == connects + 2 and pool.get_stats()['in_use'] == 0
+
+    # make sure connections used within the interval are not checked
+    fake_db.failure_rate = fake_db.connect_failure_rate = 0.0
+    pool.idle_times.check_interval = 60
+
+    conn = pool.getconn()
+    pool.putconn(conn)
+
+    statements: int = fake_db.get_stats()['statements']
+
+    assert pool.getconn() is conn and fake_db.get_stats()['statements'] == statements
+
+    # make sure a lost connection elsewhere gets the idle ones checked
+    pool.putconn(conn)
+    pool.check_idle()
+    fake_db.failure_rate = 1.0
+
+    assert pool.getconn() is not conn and conn.closed
+
+
+def test_run_metrics(tmp_path):
+    """
+    tests the run metrics stage timings and counters
+
+    :return:
+    """
+    # make sure nothing is recorded when there are no current run metrics
+    with metrics.stage('parse'):
+        metrics.count('testcases', 5)
+
+    assert metrics.get_current() is None
+
+    # make some current
+    token = metrics.current_metrics.set(metrics.RunMetrics('1'))
+
+    try:
+        # record a stage twice and a counter, once in another thread with a copy of the context
+        for _ in range(2):
+            with metrics.stage('parse'):
+                metrics.count('testcases', 5)
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pool.submit(contextvars.copy_context().run, metrics.count, 'testcases').result()
+
+        # get the record
+        record: dict = metrics.get_current().write(str(tmp_path / 'metrics.json'))
+
+        # make sure it was all recorded and saved
+        assert record['stages']['parse']['calls'] == 2 and record['counters'] == {'testcases': 11}
+
+        with open(tmp_path / 'metrics.json', encoding='utf-8') as fp:
+            assert json.load(fp)['counters'] == {'testcases': 11}
+
+        # make sure the textfile is written
+        metrics.get_current().write(str(tmp_path / 'metrics.prom'))
+
+        with open(tmp_path / 'metrics.prom', encoding='utf-8') as fp:
+            assert 'forensics_count{name="testcases"} 11\n' in fp.read()
+    finally:
+        metrics.current_metrics.reset(token)
+
+
+def test_run_profiler(tmp_path):
+    """
+    tests the run profiler reports
+
+    :return:
+    """
+    # create the profiler, keep the reports short
+    run_profiler = RunProfiler(top_n=5)
+
+    # profile some work here and in another thread, with a memory snapshot in between
+    run_profiler.start()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert pool.submit(run_profiler.call, sorted, range(1000, 0, -1)).result()[0] == 1
+
+    run_profiler.snapshot('parse')
+
+    # write the reports
+    run_profiler.stop(str(tmp_path))
+
+    # make sure the profile and the snapshot were saved, with the lists cut to size
+    assert os.path.getsize(tmp_path / 'forensics-profile.pstats') > 0
+
+    with open(tmp_path / 'forensics-profile.txt', encoding='utf-8') as fp:
+        assert 'due to restriction <5>' in fp.read()
+
+    with open(tmp_path / 'forensics-memory.txt', encoding='utf-8') as fp:
+        lines: list = fp.read().splitlines()
+
+    assert lines[0].startswith('== parse') and len(lines) <= 6
+
+
+def test_async_logging(tmp_path):
+    """
+    tests writing the log output on a background thread
+
+    :return:
+    """
+    # create a logger that writes in the background
+    logger = LoggingUtil.init_logging('test-async', level=logging.DEBUG, line_format='minimum', log_file_path=str(tmp_path), async_mode=True)
+
+    # log a few things, the arguments are rendered when the call is made
+    args: list = ['before']
+    logger.debug('message %s', args)
+    args[0] = 'after'
+
+    # write out everything queued
+    LoggingUtil.stop_listeners()
+
+    with open(tmp_path / 'test-async.log', encoding='utf-8') as fp:
+        assert fp.read() == "message ['before']\n"
+
+    # make sure records are dropped when the queue is full and the policy is to drop them
+    handler = BoundedQueueHandler(queue.Queue(1), 'drop')
+
+    for _ in range(3):
+        handler.handle(logging.makeLogRecord({'msg': 'message'}))
+
+    assert handler.dropped == 2
+
+
+def test_json_logging():
+    """
+    tests the JSON log format and the log context fields
+
+    :return:
+    """
+    # create a record the way a logger with the context filter does, inside a run's log context
+    token = LoggingUtil.set_context(run_id='1', stage='wait')
+
+    try:
+        record = logging.makeLogRecord({'name': 'test', 'levelno': logging.INFO, 'levelname': 'INFO', 'msg': 'found %s', 'args': ('"x"',)})
+        ContextFilter().filter(record)
+    finally:
+        LoggingUtil.reset_context(token)
+
+    # format it and make sure the fields are all there
+    line: dict = json.loads(JsonFormatter().format(record))
+
+    assert (line['message'], line['run_id'], line['stage'], line['level']) == ('found "x"', '1', 'wait', 'INFO')
+    assert line['time'].endswith('Z') and 'exception' not in line
+
+    # make sure the context is put back
+    ContextFilter().filter(record)
+
+    assert not record.context
+
+
+def test_backoff_poller(tmp_path):
+    """
+    tests the wait loop check intervals and the end of testing marker check
+
+    :return:
+    """
+    # make sure the intervals back off to the cap and start over on a reset
+    poller = BackoffPoller(time.monotonic() + 600, 1, 4, 2)
+
+    assert [poller.next_interval() for _ in range(5)] == [1, 2, 4, 4, 4]
+
+    poller.reset()
+
+    assert poller.next_interval() == 1
+
+    # make sure the intervals never go past the deadline
+    assert BackoffPoller(time.monotonic() + 0.5, 1, 4, 2).next_interval() <= 0.5
+
+    # make sure the intervals close in on the expected end
+    poller = BackoffPoller(time.monotonic() + 600, 1, 15, 2, expected_duration=10)
+
+    assert 4 < poller.next_interval() <= 5
+
+    # make sure the marker is only found once it is there, and not for a missing run directory
+    assert Forensics.get_tests_done(str(tmp_path), 'PROVIDER') == ReturnCodes.TEST_RESULTS_NOT_FOUND
+    assert Forensics.get_tests_done(str(tmp_path / 'missing'), 'PROVIDER') == ReturnCodes.TEST_RESULTS_NOT_FOUND
+
+    with open(tmp_path / 'PROVIDER_tests.complete', 'w', encoding='utf-8'):
+        pass
+
+    assert Forensics.get_tests_done(str(tmp_path), 'PROVIDER') == ReturnCodes.TEST_RESULTS_FOUND
+
+
+def test_service_requests(tmp_path, monkeypatch):
+    """
+    tests the service claiming, re-queueing and completing run requests
+
+    :return:
+    """
+    class StubDB:
+        """
+        stands in for the irods-sv DB, noting the pools asked for
+        """
+        db_names: tuple = ('irods-sv',)
+
+        def __init__(self):
+            self.pools: dict = {}
+
+        def enable_pool(self, db_name, pool_max):
+            """ notes the pool size asked for """
+            self.pools[db_name] = pool_max
+
+            return True
+
+    class StubForensics:
+        """
+        stands in for the forensics object, failing runs with no run directory
+        """
+        app_version: str = 'test'
+        settings: ForensicsSettings = ForensicsSettings(watch_mode='poll')
+        logger = logging.getLogger(__name__)
+
+        def __init__(self):
+            self.db_info = StubDB()
+            self.runs: list = []
+
+        def run(self, run_id, run_dir):
+            """ notes the run """
+            self.runs.append(run_id)
+
+            if not os.path.isdir(run_dir):
+                raise FileNotFoundError(run_dir)
+
+            return ReturnCodes.EXIT_CODE_SUCCESS
+
+    # create the service on a spool directory
+    monkeypatch.setenv('FORENSICS_SPOOL_DIR', str(tmp_path))
+    monkeypatch.setenv('FORENSICS_SERVICE_CONCURRENCY', '2')
+
+    forensics = StubForensics()
+    service = ForensicsService(forensics)
+
+    # make sure concurrent runs get a DB connection pool
+    assert forensics.db_info.pools == {'irods-sv': 2}
+
+    for dir_name in (service.working_dir, service.done_dir, service.failed_dir):
+        os.makedirs(dir_name)
+
+    # add requests, oldest first, and a file that is not a request
+    for index, request in enumerate(({'run_id': '1', 'run_dir': str(tmp_path)}, {'run_id': '2', 'run_dir': str(tmp_path / 'missing')},
+                                     {'run_dir': str(tmp_path)})):
+        (tmp_path / f'{index}.json').write_text(json.dumps(request), encoding='utf-8')
+        os.utime(tmp_path / f'{index}.json', ns=(index * 10 ** 9, index * 10 ** 9))
+
+    (tmp_path / 'new.json.tmp').write_text('{}', encoding='utf-8')
+
+    # make sure the oldest requests are claimed first, up to the number asked for
+    claimed: list = service.claim_requests(2)
+
+    assert claimed == [os.path.join(service.working_dir, '0.json'), os.path.join(service.working_dir, '1.json')]
+    assert not service.claim_requests(0) and not (tmp_path / '0.json').exists()
+
+    # make sure claimed requests that were abandoned are put back
+    service.requeue_abandoned()
+
+    assert not os.listdir(service.working_dir) and (tmp_path / '1.json').exists()
+
+    # make sure each request ends up in the right place with the result
+    for request_file in service.claim_requests(3):
+        service.process_request(request_file)
+
+    assert forensics.runs == ['1', '2'] and not os.listdir(service.working_dir)
+    assert sorted(os.listdir(service.done_dir)) == ['0.json'] and sorted(os.listdir(service.failed_dir)) == ['1.json', '2.json']
+    assert json.loads((tmp_path / 'done' / '0.json').read_text(encoding='utf-8'))['ret_val'] == ReturnCodes.EXIT_CODE_SUCCESS
+    assert (tmp_path / 'new.json.tmp').exists()
+
+
+def test_report_cache(tmp_path, monkeypatch):
+    """
+    tests the report parse result cache hits, misses, damaged entries and eviction
+
+    :return:
+    """
+    # create a report and its parse result
+    report_file = tmp_path / 'report.xml'
+    report_file.write_text('<testsuite name="s"/>', encoding='utf-8')
+
+    result: list = [('s', {'name': 's'})]
+
+    cache = ReportCache(str(tmp_path / 'cache'), 1024 * 1024, 'settings')
+
+    # make sure nothing is found before it is saved, and the result is found with the mtime unchanged
+    assert cache.get(str(report_file)) is None
+
+    cache.put(str(report_file), result)
+
+    assert cache.get(str(report_file)) == result and cache.get_stats()['hits'] == 1
+
+    # touch the report and make sure the content digest still finds it and the new mtime is saved
+    os.utime(report_file, ns=(10 ** 9, 10 ** 9))
+
+    assert cache.get(str(report_file)) == result
+
+    with open(cache.get_entry_path(str(report_file)), 'rb') as fp:
+        assert json.loads(zlib.decompress(fp.read()))['mtime_ns'] == 10 ** 9
+
+    # make sure different content of the same size misses
+    report_file.write_text('<testsuite name="t"/>', encoding='utf-8')
+
+    assert cache.get(str(report_file)) is None
+
+    cache.put(str(report_file), result)
+
+    # make sure other parser settings or another entry version miss
+    assert ReportCache(str(tmp_path / 'cache'), 1024 * 1024, 'other settings').get(str(report_file)) is None
+
+    monkeypatch.setattr(ReportCache, 'VERSION', ReportCache.VERSION + 1)
+    assert cache.get(str(report_file)) is None
+    monkeypatch.undo()
+    assert cache.get(str(report_file)) == result
+
+    # make sure a damaged entry is a miss and is replaced on the next save
+    with open(cache.get_entry_path(str(report_file)), 'wb') as fp:
+        fp.write(b'not an entry')
+
+    assert cache.get(str(report_file)) is None
+    cache.put(str(report_file), result)
+    assert cache.get(str(report_file)) == result
+
+    # fill a small cache, each entry last used in the order saved
+    cache = ReportCache(str(tmp_path / 'small'), 1024 * 1024, 'settings')
+    report_files: list = []
+
+    for index in range(4):
+        report_files.append(tmp_path / f'report_{index}.xml')
+        report_files[-1].write_text(f'<testsuite name="s{index}"/>', encoding='utf-8')
+
+    entry_size: int = 0
+
+    for index, file in enumerate(report_files):
+        cache.put(str(file), [(f's{index}', {'text': 'x' * 100})])
+
+        os.utime(cache.get_entry_path(str(file)), ns=(index * 10 ** 9, index * 10 ** 9))
+
+        entry_size = os.path.getsize(cache.get_entry_path(str(file)))
+
+    # use the oldest one again, then shrink the cache so only two entries fit under 90% of it
+    assert cache.get(str(report_files[0])) is not None
+
+    cache.max_bytes = int(entry_size * 2.5)
+    cache.evict()
+
+    # make sure the least recently used entries went and the cache is under its limit
+    assert [os.path.exists(cache.get_entry_path(str(file))) for file in report_files] == [True, False, False, True]
+    assert cache.total_bytes <= cache.max_bytes
+
+
+def test_report_tracker(tmp_path):
+    """
+    tests that the report tracker only parses reports that have stopped changing and settled
+
+    :return:
+    """
+    # start a report that is still being written
+    report_file = tmp_path / 'report.xml'
+    report_file.write_text('<testsuite name="s" tests="1">', encoding='utf-8')
+
+    tracker = ReportTracker(str(tmp_path), ReportParser('stream', 1), 60)
+
+    # make sure a report is not parsed on the first sighting or while it keeps changing
+    assert tracker.poll() == 0
+    report_file.write_text('<testsuite name="s" tests="1"><testcase classname="a" name="t" time="1"/></testsuite>', encoding='utf-8')
+    assert tracker.poll() == 0 and not tracker.parsed
+
+    # make sure a report that stopped changing is not parsed until it has been quiet for the settle time
+    assert tracker.poll() == 0 and not tracker.parsed
+
+    settled: float = time.time() - 120
+    os.utime(report_file, (settled, settled))
+
+    assert tracker.poll() == 0 and tracker.poll() == 1 and str(report_file) in tracker.parsed and not tracker.pending
+
+    # make sure a parsed report is not parsed again, and one rewritten after it was parsed is parsed again at the end
+    assert tracker.poll() == 0
+    report_file.write_text('<testsuite name="t"/>', encoding='utf-8')
+    assert tracker.collect([str(report_file)])[0][0][0] == 't'
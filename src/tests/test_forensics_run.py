@@ -0,0 +1,60 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Forensics run tests, against the in-process stand-in for the supervisor DB.
+"""
+import os
+import json
+
+from src.forensics.forensics import Forensics
+from src.common.enum_utils import ReturnCodes
+from src.common.pg_fake import FakeSupervisorDB
+
+
+def test_run_executors(tmp_path, monkeypatch):
+    """
+    tests that the executors of a run are processed together, their summaries merged and persisted, and that one executor's
+    failure is the run's result
+
+    :return:
+    """
+    # start with no stand-in DBs
+    monkeypatch.setattr(FakeSupervisorDB, 'instances', {})
+
+    # save two runs with the same test requested of both executors
+    with open(tmp_path / 'run_defs.json', 'w', encoding='utf-8') as fp:
+        json.dump({run_id: {'run_id': int(run_id), 'request_data': {'tests': {'PROVIDER': ['s1'], 'CONSUMER': ['s1'], 'TOPOLOGY': []}}}
+                   for run_id in ('1', '2')}, fp)
+
+    # use the stand-in and do not wait long for anything
+    for param, value in {'IRODS_SV_DB_BACKEND': 'fake', 'IRODS_SV_DB_FAKE_RUN_DEFS': str(tmp_path / 'run_defs.json'), 'FORENSICS_MAX_WAIT': '5',
+                         'FORENSICS_CHECK_MIN_INTERVAL': '0.1', 'FORENSICS_CHECK_INTERVAL': '0.1', 'FORENSICS_PARSE_WORKERS': '1'}.items():
+        monkeypatch.setenv(param, value)
+
+    # write the reports of both executors, each with a suite named s1, and the end of testing markers
+    for run_id in ('1', '2'):
+        for executor, tests in (('PROVIDER', 1), ('CONSUMER', 2)):
+            # the second run's consumer produced no reports
+            if run_id == '1' or executor == 'PROVIDER':
+                os.makedirs(tmp_path / 'data' / run_id / executor / 'test-reports')
+
+                (tmp_path / 'data' / run_id / executor / 'test-reports' / 'report.xml').write_text(
+                    f'<testsuite name="s1" tests="{tests}">' + '<testcase name="t" time="1"/>' * tests + '</testsuite>', encoding='utf-8')
+
+            (tmp_path / 'data' / run_id / f'{executor}_tests.complete').write_text('', encoding='utf-8')
+
+    forensics = Forensics()
+
+    # make sure both executors' summaries are saved, the suite name used by both kept apart
+    assert forensics.run('1', str(tmp_path / 'data')) == ReturnCodes.EXIT_CODE_SUCCESS
+
+    results: dict = FakeSupervisorDB.get_instance('irods-sv').get_results('1')
+
+    assert list(results.keys()) == ['s1', 'CONSUMER:s1']
+    assert (results['s1']['tests'], results['CONSUMER:s1']['tests']) == ('1', '2')
+
+    # make sure the executor with no reports fails the run
+    assert forensics.run('2', str(tmp_path / 'data')) == ReturnCodes.ERROR_NO_RESULT_DIR
+    assert FakeSupervisorDB.get_instance('irods-sv').get_results('2') == {'Error': ReturnCodes.ERROR_NO_RESULT_DIR}
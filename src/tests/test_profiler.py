@@ -0,0 +1,36 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Run profiler tests.
+"""
+import tracemalloc
+
+from src.forensics.profiler import RunProfiler
+
+
+def test_overlapping_profilers(tmp_path):
+    """
+    tests that memory tracing carries on until the last of several overlapping run profilers stops
+
+    :return:
+    """
+    # start two runs' profilers, as the service does with concurrent runs
+    profilers: list = [RunProfiler(cpu=False), RunProfiler(cpu=False)]
+
+    for run_profiler in profilers:
+        run_profiler.start()
+
+    # make sure the second run still gets its snapshot after the first one stops
+    profilers[0].stop(str(tmp_path))
+
+    assert tracemalloc.is_tracing()
+
+    profilers[1].snapshot('parse')
+    profilers[1].stop(str(tmp_path))
+
+    assert profilers[1].snapshots and profilers[1].snapshots[0].startswith('== parse')
+
+    # make sure tracing is stopped once they are all done
+    assert not tracemalloc.is_tracing() and RunProfiler.tracing_count == 0
@@ -0,0 +1,45 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Report parser tests.
+"""
+import os
+
+from src.forensics.report_parser import ReportParser
+
+
+def test_parse_parallel(tmp_path):
+    """
+    tests that parsing a directory of reports through the process pool gives the same summaries, in file order, as parsing them
+    one at a time, and that too few files are parsed without the pool
+
+    :return:
+    """
+    # write reports with a failure in every other one
+    for index in range(8):
+        failure: str = f'<failure message="m{index}">trace {index}</failure>' if index % 2 else ''
+
+        (tmp_path / f'report_{index}.xml').write_text(f'<testsuite name="suite_{index}" tests="1"><testcase name="test_{index}" time="{index}">'
+                                                      f'{failure}</testcase></testsuite>', encoding='utf-8')
+
+    # get the reports in directory order
+    file_paths: list = [os.path.join(tmp_path, file) for file in sorted(os.listdir(tmp_path))]
+
+    # parse them one at a time
+    serial: list = ReportParser('stream').parse_files(file_paths)
+
+    assert [result[0][0] for result in serial] == [f'suite_{index}' for index in range(8)]
+
+    try:
+        # start without a pool
+        ReportParser.shutdown_pool()
+
+        # make sure the pool is not started for fewer files than the threshold
+        assert ReportParser('stream', workers=2, parallel_threshold=10).parse_files(file_paths) == serial and ReportParser.pool is None
+
+        # make sure the pool gives the same summaries in the same order
+        assert ReportParser('stream', workers=2, parallel_threshold=2).parse_files(file_paths) == serial and ReportParser.pool is not None
+    finally:
+        ReportParser.shutdown_pool()
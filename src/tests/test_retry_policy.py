@@ -0,0 +1,30 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Retry policy tests.
+"""
+import time
+
+from src.common.retry_policy import RetryPolicy
+
+
+def test_retry_deadline():
+    """
+    tests that the retry deadline counts from the first attempt, not the first failure
+
+    :return:
+    """
+    # allow retries for a fifth of a second
+    policy = RetryPolicy(0.01, 0.01, 0, 0.2)
+
+    # make sure a first attempt that takes up the deadline gets no retries
+    delays = policy.delays()
+
+    time.sleep(0.25)
+
+    assert next(delays, None) is None
+
+    # make sure a quick failure is retried
+    assert 0 < next(policy.delays()) <= 0.01
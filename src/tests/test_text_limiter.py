@@ -0,0 +1,36 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Text limiter tests.
+"""
+import gzip
+
+from src.forensics.text_limiter import TextLimiter
+
+
+def test_run_budget(tmp_path):
+    """
+    tests that the text kept over a run with many failures stays within the run budget
+
+    :return:
+    """
+    # create a summary with many failures
+    run_summary: dict = {'test_suite': {'name': 'test_suite', 'failure_details': [{'message': f'm{index}', 'text': 't' * 1000}
+                                                                                  for index in range(500)]}}
+
+    # keep 4 KB of text over the run
+    count: int = TextLimiter(run_budget=4096).apply(run_summary, str(tmp_path))
+
+    # get the text kept
+    failures: list = run_summary['test_suite']['failure_details']
+    kept: int = sum(len(failure[field].encode('utf-8')) for failure in failures for field in TextLimiter.FIELDS)
+
+    # make sure the text is within the budget, give or take the one cut marker, and the rest of the fields are empty
+    assert kept <= 4096 + 64 and count > 900
+    assert failures[-1] == {'message': '', 'text': '', 'message_size': 4, 'text_size': 1000}
+
+    # make sure the full text of every field that was cut is still saved
+    with gzip.open(tmp_path / TextLimiter.SPILL_FILE, 'rt', encoding='utf-8') as fp:
+        assert len(fp.readlines()) == count
@@ -0,0 +1,103 @@
+# BSD 3-Clause All rights reserved.
+#
+# SPDX-License-Identifier: BSD 3-Clause
+
+"""
+    Directory watcher tests.
+"""
+import time
+import threading
+
+import pytest
+
+from src.forensics.watcher import DirectoryWatcher
+
+
+def create_later(file_path, delay: float):
+    """
+    creates a file after a delay, on another thread
+
+    :return: The thread.
+    """
+    # start the thread
+    thread = threading.Thread(target=lambda: (time.sleep(delay), file_path.write_text('done', encoding='utf-8')))
+    thread.start()
+
+    # return to the caller
+    return thread
+
+
+def test_watch_notify(tmp_path):
+    """
+    tests that a wait ends soon after a file is created, and on the timeout when nothing happens
+
+    :return:
+    """
+    with DirectoryWatcher(str(tmp_path)) as watcher:
+        # notification is only available on local linux file systems
+        if not watcher.active:
+            pytest.skip('change notification is not available here')
+
+        # make sure the wait ends on the change, well before the timeout
+        thread = create_later(tmp_path / 'PROVIDER_tests.complete', 0.2)
+
+        start: float = time.monotonic()
+        assert watcher.wait(10) and time.monotonic() - start < 5
+
+        thread.join()
+
+        # drain the events of the rest of the write
+        while watcher.wait(0.05):
+            pass
+
+        # make sure the wait times out with no changes
+        start = time.monotonic()
+        assert not watcher.wait(0.2) and time.monotonic() - start >= 0.2
+
+
+def test_watch_poll(tmp_path, monkeypatch):
+    """
+    tests the fall back to sleeping on network file systems, in poll mode and until the directory exists
+
+    :return:
+    """
+    # make sure a directory on a network file system is polled
+    monkeypatch.setattr(DirectoryWatcher, 'is_network_fs', classmethod(lambda cls, path: True))
+
+    with DirectoryWatcher(str(tmp_path)) as watcher:
+        assert not watcher.active and watcher.notify_disabled
+
+        start: float = time.monotonic()
+        assert not watcher.wait(0.2) and time.monotonic() - start >= 0.2
+
+    monkeypatch.undo()
+
+    # make sure poll mode never watches
+    with DirectoryWatcher(str(tmp_path), 'poll') as watcher:
+        assert not watcher.start() and not watcher.wait(0.1)
+
+    # make sure a directory that does not exist yet is polled, and watched once it is created
+    with DirectoryWatcher(str(tmp_path / 'run')) as watcher:
+        assert not watcher.active and not watcher.notify_disabled and not watcher.wait(0.1)
+
+        (tmp_path / 'run').mkdir()
+
+        assert watcher.start() == (DirectoryWatcher.get_libc() is not None and not DirectoryWatcher.is_network_fs(str(tmp_path)))
+
+
+def test_network_fs(tmp_path):
+    """
+    tests the network file system detection against a mount table
+
+    :return:
+    """
+    # write a mount table with a local root, an NFS mount and a FUSE mount with a space in its name
+    mounts_file = tmp_path / 'mounts'
+    mounts_file.write_text('/dev/sda1 / ext4 rw 0 0\nserver:/data /data nfs4 rw 0 0\nsshfs /mnt/my\\040share fuse.sshfs rw 0 0\nbad\n',
+                           encoding='utf-8')
+
+    # make sure the longest matching mount point decides
+    assert DirectoryWatcher.is_network_fs('/data/run/1', str(mounts_file))
+    assert DirectoryWatcher.is_network_fs('/mnt/my share/run', str(mounts_file))
+    assert not DirectoryWatcher.is_network_fs('/database', str(mounts_file))
+    assert not DirectoryWatcher.is_network_fs('/data', str(tmp_path / 'missing'))